@@ -1,7 +1,8 @@
 """
 ASGI config for aistarterkit project.
 
-It exposes the ASGI callable as a module-level variable named ``application``.
+It exposes the ASGI callable as a module-level variable named ``application``,
+and ``api_application``, which serves only the async API passthrough.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -14,3 +15,20 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'aistarterkit.settings')
 
 application = get_asgi_application()
+
+# Under ASGI, Django buffers the whole response of a streaming sync view (e.g.
+# the chat page's replies) before sending it, so only the async API endpoints
+# are served here and every other path is left to the WSGI application
+API_PATH_PREFIX = '/chat/api/v1/'
+
+
+async def api_application(scope, receive, send):
+    if scope['type'] == 'http' and not scope['path'].startswith(API_PATH_PREFIX):
+        await send({
+            'type': 'http.response.start',
+            'status': 404,
+            'headers': [(b'content-type', b'text/plain; charset=utf-8')],
+        })
+        await send({'type': 'http.response.body', 'body': b'Not Found'})
+        return
+    await application(scope, receive, send)
@@ -10,10 +10,13 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import json
 import os
 from pathlib import Path
 from dotenv import load_dotenv
 
+from chat.db import sqlite_pragmas
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -117,13 +120,47 @@ os.makedirs(sqlite_storage_path, exist_ok=True)
 db_path = Path(sqlite_storage_path) / "db.sqlite3"
 
 
-CHROMADB_STORAGE_PATH = os.getenv("CHROMADB_STORAGE_PATH")
+CHROMADB_STORAGE_PATH = os.getenv("CHROMADB_STORAGE_PATH") or str(
+    Path(BASE_DIR) / "db/chroma/"
+)
 
+# Documents added to a VectorCollection are embedded with this model (or Azure
+# deployment), in batches of at most VECTOR_EMBEDDING_BATCH_SIZE documents and
+# VECTOR_EMBEDDING_BATCH_TOKENS tokens per embeddings API call
+VECTOR_EMBEDDING_MODEL = os.getenv("VECTOR_EMBEDDING_MODEL", "text-embedding-3-small")
+VECTOR_EMBEDDING_BATCH_SIZE = int(os.getenv("VECTOR_EMBEDDING_BATCH_SIZE", "256"))
+VECTOR_EMBEDDING_BATCH_TOKENS = int(os.getenv("VECTOR_EMBEDDING_BATCH_TOKENS", "100000"))
+
+
+# SQLite tuning applied to every new connection (see chat/db.py). Write-ahead
+# logging lets readers run while a writer commits, and writers wait up to
+# SQLITE_BUSY_TIMEOUT milliseconds for the write lock instead of failing with
+# "database is locked". Set SQLITE_PERFORMANCE_MODE=false for SQLite's
+# defaults, e.g. on a network file system where WAL is not supported.
+SQLITE_PERFORMANCE_MODE = os.getenv("SQLITE_PERFORMANCE_MODE", "true").lower() == "true"
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-64000"))  # KiB if negative
+
+# Seconds a database connection is reused across requests (0 to close it
+# after each request); each worker thread keeps its own connection
+DB_CONN_MAX_AGE = int(os.getenv("DB_CONN_MAX_AGE", "600"))
 
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": str(db_path),
+        "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+        "PRAGMAS": sqlite_pragmas(
+            synchronous=SQLITE_SYNCHRONOUS,
+            busy_timeout=SQLITE_BUSY_TIMEOUT,
+            mmap_size=SQLITE_MMAP_SIZE,
+            cache_size=SQLITE_CACHE_SIZE,
+        )
+        if SQLITE_PERFORMANCE_MODE
+        else {},
     }
 }
 
@@ -192,6 +229,132 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 
+# Agent context window settings (in tokens). The history sent with each
+# message is trimmed to fit AGENT_HISTORY_TOKENS (or the thread's own limit)
+# and whatever the model's context window leaves after the prompt and reply.
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-35-turbo-16k": 16384,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+DEFAULT_CONTEXT_WINDOW = int(os.getenv("DEFAULT_CONTEXT_WINDOW", "8192"))
+AGENT_HISTORY_TOKENS = int(os.getenv("AGENT_HISTORY_TOKENS", "8000"))
+AGENT_REPLY_TOKENS = int(os.getenv("AGENT_REPLY_TOKENS", "1024"))
+
+# Opt-in per-process cache of agent replies, served for messages whose
+# embedding is at least SEMANTIC_CACHE_THRESHOLD similar to an answered one
+# sent with the same prompt and history (maximum replies and seconds kept)
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+SEMANTIC_CACHE_EMBEDDING_MODEL = os.getenv(
+    "SEMANTIC_CACHE_EMBEDDING_MODEL", "text-embedding-3-small"
+)
+
+# Per-process cache of thread histories (number of threads and seconds kept)
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "256"))
+HISTORY_CACHE_TTL = int(os.getenv("HISTORY_CACHE_TTL", "600"))
+
+# Number of messages thread pages render at once (older ones load on scroll)
+THREAD_MESSAGES_PAGE_SIZE = int(os.getenv("THREAD_MESSAGES_PAGE_SIZE", "50"))
+
+# Number of threads the sidebar lists at once, and users whose list is cached
+SIDEBAR_THREADS = int(os.getenv("SIDEBAR_THREADS", "50"))
+SIDEBAR_CACHE_SIZE = int(os.getenv("SIDEBAR_CACHE_SIZE", "1024"))
+
+# Queue chat messages and write them in batches from a background thread
+# (maximum turns per transaction and seconds between flushes)
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "false").lower() == "true"
+MESSAGE_WRITE_BEHIND_BATCH_SIZE = int(os.getenv("MESSAGE_WRITE_BEHIND_BATCH_SIZE", "100"))
+MESSAGE_WRITE_BEHIND_INTERVAL = float(os.getenv("MESSAGE_WRITE_BEHIND_INTERVAL", "0.2"))
+
+# Per-process cache of authenticated API tokens (number of tokens and seconds kept)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "60"))
+
+# Upstream HTTP client settings (connection pool size per host and timeouts in seconds)
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "10"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "120"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+UPSTREAM_ASYNC_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_ASYNC_MAX_CONNECTIONS", "1000"))
+
+# More upstream endpoints to balance requests over, as a JSON list of
+# {"endpoint": ..., "api_key": ..., "deployments": [...]} objects (deployments
+# is optional). An endpoint failing UPSTREAM_BREAKER_FAILURES requests in a
+# row is ejected for UPSTREAM_BREAKER_COOLDOWN seconds.
+UPSTREAM_ENDPOINTS = json.loads(os.getenv("UPSTREAM_ENDPOINTS", "[]"))
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_COOLDOWN = float(os.getenv("UPSTREAM_BREAKER_COOLDOWN", "30"))
+
+# Retries of rate limited (429), failed (5xx) and unconnected upstream
+# requests, with jittered exponential backoff (seconds). A Retry-After longer
+# than UPSTREAM_RETRY_MAX_BACKOFF is not waited for.
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.5"))
+UPSTREAM_RETRY_MAX_BACKOFF = float(os.getenv("UPSTREAM_RETRY_MAX_BACKOFF", "20"))
+
+# Adaptive limit of the requests each worker has in flight to an endpoint and
+# model: it starts at UPSTREAM_CONCURRENCY_MAX, shrinks when the upstream
+# throttles or slows down and grows back while it is healthy. Requests over
+# the limit wait up to UPSTREAM_QUEUE_TIMEOUT seconds.
+UPSTREAM_ADAPTIVE_CONCURRENCY = (
+    os.getenv("UPSTREAM_ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+)
+UPSTREAM_CONCURRENCY_MIN = int(os.getenv("UPSTREAM_CONCURRENCY_MIN", "1"))
+UPSTREAM_CONCURRENCY_MAX = int(os.getenv("UPSTREAM_CONCURRENCY_MAX", "100"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "10"))
+
+# Stream the agent's replies to the chat page as they are generated; when
+# false, the page posts each message and appends the rendered turn once the
+# reply is complete
+CHAT_STREAMING = os.getenv("CHAT_STREAMING", "true").lower() == "true"
+
+# Get the agent's replies to chat messages in `python manage.py run_jobs`
+# worker processes instead of the web workers, which return right away while
+# the page polls for the reply. A failed job is retried JOB_MAX_ATTEMPTS times
+# with exponential backoff starting at JOB_RETRY_DELAY seconds; a job whose
+# worker died is run again after JOB_VISIBILITY_TIMEOUT seconds, by default a
+# minute more than the slowest reply the upstream timeouts and retries allow,
+# so a job still running is never run twice. Finished jobs are deleted after
+# JOB_RETENTION seconds.
+CHAT_BACKGROUND_JOBS = os.getenv("CHAT_BACKGROUND_JOBS", "false").lower() == "true"
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "2"))
+JOB_SLOWEST_REPLY = (
+    UPSTREAM_QUEUE_TIMEOUT
+    + (UPSTREAM_CONNECT_TIMEOUT + UPSTREAM_READ_TIMEOUT) * (UPSTREAM_RETRIES + 1)
+    + UPSTREAM_RETRY_MAX_BACKOFF * UPSTREAM_RETRIES
+)
+JOB_VISIBILITY_TIMEOUT = int(
+    os.getenv("JOB_VISIBILITY_TIMEOUT", str(int(JOB_SLOWEST_REPLY) + 60))
+)
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "86400"))
+
+# Send a second copy of a non-streamed request still running after the 95th
+# percentile of recent latencies (but at least UPSTREAM_HEDGE_MIN_DELAY
+# seconds), and use whichever response arrives first
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "false").lower() == "true"
+UPSTREAM_HEDGE_MIN_DELAY = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "1"))
+
+# Serve the API passthrough endpoints with the async views (run under ASGI)
+ASYNC_PASSTHROUGH = os.getenv("ASYNC_PASSTHROUGH", "false").lower() == "true"
+
+# Opt-in cache of deterministic (temperature 0) API passthrough responses,
+# stored in a SQLite file (maximum responses and seconds kept)
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_PATH = os.getenv(
+    "RESPONSE_CACHE_PATH", str(Path(sqlite_storage_path) / "response_cache.sqlite3")
+)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+
+# Share one upstream call between identical deterministic requests in flight
+# at the same time (across workers too when RESPONSE_CACHE is enabled)
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+
 AUTH_USER_MODEL = "chat.CustomUser"
 
 DEFAULT_ADMIN_USERNAME = os.getenv("DEFAULT_ADMIN_USERNAME")
@@ -0,0 +1,10 @@
+import { Controller } from "stimulus"
+
+export default class extends Controller {
+  // Replace the "Show more" button with the next page of threads
+  async more({ params: { url } }) {
+    const response = await fetch(url)
+    if (!response.ok) return
+    this.element.outerHTML = await response.text()
+  }
+}
@@ -1,16 +1,53 @@
 // chat/static/chat/js/controllers/thread_controller.js
 import { Controller } from "stimulus"
-import Idiomorph from 'idiomorph'
 import Prism from 'prismjs';
 
 export default class extends Controller {
-  static targets = ["form", "messageList", "messageInput", "emptyMessage"]
+  static targets = ["form", "messageList", "messageInput", "emptyMessage", "olderMessages"]
+  static values = { streamUrl: String }
 
   connect() {
     console.log("Connected to StimulusJS Thread Controller!")
     this.scrollToBottom()
   }
 
+  disconnect() {
+    if (this.olderObserver) this.olderObserver.disconnect()
+  }
+
+  // Load the previous page of messages when its placeholder scrolls into view
+  olderMessagesTargetConnected(element) {
+    if (!this.olderObserver) {
+      this.olderObserver = new IntersectionObserver(entries => {
+        entries.filter(entry => entry.isIntersecting).forEach(entry => {
+          this.olderObserver.unobserve(entry.target)
+          this.loadOlderMessages(entry.target)
+        })
+      })
+    }
+    this.olderObserver.observe(element)
+  }
+
+  olderMessagesTargetDisconnected(element) {
+    if (this.olderObserver) this.olderObserver.unobserve(element)
+  }
+
+  async loadOlderMessages(placeholder) {
+    const response = await fetch(placeholder.dataset.url)
+    if (!response.ok) {
+      placeholder.textContent = 'Failed to load earlier messages.'
+      return
+    }
+    const html = await response.text()
+
+    // Keep the messages in view from jumping as older ones are added above
+    const scroller = this.messageListTarget.parentElement
+    const previousHeight = scroller.scrollHeight
+    placeholder.outerHTML = html
+    scroller.scrollTop += scroller.scrollHeight - previousHeight
+    Prism.highlightAll()
+  }
+
   submit(event) {
     console.log("Submitting")
     event.preventDefault()
@@ -21,16 +58,16 @@ export default class extends Controller {
     }
 
     // Add user's message to the message list
-    this.messageListTarget.innerHTML += `
+    this.messageListTarget.insertAdjacentHTML('beforeend', `
       <div class="flex gap-4 p-6 border-b border-gray-200 text-gray-800 bg-gray-50">
         <i class="fas fa-user w-6 text-lg text-green-400"></i>
         <div>${this.escapeHTML(this.messageInputTarget.value)}</div>
       </div>
-    `
+    `)
 
     // Display loading indicator
-    this.messageListTarget.innerHTML += `
-      <div class="flex gap-4 p-6 border-b border-gray-200 text-gray-800 bg-gray-50">
+    this.messageListTarget.insertAdjacentHTML('beforeend', `
+      <div class="flex gap-4 p-6 border-b border-gray-200 text-gray-800" data-pending-reply>
         <i class="fas fa-robot w-6 text-lg text-indigo-400"></i>
         <div role="status">
           <svg class="animate-spin -ml-1 mr-3 h-5 w-5 text-blue-400" xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24">
@@ -40,38 +77,141 @@ export default class extends Controller {
           <span class="sr-only">Loading...</span>
         </div>
       </div>
-    `
+    `)
 
     // Scroll to the bottom
     this.scrollToBottom()
 
-    // Submit the form via AJAX
+    if (this.hasStreamUrlValue) {
+      this.streamReply()
+      this.messageInputTarget.value = ''
+      return
+    }
+
+    // Otherwise submit the form via AJAX and append the rendered messages of the turn
+    const reply = this.messageListTarget.lastElementChild
+    const pending = [reply.previousElementSibling, reply]
     fetch(this.formTarget.action, {
       method: 'POST',
       body: new FormData(this.formTarget),
       headers: {
-        'X-CSRFToken': this.formTarget.querySelector('[name=csrfmiddlewaretoken]').value
+        'X-CSRFToken': this.formTarget.querySelector('[name=csrfmiddlewaretoken]').value,
+        'X-Requested-With': 'XMLHttpRequest'
       }
     })
-      .then(response => response.text())
+      .then(response => {
+        if (!response.ok) throw new Error(response.statusText)
+        // 202: the reply is got by a background job, wait for it to finish
+        if (response.status === 202) return response.json().then(job => this.waitForJob(job.status_url))
+        return response.text()
+      })
       .then(html => {
-        const parser = new DOMParser()
-        const doc = parser.parseFromString(html, 'text/html')
+        const turn = document.createElement('template')
+        turn.innerHTML = html
+        const messages = Array.from(turn.content.children)
 
-        // Use idiomorph to only update the parts of the page that have changed
-        Idiomorph.morph(document.body, doc.body)
+        // Swap the optimistic message and loading indicator for the server-rendered turn
+        pending.forEach(element => element.remove())
+        this.messageListTarget.append(...messages)
 
-        // Defer the scrolling until after the browser has rendered the updated DOM
+        // Defer the scrolling until after the browser has rendered the new messages
         requestAnimationFrame(() => {
-          Prism.highlightAll()
+          messages.forEach(message => Prism.highlightAllUnder(message))
           this.scrollToBottom()
         })
       })
+      .catch(() => {
+        reply.querySelector('[role=status]').replaceWith('The assistant failed to respond.')
+      })
 
     // Clear out the textbox in the form
     this.messageInputTarget.value = ''
   }
 
+  // Poll a background job with backoff; resolves with its rendered messages
+  async waitForJob(statusUrl) {
+    let delay = 500
+    while (true) {
+      await new Promise(resolve => setTimeout(resolve, delay))
+      const response = await fetch(statusUrl)
+      if (!response.ok) throw new Error(response.statusText)
+      const job = await response.json()
+      if (job.status === 'done') return job.html
+      if (job.status === 'failed') throw new Error(job.error)
+      delay = Math.min(delay * 1.5, 5000)
+    }
+  }
+
+  async streamReply() {
+    const reply = this.messageListTarget.lastElementChild
+    const response = await fetch(this.streamUrlValue, {
+      method: 'POST',
+      body: new FormData(this.formTarget),
+      headers: {
+        'Accept': 'text/event-stream',
+        'X-CSRFToken': this.formTarget.querySelector('[name=csrfmiddlewaretoken]').value
+      }
+    })
+
+    const content = document.createElement('div')
+    content.className = 'whitespace-pre-wrap'
+
+    if (!response.ok) {
+      content.textContent = 'The assistant failed to respond.'
+      reply.querySelector('[role=status]').replaceWith(content)
+      return
+    }
+
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader()
+    let buffer = ''
+    let started = false
+
+    while (true) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += value
+
+      // Server-sent events are separated by a blank line
+      let boundary
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const event = this.parseEvent(buffer.slice(0, boundary))
+        buffer = buffer.slice(boundary + 2)
+
+        if (event.type === 'done') {
+          // Swap the raw text for the server-rendered markdown
+          reply.outerHTML = event.data.html
+          requestAnimationFrame(() => {
+            Prism.highlightAll()
+            this.scrollToBottom()
+          })
+          return
+        }
+        if (event.type === 'error') {
+          if (!started) reply.querySelector('[role=status]').replaceWith(content)
+          content.textContent = event.data.error
+          return
+        }
+
+        if (!started) {
+          // Replace the loading indicator with the streamed text
+          reply.querySelector('[role=status]').replaceWith(content)
+          started = true
+        }
+        content.textContent += event.data.delta
+        this.scrollToBottom()
+      }
+    }
+  }
+
+  parseEvent(raw) {
+    const event = { type: 'message', data: null }
+    raw.split('\n').forEach(line => {
+      if (line.startsWith('event: ')) event.type = line.slice(7)
+      if (line.startsWith('data: ')) event.data = JSON.parse(line.slice(6))
+    })
+    return event
+  }
+
   scrollToBottom() {
     this.messageListTarget.scrollTop = this.messageListTarget.scrollHeight
   }
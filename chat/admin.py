@@ -1,4 +1,4 @@
-from .models import CustomUser, Thread, Message
+from .models import CustomUser, Thread, Message, Job
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.utils.translation import gettext_lazy as _
@@ -29,4 +29,5 @@ class CustomUserAdmin(UserAdmin):
 # Register your models here
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(Thread)
-admin.site.register(Message)
\ No newline at end of file
+admin.site.register(Message)
+admin.site.register(Job)
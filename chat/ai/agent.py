@@ -9,19 +9,146 @@ Typical usage example:
 
 import os
 import json
-from openai import OpenAI, AzureOpenAI
+import logging
+import threading
+from contextlib import ExitStack, nullcontext
+from openai import (
+    APIConnectionError,
+    AzureOpenAI,
+    InternalServerError,
+    OpenAI,
+    OpenAIError,
+    RateLimitError,
+)
 import re
 from django.conf import settings
 from ..models import Message
+from .. import upstream
+from ..balancer import get_balancer
+from ..limiter import get_limiter
+from ..singleflight import flights
+from .history import load_history
+from .persistence import pending_messages, save_turn
+from .semantic_cache import semantic_cache, semantic_scope
+from .tokens import MESSAGE_OVERHEAD_TOKENS, count_message_tokens, truncate_tokens
 
-# Initialize the OpenAI client
-if settings.OPENAI_API_TYPE == "azure":
-    client = AzureOpenAI(
-        api_version=settings.OPENAI_API_VERSION,
-        azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+logger = logging.getLogger(__name__)
+
+# The smallest remainder worth keeping when truncating an older message
+MIN_TRUNCATED_TOKENS = 32
+
+# Initialize the OpenAI client on the shared, pooled upstream HTTP client.
+# The SDK retries rate limited and failed requests with jittered exponential
+# backoff, honouring Retry-After.
+def _create_client(endpoint=None, api_key=None):
+    if settings.OPENAI_API_TYPE == "azure":
+        return AzureOpenAI(
+            api_version=settings.OPENAI_API_VERSION,
+            azure_endpoint=endpoint or settings.AZURE_OPENAI_ENDPOINT,
+            api_key=api_key or settings.AZURE_OPENAI_API_KEY,
+            http_client=upstream.get_http_client(),
+            timeout=upstream.get_httpx_timeout(),
+            max_retries=settings.UPSTREAM_RETRIES,
+        )
+    return OpenAI(
+        base_url=endpoint,
+        api_key=api_key,
+        http_client=upstream.get_http_client(),
+        timeout=upstream.get_httpx_timeout(),
+        max_retries=settings.UPSTREAM_RETRIES,
     )
-else:
-    client = OpenAI()
+
+
+# The client of the primary endpoint, created on first use so importing this
+# module (e.g. in `manage.py migrate`) does not set up the HTTP client
+client = None
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the OpenAI client of the primary upstream endpoint."""
+    global client
+    if client is None:
+        with _clients_lock:
+            if client is None:
+                client = _create_client()
+    return client
+
+
+# Clients of the other upstream endpoints, by endpoint and key
+_endpoint_clients = {}
+
+
+def _client_for(backend):
+    """Returns the OpenAI client sending requests to an upstream endpoint."""
+    if backend is get_balancer().primary:
+        return get_client()
+    key = (backend.endpoint, backend.api_key)
+    if key not in _endpoint_clients:
+        with _clients_lock:
+            if key not in _endpoint_clients:
+                _endpoint_clients[key] = _create_client(backend.endpoint, backend.api_key)
+    return _endpoint_clients[key]
+
+
+def _reset_after_fork():
+    """Drops the inherited clients, which use the parent's HTTP client."""
+    global client, _clients_lock
+    client = None
+    _endpoint_clients.clear()
+    _clients_lock = threading.Lock()
+
+
+# Workers forked from a preloaded gunicorn master create their own clients
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _is_endpoint_failure(exc):
+    # Invalid requests are not the endpoint's fault
+    return isinstance(exc, (APIConnectionError, RateLimitError, InternalServerError))
+
+
+def _is_throttled(exc):
+    # Only throttling and unreachable endpoints shrink the concurrency limit
+    return isinstance(exc, (APIConnectionError, RateLimitError))
+
+
+def _create_completion(**kwargs):
+    """Creates a chat completion on the healthiest upstream endpoint.
+
+    The request waits for the adaptive concurrency limit of the endpoint and
+    model, and raises ConcurrencyLimitExceeded if it waits too long. A
+    streamed completion holds its slot until it is consumed or closed.
+    """
+    balancer = get_balancer()
+    backend = balancer.choose(kwargs["model"])
+    limiter = get_limiter((backend.endpoint, kwargs["model"]))
+    slot = nullcontext() if limiter is None else limiter.slot(is_throttled=_is_throttled)
+    with ExitStack() as stack:
+        stack.enter_context(slot)
+        stack.enter_context(balancer.track(backend, is_failure=_is_endpoint_failure))
+        completion = _client_for(backend).chat.completions.create(**kwargs)
+        if kwargs.get("stream"):
+            return _hold_until_consumed(completion, stack.pop_all())
+        return completion
+
+
+def _hold_until_consumed(chunks, stack):
+    """Iterates a streamed completion, then exits the contexts of its request.
+
+    Returns:
+        A started generator of the chunks, so that closing it (or garbage
+        collecting it) before reading any chunk still exits the contexts.
+    """
+
+    def iterate():
+        with stack:
+            yield
+            yield from chunks
+
+    held = iterate()
+    next(held)
+    return held
 
 
 class Agent:
@@ -33,28 +160,62 @@ class Agent:
         tool_invoker: An instance of the ToolInvoker class.
         history: A list of previous interactions with the user.
         prompt: A string used as the initial prompt for the chat.
+        max_history_tokens: The token budget for the history sent with each
+                            message.
+        last_turn: The Message instances of the latest turn saved to the
+                   thread (the user's message and the reply).
     """
 
-    def __init__(self, prompt="You are a helpful assistant.", thread=None) -> None:
+    def __init__(
+        self, prompt="You are a helpful assistant.", thread=None, max_history_tokens=None
+    ) -> None:
         self.thread = thread
+        self.last_turn = []
         self.history = self._build_history()
         self.prompt = prompt
+        if max_history_tokens is None and thread is not None:
+            max_history_tokens = thread.max_history_tokens
+        self.max_history_tokens = max_history_tokens or settings.AGENT_HISTORY_TOKENS
 
-    def chat(self, message):
+    def chat(self, message, stream=False):
         """Interacts with the user and invokes the necessary tools.
 
         Args:
             message: A string containing the user's input.
+            stream: If True, return a generator that yields the response in
+                    chunks as they arrive from the AI model.
 
         Returns:
-            A string containing the assistant's response.
+            A string containing the assistant's response, or a generator of
+            response chunks when stream is True.
         """
+        if stream:
+            return self._stream_chat(message)
+
         ai_reply = self._get_ai_reply(message, system_message=self.prompt.strip())
-        self._update_history("user", message)
-        self._update_history("assistant", ai_reply)
+        self._save_turn(message, ai_reply)
 
         return ai_reply
 
+    def _stream_chat(self, message):
+        """Streams the assistant's response and saves the turn once it completes.
+
+        Args:
+            message: A string containing the user's input.
+
+        Yields:
+            Strings containing consecutive chunks of the assistant's response.
+        """
+        chunks = []
+        for chunk in self._get_ai_reply(
+            message, system_message=self.prompt.strip(), stream=True
+        ):
+            chunks.append(chunk)
+            yield chunk
+
+        ai_reply = "".join(chunks).strip()
+        self._save_turn(message, ai_reply)
+
     def _build_history(self):
         """Builds the history from the thread messages.
 
@@ -63,13 +224,21 @@ class Agent:
         """
         history = []
         if self.thread is not None:  # Ensure that thread is not None
-            messages = Message.objects.filter(thread=self.thread).order_by("timestamp")
-            for message in messages:
-                history.append({"role": message.role, "content": message.content})
+            history = load_history(self.thread)
+            # Include turns still queued for writing by this process
+            history.extend(
+                {"role": message.role, "content": message.content}
+                for message in pending_messages(self.thread.pk)
+            )
         return history
 
     def _get_ai_reply(
-        self, message, model="gpt-35-turbo-16k", system_message=None, temperature=0
+        self,
+        message,
+        model="gpt-35-turbo-16k",
+        system_message=None,
+        temperature=0,
+        stream=False,
     ):
         """Gets a response from the AI model.
 
@@ -78,22 +247,102 @@ class Agent:
             model: A string containing the name of the AI model.
             system_message: A string containing a system message.
             temperature: A float used to control the randomness of the AI's output.
+            stream: If True, return a generator of response chunks instead of
+                    waiting for the full completion.
 
         Returns:
-            A string containing the AI's response.
+            A string containing the AI's response, or a generator of response
+            chunks when stream is True.
         """
-        messages = self._prepare_messages(message, system_message)
-        completion = client.chat.completions.create(
-            model=model, messages=messages, temperature=temperature
-        )
-        return completion.choices[0].message.content.strip()
+        messages = self._prepare_messages(message, system_message, model)
+        cache_key = self._semantic_cache_key(messages, model, temperature)
+        if cache_key is not None:
+            ai_reply = semantic_cache.lookup(*cache_key)
+            if ai_reply is not None:
+                return iter([ai_reply]) if stream else ai_reply
 
-    def _prepare_messages(self, message, system_message):
+        if stream:
+            completion = _create_completion(
+                model=model, messages=messages, temperature=temperature, stream=True
+            )
+            return self._iter_stream_content(completion, cache_key)
+
+        def create():
+            # Slow replies are hedged with a second request
+            return upstream.hedge(
+                ("agent", model),
+                lambda: _create_completion(
+                    model=model, messages=messages, temperature=temperature
+                ),
+            )
+
+        if settings.COALESCE_REQUESTS and temperature == 0:
+            # Identical requests in flight at the same time share one call
+            key = ("agent", semantic_scope(model, temperature, messages))
+            completion = flights.do(key, create)
+        else:
+            completion = create()
+        ai_reply = completion.choices[0].message.content.strip()
+        if cache_key is not None:
+            semantic_cache.add(*cache_key, ai_reply)
+        return ai_reply
+
+    def _semantic_cache_key(self, messages, model, temperature):
+        """Embeds the user's message to look it up in the semantic cache.
+
+        Args:
+            messages: A list of the messages prepared for the AI model.
+            model: A string containing the name of the AI model.
+            temperature: A float used to control the randomness of the AI's output.
+
+        Returns:
+            A (scope, embedding) tuple, or None if the semantic cache is
+            disabled or the message could not be embedded.
+        """
+        if not settings.SEMANTIC_CACHE or not messages or messages[-1]["role"] != "user":
+            return None
+        try:
+            response = get_client().embeddings.create(
+                model=settings.SEMANTIC_CACHE_EMBEDDING_MODEL,
+                input=messages[-1]["content"],
+            )
+        except OpenAIError:
+            logger.warning("Failed to embed a message for the semantic cache", exc_info=True)
+            return None
+        return semantic_scope(model, temperature, messages[:-1]), response.data[0].embedding
+
+    def _iter_stream_content(self, completion, cache_key=None):
+        """Extracts the text deltas from a streamed chat completion.
+
+        Args:
+            completion: An iterable of chat completion chunks.
+            cache_key: A (scope, embedding) tuple to cache the complete
+                       reply under in the semantic cache, or None.
+
+        Yields:
+            Non-empty strings containing the content of each chunk.
+        """
+        chunks = []
+        for chunk in completion:
+            # Azure sends chunks without choices (e.g. content filter results)
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                chunks.append(content)
+                yield content
+        if cache_key is not None:
+            semantic_cache.add(*cache_key, "".join(chunks).strip())
+
+    def _prepare_messages(self, message, system_message, model="gpt-35-turbo-16k"):
         """Prepares the messages for the AI model.
 
+        Only the newest history that fits the token budget is included.
+
         Args:
             message: A string containing the user's input.
             system_message: A string containing a system message.
+            model: A string containing the name of the AI model.
 
         Returns:
             A list of messages for the AI model.
@@ -101,21 +350,82 @@ class Agent:
         messages = []
         if system_message is not None:
             messages.append({"role": "system", "content": system_message})
-        messages.extend(self.history)
+        user_messages = []
         if message is not None:
-            messages.append({"role": "user", "content": message})
+            user_messages.append({"role": "user", "content": message})
+
+        budget = self._history_budget(messages + user_messages, model)
+        messages.extend(self._trim_history(budget, model))
+        messages.extend(user_messages)
         return messages
 
-    def _update_history(self, role, content):
-        """Updates the history of interactions with the user.
+    def _history_budget(self, messages, model):
+        """Computes how many tokens of history can be sent with the messages.
 
         Args:
-            role: A string indicating the role of the message sender.
-            content: A string containing the message content.
+            messages: A list of the other messages sent to the AI model.
+            model: A string containing the name of the AI model.
+
+        Returns:
+            An integer number of tokens.
+        """
+        context_window = settings.MODEL_CONTEXT_WINDOWS.get(
+            model, settings.DEFAULT_CONTEXT_WINDOW
+        )
+        available = (
+            context_window
+            - settings.AGENT_REPLY_TOKENS
+            - sum(count_message_tokens(m, model) for m in messages)
+        )
+        return min(self.max_history_tokens, available)
+
+    def _trim_history(self, budget, model):
+        """Keeps the newest history messages that fit within a token budget.
+
+        Older messages are dropped. The newest message that does not fit is
+        truncated to its last tokens when enough of the budget remains.
+
+        Args:
+            budget: The number of tokens the history may use.
+            model: A string containing the name of the AI model.
+
+        Returns:
+            A list of history messages in chronological order.
+        """
+        kept = []
+        for entry in reversed(self.history):
+            tokens = count_message_tokens(entry, model)
+            if tokens <= budget:
+                kept.append(entry)
+                budget -= tokens
+                continue
+
+            remaining = budget - MESSAGE_OVERHEAD_TOKENS
+            if remaining >= MIN_TRUNCATED_TOKENS:
+                content = truncate_tokens(entry["content"], remaining, model)
+                kept.append({"role": entry["role"], "content": content})
+            break
+        kept.reverse()
+        return kept
+
+    def _save_turn(self, message, ai_reply):
+        """Adds a turn to the history and saves it to the thread.
+
+        Both messages are written together in one transaction (or queued for
+        a batched write when write-behind is enabled).
+
+        Args:
+            message: A string containing the user's input.
+            ai_reply: A string containing the assistant's response.
         """
-        self.history.append({"role": role, "content": content})
-        # Create and save a Message instance
+        turn = [
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": ai_reply},
+        ]
+        self.history.extend(turn)
         if self.thread is not None:  # Ensure that thread is not None
-            Message.objects.create(
-                thread=self.thread, user=self.thread.user, content=content, role=role
-            )
+            self.last_turn = [
+                Message(thread=self.thread, user=self.thread.user, **entry)
+                for entry in turn
+            ]
+            save_turn(self.thread, self.last_turn)
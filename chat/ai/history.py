@@ -0,0 +1,50 @@
+"""This module contains the per-thread conversation history cache.
+
+Each worker process keeps the history of recently active threads in memory,
+together with the id of the newest message it has seen. Loading a thread's
+history then only fetches messages newer than that id (usually none), so the
+cost of a turn no longer grows with the length of the thread. Because the
+database is checked for newer messages on every load, messages written by
+this or other worker processes are picked up on the next load.
+Typical usage example:
+
+    history = load_history(thread)
+"""
+
+from django.conf import settings
+
+from ..caching import LRUCache
+from ..models import Message
+
+# Maps a thread id to a tuple of (newest message id, list of history entries)
+history_cache = LRUCache(
+    maxsize=settings.HISTORY_CACHE_SIZE, ttl=settings.HISTORY_CACHE_TTL
+)
+
+
+def load_history(thread):
+    """Returns the history of a thread, fetching only uncached messages.
+
+    Args:
+        thread: The Thread to load the history of.
+
+    Returns:
+        A new list of {"role", "content"} dictionaries in chronological order.
+    """
+    last_id, entries = history_cache.get(thread.pk, (0, []))
+    rows = list(
+        Message.objects.filter(thread=thread, pk__gt=last_id)
+        .order_by("timestamp")
+        .values_list("pk", "role", "content")
+    )
+    if rows:
+        entries = entries + [
+            {"role": role, "content": content} for _, role, content in rows
+        ]
+        history_cache.set(thread.pk, (max(row[0] for row in rows), entries))
+    return list(entries)
+
+
+def invalidate_history(thread_id):
+    """Drops the cached history of a thread."""
+    history_cache.pop(thread_id)
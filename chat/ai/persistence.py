@@ -0,0 +1,192 @@
+"""This module contains the persistence of chat turns.
+
+A turn (the user's message and the assistant's reply) is written with a
+single bulk insert in one transaction, so it takes the database write lock
+once and is never saved half way. With MESSAGE_WRITE_BEHIND enabled, turns
+are instead queued and written in batches by a background thread, so
+concurrent chats share one transaction. Queued messages are included when
+this process loads a thread, but other worker processes only see them once
+they are flushed (after at most MESSAGE_WRITE_BEHIND_INTERVAL seconds).
+Typical usage example:
+
+    save_turn(thread, [user_message, assistant_message])
+    pending_messages(thread.pk)
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from ..models import Message
+
+logger = logging.getLogger(__name__)
+
+
+def write_turns(turns):
+    """Writes the messages of one or more turns in a single transaction.
+
+    Args:
+        turns: A list of (thread, messages) tuples, where messages is a list
+               of unsaved Message instances in chronological order.
+    """
+    for _, messages in turns:
+        for message in messages:
+            message.render_content()  # bulk_create does not call save()
+    with transaction.atomic():
+        Message.objects.bulk_create(
+            [message for _, messages in turns for message in messages]
+        )
+
+
+class WriteBehindQueue:
+    """Queues turns and writes them in batches from a background thread.
+
+    When a batch fails, its turns are written one at a time, so one bad turn
+    does not lose the others, and a failing turn is retried a few times
+    before it is dropped.
+
+    Attributes:
+        batch_size: The maximum number of turns written in one transaction.
+        interval: The number of seconds to wait for more turns after the
+                  first one is queued.
+        retries: The number of times a turn that fails on its own is retried.
+    """
+
+    def __init__(self, batch_size=100, interval=0.2, retries=3):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retries = retries
+        self._reset()
+
+    def _reset(self):
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, thread, messages):
+        """Queues the messages of a turn to be written.
+
+        Args:
+            thread: The Thread the messages belong to.
+            messages: A list of unsaved Message instances in chronological order.
+        """
+        with self._lock:
+            self._pending.setdefault(thread.pk, []).extend(messages)
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="message-write-behind", daemon=True
+                )
+                self._worker.start()
+        self._queue.put((thread, messages))
+
+    def pending(self, thread_id):
+        """Returns the queued messages of a thread that are not written yet."""
+        with self._lock:
+            return list(self._pending.get(thread_id, []))
+
+    def flush(self):
+        """Blocks until every queued turn has been written."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            turns = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(turns) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    turns.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._write(turns)
+            finally:
+                # The thread outlives requests, so drop a broken or expired connection
+                close_old_connections()
+                for _ in turns:
+                    self._queue.task_done()
+
+    def _write(self, turns):
+        """Writes a batch of turns, falling back to one turn at a time."""
+        try:
+            write_turns(turns)
+        except Exception:
+            logger.exception(
+                "Failed to write %d queued chat turns, writing them one by one", len(turns)
+            )
+        else:
+            self._done(turns)
+            return
+
+        for turn in turns:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    time.sleep(self.interval * 2 ** (attempt - 1))
+                close_old_connections()
+                try:
+                    write_turns([turn])
+                    break
+                except Exception:
+                    logger.exception(
+                        "Failed to write a chat turn of thread %s (attempt %d of %d)",
+                        turn[0].pk,
+                        attempt + 1,
+                        self.retries + 1,
+                    )
+            else:
+                logger.error("Dropped a chat turn of thread %s", turn[0].pk)
+            # Later turns of the thread wait until this one is written or dropped
+            self._done([turn])
+
+    def _done(self, turns):
+        """Removes turns that are written, or given up on, from the pending ones."""
+        with self._lock:
+            for thread, messages in turns:
+                # Turns of a thread are written in the order they were queued
+                del self._pending[thread.pk][: len(messages)]
+                if not self._pending[thread.pk]:
+                    del self._pending[thread.pk]
+
+
+write_behind = WriteBehindQueue(
+    batch_size=settings.MESSAGE_WRITE_BEHIND_BATCH_SIZE,
+    interval=settings.MESSAGE_WRITE_BEHIND_INTERVAL,
+)
+
+# Write the queued turns before a worker process exits
+atexit.register(write_behind.flush)
+
+# A forked worker does not inherit the background thread or the parent's queue
+os.register_at_fork(after_in_child=write_behind._reset)
+
+
+def save_turn(thread, messages):
+    """Saves the messages of a turn, queueing them when write-behind is enabled.
+
+    Args:
+        thread: The Thread the messages belong to.
+        messages: A list of unsaved Message instances in chronological order.
+    """
+    if settings.MESSAGE_WRITE_BEHIND:
+        write_behind.submit(thread, messages)
+    else:
+        write_turns([(thread, messages)])
+
+
+def pending_messages(thread_id):
+    """Returns the messages of a thread still queued for writing.
+
+    Returns:
+        A list of unsaved Message instances in chronological order.
+    """
+    return write_behind.pending(thread_id)
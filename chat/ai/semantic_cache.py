@@ -0,0 +1,173 @@
+"""This module contains the semantic cache of agent replies.
+
+A reply is cached with the embedding of the message it answered, scoped to
+everything else the model was sent (the model, temperature, system prompt
+and history). A later message in the same scope whose embedding is at least
+SEMANTIC_CACHE_THRESHOLD similar (by cosine similarity) is answered with the
+cached reply instead of calling the model. The cache is kept per worker
+process, holds at most SEMANTIC_CACHE_SIZE replies across all scopes and
+evicts the least recently used ones first. numpy is imported on the first
+lookup, so workers with the cache disabled do not load it.
+Typical usage example:
+
+    scope = semantic_scope(model, temperature, messages[:-1])
+    reply = semantic_cache.lookup(scope, embedding)
+    if reply is None:
+        semantic_cache.add(scope, embedding, get_reply())
+"""
+
+import hashlib
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+def semantic_scope(model, temperature, messages):
+    """Computes the scope of a message from the context it is sent with.
+
+    Args:
+        model: A string containing the name of the AI model.
+        temperature: The sampling temperature of the request.
+        messages: A list of the messages sent before the user's message.
+
+    Returns:
+        A hex digest string.
+    """
+    context = json.dumps(
+        [model, temperature, messages], sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(context.encode()).hexdigest()
+
+
+class SemanticCache:
+    """A thread-safe, size-bounded cache of replies looked up by similarity.
+
+    Attributes:
+        maxsize: The maximum number of replies kept; the least recently used
+                 reply is evicted when a new one would exceed it.
+        threshold: The minimum cosine similarity of a cached message's
+                   embedding for its reply to be served.
+        ttl: The number of seconds a reply stays valid, or None to keep
+             replies until they are evicted.
+        hits: The number of lookups that found a similar enough message.
+        misses: The number of lookups that did not.
+    """
+
+    def __init__(self, maxsize=1000, threshold=0.95, ttl=None):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._ids = itertools.count()
+        # id -> (scope, unit vector, reply, expires_at), least recently used first
+        self._entries = OrderedDict()
+        # scope -> ids of its entries
+        self._scopes = {}
+        # scope -> (ids, matrix of their unit vectors), built on the first lookup
+        self._matrices = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, scope, embedding):
+        """Returns the cached reply most similar to an embedding, or None.
+
+        Args:
+            scope: The scope of the message, from semantic_scope.
+            embedding: A sequence of floats embedding the user's message.
+        """
+        import numpy as np
+
+        vector = self._normalize(embedding)
+        with self._lock:
+            ids, matrix = self._matrix(scope)
+            if ids:
+                similarities = matrix @ vector
+                best = int(np.argmax(similarities))
+                entry = self._entries[ids[best]]
+                if similarities[best] >= self.threshold and (
+                    entry[3] is None or entry[3] > time.monotonic()
+                ):
+                    self._entries.move_to_end(ids[best])
+                    self.hits += 1
+                    return entry[2]
+            self.misses += 1
+            return None
+
+    def add(self, scope, embedding, reply):
+        """Caches a reply, evicting expired and least recently used replies."""
+        vector = self._normalize(embedding)
+        now = time.monotonic()
+        expires_at = None if self.ttl is None else now + self.ttl
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (scope, vector, reply, expires_at)
+            self._scopes.setdefault(scope, set()).add(entry_id)
+            self._matrices.pop(scope, None)
+            expired = [
+                key
+                for key, entry in self._entries.items()
+                if entry[3] is not None and entry[3] <= now
+            ]
+            for key in expired:
+                self._evict(key)
+            while len(self._entries) > self.maxsize:
+                self._evict(next(iter(self._entries)))
+
+    def clear(self):
+        """Removes every reply from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+            self._matrices.clear()
+
+    def stats(self):
+        """Returns the hit and miss counters, the hit rate and the current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "scopes": len(self._scopes),
+                "maxsize": self.maxsize,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _normalize(self, embedding):
+        import numpy as np
+
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _matrix(self, scope):
+        if scope not in self._scopes:
+            return [], None
+        if scope not in self._matrices:
+            import numpy as np
+
+            ids = sorted(self._scopes[scope])
+            matrix = np.stack([self._entries[key][1] for key in ids])
+            self._matrices[scope] = (ids, matrix)
+        return self._matrices[scope]
+
+    def _evict(self, key):
+        scope = self._entries.pop(key)[0]
+        self._matrices.pop(scope, None)
+        self._scopes[scope].discard(key)
+        if not self._scopes[scope]:
+            del self._scopes[scope]
+
+
+semantic_cache = SemanticCache(
+    maxsize=settings.SEMANTIC_CACHE_SIZE,
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    ttl=settings.SEMANTIC_CACHE_TTL,
+)
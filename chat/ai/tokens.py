@@ -0,0 +1,93 @@
+"""This module contains helpers for counting and truncating tokens locally.
+
+Token counts use tiktoken when it is installed and its encodings are
+available; otherwise they fall back to an estimate of four characters per
+token, which is close for English text.
+Typical usage example:
+
+    count_message_tokens({"role": "user", "content": "Hi"}, "gpt-4o")
+    truncate_tokens(long_text, 500, "gpt-4o")
+"""
+
+import functools
+import logging
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken is an optional dependency
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Tokens added by the chat format around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+CHARS_PER_TOKEN = 4
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model):
+    """Returns the tiktoken encoding for a model, or None if unavailable.
+
+    Args:
+        model: A string containing the model or Azure deployment name.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        name = tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        name = "cl100k_base"
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:  # The encoding file could not be downloaded
+        logger.warning("No tiktoken encoding for %s; estimating token counts", model)
+        return None
+
+
+def count_tokens(text, model):
+    """Counts the tokens in a string.
+
+    Args:
+        text: A string to count the tokens of.
+        model: A string containing the model or Azure deployment name.
+
+    Returns:
+        An integer number of tokens.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message, model):
+    """Counts the tokens a chat message takes up in the prompt.
+
+    Args:
+        message: A dictionary with "role" and "content" keys.
+        model: A string containing the model or Azure deployment name.
+
+    Returns:
+        An integer number of tokens.
+    """
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(message["content"] or "", model)
+
+
+def truncate_tokens(text, max_tokens, model):
+    """Keeps the last max_tokens tokens of a string.
+
+    Args:
+        text: A string to truncate.
+        max_tokens: The maximum number of tokens to keep.
+        model: A string containing the model or Azure deployment name.
+
+    Returns:
+        The end of the string that fits within max_tokens.
+    """
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[-max_tokens * CHARS_PER_TOKEN :]
+    tokens = encoding.encode(text, disallowed_special=())
+    return encoding.decode(tokens[-max_tokens:])
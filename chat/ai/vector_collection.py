@@ -0,0 +1,160 @@
+"""This module contains the Document and VectorCollection classes.
+
+A VectorCollection stores documents in a Chroma collection, persisted in
+CHROMADB_STORAGE_PATH, together with embeddings computed by the upstream
+embeddings API. Documents are embedded in batches of at most
+VECTOR_EMBEDDING_BATCH_SIZE documents and VECTOR_EMBEDDING_BATCH_TOKENS
+tokens, one API call per batch, and upserted by id, so indexing a corpus
+again updates its documents instead of duplicating them.
+Typical usage example:
+
+    collection = VectorCollection(collection_name="syllabus")
+    collection.add_many(Document(row["id"], row) for row in rows)
+    results = collection.search("When is the midterm?", n_results=5)
+"""
+
+import json
+import logging
+import threading
+
+from django.conf import settings
+
+from .tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_chroma_client = None
+
+
+def get_chroma_client():
+    """Returns the process-wide Chroma client, persisted in CHROMADB_STORAGE_PATH."""
+    global _chroma_client
+    if _chroma_client is None:
+        # chromadb is slow to import; only processes that use it load it
+        import chromadb
+
+        with _lock:
+            if _chroma_client is None:
+                _chroma_client = chromadb.PersistentClient(
+                    path=settings.CHROMADB_STORAGE_PATH,
+                    settings=chromadb.Settings(anonymized_telemetry=False),
+                )
+    return _chroma_client
+
+
+class Document:
+    """A piece of JSON-serializable data stored in a VectorCollection.
+
+    Attributes:
+        id: A string identifying the document in its collection.
+        data: The data of the document, returned by searches.
+    """
+
+    def __init__(self, id, data):
+        self.id = str(id)
+        self.data = data
+
+    def to_embed_str(self):
+        """Returns the text embedded (and stored) for the document."""
+        return json.dumps(self.data)
+
+
+class VectorCollection:
+    """A collection of documents searched by the similarity of their embeddings.
+
+    Attributes:
+        collection: The Chroma collection storing the documents.
+        embedding_model: The embedding model (or Azure deployment) name.
+        batch_size: The maximum number of documents embedded per API call.
+        batch_tokens: The maximum number of tokens embedded per API call.
+    """
+
+    def __init__(
+        self, collection_name, embedding_model=None, batch_size=None, batch_tokens=None
+    ):
+        self.embedding_model = embedding_model or settings.VECTOR_EMBEDDING_MODEL
+        self.batch_size = batch_size or settings.VECTOR_EMBEDDING_BATCH_SIZE
+        self.batch_tokens = batch_tokens or settings.VECTOR_EMBEDDING_BATCH_TOKENS
+        # Embeddings are always passed in, so Chroma's own model is never loaded
+        self.collection = get_chroma_client().get_or_create_collection(
+            name=collection_name,
+            metadata={"hnsw:space": "cosine"},
+            embedding_function=None,
+        )
+
+    def add(self, document):
+        """Adds a document, or updates the document with the same id."""
+        self.add_many([document])
+
+    def add_many(self, documents):
+        """Adds documents, updating those with the ids of stored ones.
+
+        Args:
+            documents: An iterable of Document instances. If several have the
+                       same id, the last one is stored.
+
+        Returns:
+            The number of documents stored.
+        """
+        by_id = {}
+        for document in documents:
+            by_id.pop(document.id, None)  # Keep the order of the last occurrence
+            by_id[document.id] = document
+
+        count = 0
+        items = [(document.id, document.to_embed_str()) for document in by_id.values()]
+        for batch in self._batches(items):
+            ids, texts = zip(*batch)
+            self.collection.upsert(
+                ids=list(ids), embeddings=self._embed(list(texts)), documents=list(texts)
+            )
+            count += len(batch)
+            logger.debug("Indexed %d of %d documents", count, len(by_id))
+        return count
+
+    def search(self, query, n_results=5):
+        """Finds the documents most similar to a query.
+
+        Args:
+            query: A string to search for.
+            n_results: The maximum number of documents returned.
+
+        Returns:
+            A list of the data of the matching documents, most similar first.
+        """
+        # Chroma warns when asked for more results than it has documents, and
+        # fails when asked for none
+        n_results = min(n_results, self.collection.count())
+        if n_results <= 0:
+            return []
+        results = self.collection.query(
+            query_embeddings=self._embed([query]),
+            n_results=n_results,
+            include=["documents"],
+        )
+        return [json.loads(text) for text in results["documents"][0]]
+
+    def _batches(self, items):
+        """Splits (id, text) pairs into batches within the size and token caps."""
+        batch = []
+        tokens = 0
+        for item in items:
+            item_tokens = count_tokens(item[1], self.embedding_model)
+            if batch and (
+                len(batch) >= self.batch_size or tokens + item_tokens > self.batch_tokens
+            ):
+                yield batch
+                batch = []
+                tokens = 0
+            batch.append(item)
+            tokens += item_tokens
+        if batch:
+            yield batch
+
+    def _embed(self, texts):
+        """Embeds texts with one call to the embeddings API."""
+        from .agent import get_client
+
+        response = get_client().embeddings.create(model=self.embedding_model, input=texts)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
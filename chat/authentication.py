@@ -0,0 +1,55 @@
+"""This module contains the bearer token authentication of the API.
+
+Authenticated tokens are cached per process for TOKEN_CACHE_TTL seconds, so
+most API requests are authenticated without a database query. The cached
+entry of a token is dropped when the token is deleted (or regenerated) or its
+user is saved, e.g. deactivated; other worker processes pick up the change
+once their entry expires.
+Typical usage example:
+
+    @authentication_classes([BearerAuthentication])
+    def view(request): ...
+"""
+
+import copy
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .caching import LRUCache
+
+# Maps a token key to its active user
+token_cache = LRUCache(maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL)
+
+
+class BearerAuthentication(BaseAuthentication):
+    def authenticate(self, request):
+        header = request.META.get("HTTP_AUTHORIZATION")
+        if not header:
+            return None
+
+        try:
+            token = header.split(" ")[1]
+        except IndexError:
+            raise AuthenticationFailed("Bearer token not provided")
+
+        user = token_cache.get(token)
+        if user is None:
+            try:
+                user = get_user_model().objects.get(auth_token=token)
+            except get_user_model().DoesNotExist:
+                raise AuthenticationFailed("No such user")
+            if not user.is_active:
+                raise AuthenticationFailed("User inactive or deleted")
+            token_cache.set(token, user)
+
+        # Each request gets its own copy, so a view that changes its user does
+        # not change the user of concurrent requests
+        return (copy.copy(user), token)
+
+
+def invalidate_token(key):
+    """Drops the cached user of a token."""
+    token_cache.pop(key)
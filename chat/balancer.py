@@ -0,0 +1,256 @@
+"""This module contains the load balancing of upstream API endpoints.
+
+Besides the endpoint configured by AZURE_OPENAI_ENDPOINT (or OpenAI's API),
+UPSTREAM_ENDPOINTS can list more endpoints, e.g. Azure deployments in other
+regions, each with its own key and, optionally, the deployments it serves.
+Each request is sent to the better of two randomly picked endpoints, scored
+by the requests they have in flight, their recent latency and their error
+rate. An endpoint that fails UPSTREAM_BREAKER_FAILURES requests in a row is
+ejected for UPSTREAM_BREAKER_COOLDOWN seconds (its circuit is opened), then
+gets requests again; one more failure ejects it again.
+Typical usage example:
+
+    backend = get_balancer().choose("gpt-4o")
+    with get_balancer().track(backend) as outcome:
+        outcome.ok = send(backend).status_code < 500
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Weight of the latest request in the latency and error rate averages
+SMOOTHING = 0.2
+
+
+class Backend:
+    """An upstream API endpoint and its observed health.
+
+    Attributes:
+        endpoint: The base URL, e.g. "https://eastus.openai.azure.com".
+        api_key: The API key of the endpoint.
+        deployments: The set of deployment (or model) names served by the
+                     endpoint, or None if it serves all of them.
+        in_flight: The number of requests currently sent to the endpoint.
+        latency: The moving average of request latencies in seconds, or None.
+        error_rate: The moving average of failed requests, between 0 and 1.
+        failures: The number of requests failed in a row.
+        ejected_until: The time.monotonic() until which the circuit is open.
+    """
+
+    def __init__(self, endpoint, api_key, deployments=None):
+        self.endpoint = endpoint.rstrip("/")
+        self.api_key = api_key
+        self.deployments = set(deployments) if deployments else None
+        self.in_flight = 0
+        self.latency = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def __repr__(self):
+        return f"<Backend {self.endpoint}>"
+
+    @property
+    def base_url(self):
+        """Returns the URL the API paths of the endpoint start with."""
+        if settings.OPENAI_API_TYPE == "azure":
+            return f"{self.endpoint}/openai/deployments/"
+        return f"{self.endpoint}/"
+
+    @property
+    def headers(self):
+        """Returns the authentication headers of the endpoint."""
+        if settings.OPENAI_API_TYPE == "azure":
+            return {"api-key": self.api_key}
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def serves(self, deployment):
+        return self.deployments is None or deployment in self.deployments
+
+    def score(self, default_latency):
+        """Returns the expected cost of sending a request; lower is better."""
+        latency = self.latency if self.latency is not None else default_latency
+        return (self.in_flight + 1) * latency / max(1.0 - self.error_rate, 0.05)
+
+
+class _Outcome:
+    ok = True
+
+
+class Balancer:
+    """Picks the endpoint of each upstream request and tracks their health.
+
+    Attributes:
+        backends: A list of Backend instances; the first one is the primary
+                  endpoint that resolve_endpoint builds URLs for.
+        failure_threshold: The number of failures in a row that eject a backend.
+        cooldown: The number of seconds a backend stays ejected.
+    """
+
+    def __init__(self, backends, failure_threshold=5, cooldown=30):
+        self.backends = backends
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self):
+        return self.backends[0]
+
+    def choose(self, deployment=None):
+        """Returns the backend to send a request for a deployment to.
+
+        Two backends that serve the deployment and are not ejected are
+        picked at random and the one with the lower score is returned. If
+        every such backend is ejected, the one ejected first is returned.
+        """
+        candidates = [
+            backend for backend in self.backends if backend.serves(deployment)
+        ] or self.backends
+        if len(candidates) == 1:
+            return candidates[0]
+
+        now = time.monotonic()
+        with self._lock:
+            healthy = [b for b in candidates if b.ejected_until <= now]
+            if not healthy:
+                return min(candidates, key=lambda backend: backend.ejected_until)
+            if len(healthy) == 1:
+                return healthy[0]
+            latencies = [b.latency for b in healthy if b.latency is not None]
+            default_latency = sum(latencies) / len(latencies) if latencies else 1.0
+            return min(
+                random.sample(healthy, 2),
+                key=lambda backend: backend.score(default_latency),
+            )
+
+    def backend_for(self, url, headers):
+        """Returns the backend a URL and headers were built for, or None."""
+        for backend in self.backends:
+            if url.startswith(backend.base_url) and all(
+                headers.get(name) == value for name, value in backend.headers.items()
+            ):
+                return backend
+        return None
+
+    def route(self, url, headers):
+        """Moves a request built for one backend to the best one for it.
+
+        Args:
+            url: The URL of the request, e.g. from resolve_endpoint.
+            headers: A dictionary of the request headers.
+
+        Returns:
+            A tuple of the URL, the headers and the chosen Backend, or of the
+            unchanged URL and headers and None if the URL is not one of a
+            backend.
+        """
+        current = self.backend_for(url, headers)
+        if current is None:
+            return url, headers, None
+        path = url[len(current.base_url):]
+        deployment = path.split("/", 1)[0] if settings.OPENAI_API_TYPE == "azure" else None
+        backend = self.choose(deployment)
+        if backend is current:
+            return url, headers, backend
+        headers = {
+            name: value for name, value in headers.items() if name not in current.headers
+        }
+        headers.update(backend.headers)
+        return backend.base_url + path, headers, backend
+
+    @contextmanager
+    def track(self, backend, is_failure=None):
+        """Records the latency and outcome of a request sent to a backend.
+
+        Args:
+            backend: The Backend the request is sent to.
+            is_failure: A function telling whether an exception raised by the
+                        request is a failure of the backend, or None to count
+                        every exception as one.
+
+        The request also counts as failed if the yielded outcome's ok
+        attribute is set to False.
+        """
+        outcome = _Outcome()
+        with self._lock:
+            backend.in_flight += 1
+        start = time.monotonic()
+        try:
+            yield outcome
+        except BaseException as exc:
+            if is_failure is None or is_failure(exc):
+                outcome.ok = False
+            raise
+        finally:
+            self.record(backend, time.monotonic() - start, outcome.ok)
+
+    def record(self, backend, seconds, ok):
+        """Updates the health of a backend after a request completed."""
+        with self._lock:
+            backend.in_flight -= 1
+            if ok:
+                backend.latency = (
+                    seconds
+                    if backend.latency is None
+                    else (1 - SMOOTHING) * backend.latency + SMOOTHING * seconds
+                )
+                backend.failures = 0
+            else:
+                backend.failures += 1
+                if backend.failures >= self.failure_threshold:
+                    backend.ejected_until = time.monotonic() + self.cooldown
+            backend.error_rate = (1 - SMOOTHING) * backend.error_rate + SMOOTHING * (not ok)
+
+    def stats(self):
+        """Returns the observed health of each backend."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "endpoint": backend.endpoint,
+                    "in_flight": backend.in_flight,
+                    "latency": backend.latency,
+                    "error_rate": backend.error_rate,
+                    "ejected": backend.ejected_until > now,
+                }
+                for backend in self.backends
+            ]
+
+
+_lock = threading.Lock()
+_balancer = None
+
+
+def build_backends():
+    """Builds the backends configured in the settings, primary first."""
+    if settings.OPENAI_API_TYPE == "azure":
+        primary = Backend(settings.AZURE_OPENAI_ENDPOINT or "", settings.AZURE_OPENAI_API_KEY)
+    else:
+        primary = Backend("https://api.openai.com/v1", settings.OPENAI_API_KEY)
+    return [primary] + [
+        Backend(
+            entry.get("endpoint", primary.endpoint),
+            entry["api_key"],
+            entry.get("deployments"),
+        )
+        for entry in settings.UPSTREAM_ENDPOINTS
+    ]
+
+
+def get_balancer():
+    """Returns the process-wide balancer of the configured endpoints."""
+    global _balancer
+    if _balancer is None:
+        with _lock:
+            if _balancer is None:
+                _balancer = Balancer(
+                    build_backends(),
+                    failure_threshold=settings.UPSTREAM_BREAKER_FAILURES,
+                    cooldown=settings.UPSTREAM_BREAKER_COOLDOWN,
+                )
+    return _balancer
@@ -1,13 +1,14 @@
 # chat/context_processors.py
-from .models import Thread
+from .sidebar import get_sidebar_threads
 
 def thread_list(request):
     if request.user.is_authenticated:
-        # Order threads by 'created_at' in descending order so the newest threads are first
-        threads = Thread.objects.filter(user=request.user).order_by('-created_at')
+        # The newest threads first, with a "show more" link when there are more
+        threads, has_more_threads = get_sidebar_threads(request.user)
     else:
-        threads = []
-    
+        threads, has_more_threads = [], False
+
     return {
-        'threads': threads
+        'threads': threads,
+        'has_more_threads': has_more_threads,
     }
\ No newline at end of file
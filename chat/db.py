@@ -0,0 +1,69 @@
+"""This module contains the tuning of SQLite connections.
+
+Each new connection to a SQLite database is set up with the PRAGMAS of its
+entry in DATABASES, e.g. write-ahead logging (WAL), which lets readers run
+while a writer commits, and a busy timeout, which makes a writer wait for
+the write lock instead of failing with "database is locked". Together with
+persistent connections (CONN_MAX_AGE) the pragmas are applied once per
+thread rather than once per request.
+Typical usage example:
+
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": "db.sqlite3",
+            "PRAGMAS": {"journal_mode": "WAL", "busy_timeout": 5000},
+        }
+    }
+"""
+
+import re
+
+# Pragma names and values that are safe to interpolate into a statement
+PRAGMA_NAME_RE = re.compile(r"^[a-z_]+$")
+PRAGMA_VALUE_RE = re.compile(r"^-?\w+$")
+
+
+def sqlite_pragmas(
+    journal_mode="WAL",
+    synchronous="NORMAL",
+    busy_timeout=5000,
+    mmap_size=268435456,
+    cache_size=-64000,
+    temp_store="MEMORY",
+):
+    """Builds the pragmas of a SQLite database entry.
+
+    Args:
+        journal_mode: "WAL", or "DELETE" for SQLite's default rollback journal.
+        synchronous: "NORMAL" is durable with WAL except on power loss; "FULL"
+                     also syncs every commit to disk.
+        busy_timeout: Milliseconds to wait for a lock before failing.
+        mmap_size: Bytes of the database file read through memory mapping.
+        cache_size: Pages of the page cache, or KiB if negative.
+        temp_store: "MEMORY" to keep temporary tables and indexes in memory.
+
+    Returns:
+        A dictionary of pragma names and values, in the order they are set.
+    """
+    # The busy timeout goes first, so switching the journal mode waits for locks
+    return {
+        "busy_timeout": busy_timeout,
+        "journal_mode": journal_mode,
+        "synchronous": synchronous,
+        "mmap_size": mmap_size,
+        "cache_size": cache_size,
+        "temp_store": temp_store,
+    }
+
+
+def apply_pragmas(connection):
+    """Sets the pragmas of a new database connection, if it is SQLite."""
+    if connection.vendor != "sqlite":
+        return
+    pragmas = connection.settings_dict.get("PRAGMAS") or {}
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            if not (PRAGMA_NAME_RE.match(name) and PRAGMA_VALUE_RE.match(str(value))):
+                raise ValueError(f"Invalid SQLite pragma {name}={value!r}")
+            cursor.execute(f"PRAGMA {name} = {value}")
@@ -46,10 +46,11 @@ class ThreadForm(forms.ModelForm):
     )
     temperature = forms.FloatField(required=False)
     prompt = forms.CharField(required=False)
+    max_history_tokens = forms.IntegerField(required=False, min_value=1)
 
     class Meta:
         model = Thread
-        fields = ["name", "model", "temperature", "prompt"]
+        fields = ["name", "model", "temperature", "prompt", "max_history_tokens"]
 
 
 class MessageForm(forms.ModelForm):
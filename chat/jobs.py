@@ -0,0 +1,213 @@
+"""This module contains the database-backed queue of background jobs.
+
+Jobs are rows of the Job model, run by `python manage.py run_jobs` worker
+processes instead of web workers. A worker claims a due job by updating its
+status, so several workers can share the queue. A job that raises is retried
+up to JOB_MAX_ATTEMPTS times with exponential backoff, and a job whose
+worker died is run again once its JOB_VISIBILITY_TIMEOUT has passed. Jobs
+with the same key (e.g. the turns of one thread) run one at a time, in the
+order they were queued.
+Typical usage example:
+
+    job = enqueue("agent_turn", {"thread": thread.pk, "content": "Hi"}, user=user)
+    Worker(concurrency=4).run()
+"""
+
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .ai.persistence import write_behind
+from .models import Job, Thread
+
+logger = logging.getLogger(__name__)
+
+# Functions running each kind of job, by kind
+handlers = {}
+
+# How often a worker deletes old finished jobs, in seconds
+PURGE_INTERVAL = 60
+
+
+def handler(kind):
+    """Registers a function as the handler of a kind of job.
+
+    The function is called with the Job and returns a JSON-serializable
+    result, stored in job.result.
+    """
+
+    def register(fn):
+        handlers[kind] = fn
+        return fn
+
+    return register
+
+
+def enqueue(kind, payload, user=None, key=""):
+    """Queues a job.
+
+    Args:
+        kind: The kind of job, one of the registered handlers.
+        payload: A JSON-serializable dictionary passed to the handler.
+        user: The CustomUser the job runs for, or None.
+        key: Jobs with the same non-empty key run one at a time, in order.
+
+    Returns:
+        The queued Job.
+    """
+    return Job.objects.create(kind=kind, payload=payload, user=user, key=key)
+
+
+def claim():
+    """Claims the next due job for this worker.
+
+    Returns:
+        The claimed Job, now running, or None if no job is due.
+    """
+    now = timezone.now()
+    due = Q(status=Job.QUEUED, run_after__lte=now) | Q(
+        status=Job.RUNNING, locked_until__lte=now
+    )
+    earlier_in_line = Job.objects.filter(
+        key=OuterRef("key"),
+        pk__lt=OuterRef("pk"),
+        status__in=[Job.QUEUED, Job.RUNNING],
+    )
+    candidates = (
+        Job.objects.filter(due)
+        .exclude(~Q(key="") & Exists(earlier_in_line))
+        .order_by("pk")
+    )
+    for job in candidates[:10]:
+        # Another worker may claim the same job first
+        claimed = Job.objects.filter(
+            pk=job.pk, status=job.status, attempts=job.attempts
+        ).update(
+            status=Job.RUNNING,
+            attempts=F("attempts") + 1,
+            locked_until=now + timedelta(seconds=settings.JOB_VISIBILITY_TIMEOUT),
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run(job):
+    """Runs a claimed job and records its result, or queues its retry."""
+    fields = {}
+    try:
+        fields["result"] = handlers[job.kind](job)
+        fields["status"] = Job.DONE
+    except Exception as exc:
+        logger.exception("Job %s failed (attempt %d)", job, job.attempts)
+        fields["error"] = f"{type(exc).__name__}: {exc}"
+        if job.attempts < settings.JOB_MAX_ATTEMPTS:
+            delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            fields["status"] = Job.QUEUED
+            fields["run_after"] = timezone.now() + timedelta(seconds=delay)
+        else:
+            fields["status"] = Job.FAILED
+
+    # The job is left alone if it timed out and another worker claimed it
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING, attempts=job.attempts).update(
+        locked_until=None, updated_at=timezone.now(), **fields
+    )
+
+
+def purge():
+    """Deletes finished jobs older than JOB_RETENTION seconds."""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_RETENTION)
+    return Job.objects.filter(
+        status__in=[Job.DONE, Job.FAILED], updated_at__lt=cutoff
+    ).delete()[0]
+
+
+class Worker:
+    """Runs jobs from the queue on a fixed number of threads.
+
+    Attributes:
+        concurrency: The number of jobs run at the same time.
+        poll_interval: The number of seconds to wait when no job is due.
+    """
+
+    def __init__(self, concurrency=4, poll_interval=0.5):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+
+    def run(self):
+        """Runs jobs until stop() is called."""
+        threads = [
+            threading.Thread(target=self._loop, name=f"job-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        while not self.stopping.wait(PURGE_INTERVAL):
+            try:
+                purge()
+            except Exception:
+                logger.exception("Failed to purge finished jobs")
+            finally:
+                close_old_connections()
+        for thread in threads:
+            thread.join()
+
+    def run_until_empty(self):
+        """Runs due jobs one after another until none is left."""
+        count = 0
+        while (job := claim()) is not None:
+            run(job)
+            count += 1
+        return count
+
+    def stop(self):
+        """Lets the running jobs finish, then stops the worker threads."""
+        self.stopping.set()
+
+    def _loop(self):
+        while not self.stopping.is_set():
+            try:
+                job = claim()
+                if job is None:
+                    self.stopping.wait(self.poll_interval)
+                else:
+                    run(job)
+            except Exception:
+                logger.exception("Job worker error")
+                self.stopping.wait(self.poll_interval)
+            finally:
+                close_old_connections()
+
+
+@handler("agent_turn")
+def run_agent_turn(job):
+    """Gets the agent's reply to a message and saves the turn to its thread.
+
+    Returns:
+        A dictionary with the ids of the turn's messages.
+    """
+    from .ai.agent import Agent
+
+    thread = Thread.objects.get(pk=job.payload["thread"])
+    agent = Agent(thread=thread, prompt=thread.prompt)
+    agent.chat(job.payload["content"])
+    if any(message.pk is None for message in agent.last_turn):
+        write_behind.flush()  # The ids are set once the turn is written
+    return {"messages": [message.pk for message in agent.last_turn]}
+
+
+def enqueue_turn(thread, content, user):
+    """Queues the agent's reply to a message of a thread."""
+    return enqueue(
+        "agent_turn",
+        {"thread": thread.pk, "content": content},
+        user=user,
+        key=f"thread:{thread.pk}",
+    )
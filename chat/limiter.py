@@ -0,0 +1,245 @@
+"""This module contains the adaptive concurrency limits of upstream requests.
+
+Each worker process limits the requests it has in flight to each endpoint
+and model. The limit adapts (additive increase, multiplicative decrease): it
+grows by one for every limit's worth of successful requests, halves when
+the upstream throttles a request (429) or cannot be reached, and shrinks by
+a tenth when a request takes LATENCY_SPIKE_RATIO times the usual latency.
+Requests over the limit wait in line for up to UPSTREAM_QUEUE_TIMEOUT
+seconds, then fail with ConcurrencyLimitExceeded.
+Typical usage example:
+
+    with get_limiter(("https://eastus.openai.azure.com", "gpt-4o")).slot() as outcome:
+        outcome.throttled = send().status_code == 429
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+# Factor applied to the limit when a request is throttled, and when it is slow
+THROTTLED_DECREASE = 0.5
+SLOW_DECREASE = 0.9
+# A request is slow when it takes this many times the usual latency
+LATENCY_SPIKE_RATIO = 3.0
+# Weight of the latest request in the usual latency
+LATENCY_SMOOTHING = 0.05
+
+
+class ConcurrencyLimitExceeded(Exception):
+    """Raised when a request waited too long for the concurrency limit."""
+
+
+class _Waiter:
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+
+
+class _Outcome:
+    throttled = False
+
+
+class AdaptiveLimiter:
+    """An AIMD concurrency limit with a first-in, first-out waiting line.
+
+    Attributes:
+        limit: The current limit, a float between min_limit and max_limit of
+               which the integer part is enforced.
+        min_limit: The lowest limit.
+        max_limit: The highest limit, also the initial one.
+        queue_timeout: The number of seconds a request waits for the limit.
+        in_flight: The number of requests holding a slot.
+        latency: The usual latency of successful requests in seconds, or None.
+    """
+
+    def __init__(self, max_limit=100, min_limit=1, queue_timeout=10):
+        self.limit = float(max_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.latency = None
+        self._waiters = deque()
+        self._decrease_after = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self):
+        """Returns the number of requests waiting for a slot."""
+        return len(self._waiters)
+
+    def _try_acquire(self, waiter):
+        # Called with the lock held; waiting requests go first
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return True
+        self._waiters.append(waiter)
+        return False
+
+    def _grant(self):
+        # Called with the lock held
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            self.in_flight += 1
+            waiter.wake()
+
+    def _abandon(self, waiter):
+        """Gives up waiting; returns True if the slot was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def acquire(self):
+        """Waits for a slot, raising ConcurrencyLimitExceeded after queue_timeout."""
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        with self._lock:
+            if self._try_acquire(waiter):
+                return
+        if not event.wait(self.queue_timeout) and not self._abandon(waiter):
+            raise ConcurrencyLimitExceeded(
+                f"No upstream capacity within {self.queue_timeout} seconds"
+            )
+
+    async def aacquire(self):
+        """Awaits a slot; the async version of acquire."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = _Waiter(wake)
+        with self._lock:
+            if self._try_acquire(waiter):
+                return
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(waiter):
+                raise ConcurrencyLimitExceeded(
+                    f"No upstream capacity within {self.queue_timeout} seconds"
+                ) from None
+        except BaseException:
+            # Cancelled while waiting: hand a granted slot back
+            if self._abandon(waiter):
+                self.release(None, throttled=False)
+            raise
+
+    def release(self, seconds, throttled):
+        """Frees a slot and adapts the limit to the outcome of its request.
+
+        Args:
+            seconds: The latency of the request, or None if unknown.
+            throttled: True if the upstream throttled or dropped the request.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            if throttled:
+                self._decrease(THROTTLED_DECREASE, now)
+            elif seconds is not None:
+                if self.latency is not None and seconds > LATENCY_SPIKE_RATIO * self.latency:
+                    self._decrease(SLOW_DECREASE, now)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.latency = (
+                    seconds
+                    if self.latency is None
+                    else (1 - LATENCY_SMOOTHING) * self.latency + LATENCY_SMOOTHING * seconds
+                )
+            self._grant()
+
+    def _decrease(self, factor, now):
+        # Requests sent before a decrease report their outcome after it, so
+        # the limit is decreased at most once per usual latency
+        if now < self._decrease_after:
+            return
+        self.limit = max(self.min_limit, self.limit * factor)
+        self._decrease_after = now + (self.latency or 1.0)
+
+    @contextmanager
+    def slot(self, is_throttled=None):
+        """Holds a slot while a request is sent.
+
+        Args:
+            is_throttled: A function telling whether an exception raised by
+                          the request means the upstream is overloaded, or
+                          None to count every exception as throttling.
+
+        The yielded outcome's throttled attribute should be set to True if
+        the upstream throttled the request.
+        """
+        self.acquire()
+        outcome = _Outcome()
+        start = time.monotonic()
+        try:
+            yield outcome
+        except BaseException as exc:
+            if is_throttled is None or is_throttled(exc):
+                outcome.throttled = True
+            raise
+        finally:
+            self.release(time.monotonic() - start, outcome.throttled)
+
+    @asynccontextmanager
+    async def aslot(self, is_throttled=None):
+        """Holds a slot while a request is sent; the async version of slot."""
+        await self.aacquire()
+        outcome = _Outcome()
+        start = time.monotonic()
+        try:
+            yield outcome
+        except BaseException as exc:
+            if is_throttled is None or is_throttled(exc):
+                outcome.throttled = True
+            raise
+        finally:
+            self.release(time.monotonic() - start, outcome.throttled)
+
+    def stats(self):
+        """Returns the current limit, requests in flight and waiting ones."""
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "latency": self.latency,
+            }
+
+
+_lock = threading.Lock()
+_limiters = {}
+
+
+def get_limiter(key):
+    """Returns the limiter of an (endpoint, model) key, or None if disabled."""
+    if not settings.UPSTREAM_ADAPTIVE_CONCURRENCY:
+        return None
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.setdefault(
+                key,
+                AdaptiveLimiter(
+                    max_limit=settings.UPSTREAM_CONCURRENCY_MAX,
+                    min_limit=settings.UPSTREAM_CONCURRENCY_MIN,
+                    queue_timeout=settings.UPSTREAM_QUEUE_TIMEOUT,
+                ),
+            )
+    return limiter
+
+
+def stats():
+    """Returns the state of every limiter, by endpoint and model."""
+    with _lock:
+        limiters = list(_limiters.items())
+    return {f"{endpoint} {model}": limiter.stats() for (endpoint, model), limiter in limiters}
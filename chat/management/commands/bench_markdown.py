@@ -0,0 +1,72 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.rendering import render_markdown
+from chat.templatetags.markdown_filters import enhance_markdown_html, markdown_to_html
+
+CODE_BLOCK = '''```python
+def fetch(url, retries=3):
+    """Fetches a URL, retrying on "transient" errors."""
+    for attempt in range(retries):
+        if attempt > 0 and status < 500 and url != "":
+            return session.get(url, timeout=(5, 30)) & mask
+    return None
+```
+'''
+
+PROSE = """## Step {i}
+
+This step explains the `fetch` helper & how it *retries* requests:
+
+- It returns early when `status < 500`.
+- It uses a **shared** session.
+
+> Note: timeouts are in seconds.
+"""
+
+
+def build_message(sections):
+    """Builds a code-heavy assistant reply of the given number of sections."""
+    return "\n".join(PROSE.format(i=i) + "\n" + CODE_BLOCK for i in range(sections))
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the per-message render cost of the single-pass markdown renderer "
+        "with the markdown_to_html|enhance_markdown_html (BeautifulSoup) filters."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sections",
+            type=int,
+            default=20,
+            help="Number of prose and code block sections in the message.",
+        )
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        message = build_message(options["sections"])
+        renderers = [
+            ("markdown + BeautifulSoup", lambda: enhance_markdown_html(markdown_to_html(message))),
+            ("single pass", lambda: render_markdown(message)),
+        ]
+        outputs = {name: render() for name, render in renderers}
+        if len(set(outputs.values())) != 1:
+            self.stderr.write("Warning: the renderers produced different HTML")
+
+        self.stdout.write(
+            f"Message of {len(message)} characters, {options['sections']} code blocks"
+        )
+        for name, render in renderers:
+            timings = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                render()
+                timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(
+                f"  {name:<26} median {statistics.median(timings):.2f} ms, "
+                f"min {min(timings):.2f} ms"
+            )
@@ -0,0 +1,151 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from chat.models import Message, Thread
+
+BENCH_DB = "bench"
+BEFORE_MIGRATION = "0005_thread_max_history_tokens"
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a scratch SQLite database with messages and reports the query plans "
+        "and timings of the thread history and sidebar queries before and after "
+        "the composite index migration."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1_000_000)
+        parser.add_argument("--threads", type=int, default=10_000)
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument(
+            "--samples",
+            type=int,
+            default=200,
+            help="Number of random threads and users each query is timed for.",
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as db_dir:
+            connections.settings[BENCH_DB] = connections.configure_settings(
+                {
+                    "default": settings.DATABASES["default"],
+                    BENCH_DB: {
+                        "ENGINE": "django.db.backends.sqlite3",
+                        "NAME": os.path.join(db_dir, "bench.sqlite3"),
+                    },
+                }
+            )[BENCH_DB]
+            try:
+                self._run(options)
+            finally:
+                connections[BENCH_DB].close()
+                del connections[BENCH_DB]
+
+    def _run(self, options):
+        call_command("migrate", "chat", BEFORE_MIGRATION, database=BENCH_DB, verbosity=0)
+
+        start = time.perf_counter()
+        self._seed(options["users"], options["threads"], options["messages"])
+        self.stdout.write(
+            f"Seeded {options['messages']} messages in {options['threads']} threads "
+            f"for {options['users']} users in {time.perf_counter() - start:.1f}s"
+        )
+
+        self._report("Before indexes", options)
+        start = time.perf_counter()
+        call_command("migrate", "chat", database=BENCH_DB, verbosity=0)
+        self.stdout.write(f"\nBuilt indexes in {time.perf_counter() - start:.1f}s")
+        self._report("After indexes", options)
+
+    def _seed(self, users, threads, messages):
+        with connections[BENCH_DB].cursor() as cursor:
+            # The scratch database does not need to survive a crash
+            cursor.execute("PRAGMA synchronous = OFF")
+        now = datetime.now(timezone.utc)
+        # The rows are inserted with the columns of the schema at BEFORE_MIGRATION,
+        # which lacks fields the current models have
+        with transaction.atomic(using=BENCH_DB), connections[BENCH_DB].cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO chat_customuser (id, password, is_superuser, first_name, "
+                "last_name, is_staff, is_active, date_joined, email) "
+                "VALUES (%s, '', 0, '', '', 0, 1, %s, %s)",
+                [(i, now, f"user{i}@example.com") for i in range(1, users + 1)],
+            )
+            cursor.executemany(
+                "INSERT INTO chat_thread (id, user_id, name, model, temperature, prompt, "
+                "created_at) VALUES (%s, %s, %s, 'gpt-4o-mini', 0, '', %s)",
+                [
+                    (i, i % users + 1, f"Thread {i}", now - timedelta(minutes=threads - i))
+                    for i in range(1, threads + 1)
+                ],
+            )
+
+            # Messages of different threads are interleaved, as they are in use
+            rng = random.Random(0)
+            batch = []
+            for i in range(1, messages + 1):
+                thread_id = rng.randint(1, threads)
+                role = "user" if i % 2 else "assistant"
+                timestamp = now - timedelta(seconds=messages - i)
+                batch.append(
+                    (thread_id % users + 1, thread_id, role, f"Message {i}", timestamp)
+                )
+                if len(batch) == 10_000 or i == messages:
+                    cursor.executemany(
+                        "INSERT INTO chat_message (user_id, thread_id, role, content, "
+                        "timestamp) VALUES (%s, %s, %s, %s, %s)",
+                        batch,
+                    )
+                    batch = []
+            cursor.execute("ANALYZE")
+
+    def _report(self, title, options):
+        rng = random.Random(1)
+        thread_ids = [rng.randint(1, options["threads"]) for _ in range(options["samples"])]
+        user_ids = [rng.randint(1, options["users"]) for _ in range(options["samples"])]
+
+        # The queries select only columns that exist before the migrations
+        # applied after BEFORE_MIGRATION, like the app's own queries do
+        queries = [
+            (
+                "Thread history",
+                lambda pk: Message.objects.using(BENCH_DB)
+                .filter(thread_id=pk)
+                .order_by("timestamp")
+                .values_list("pk", "role", "content"),
+                thread_ids,
+            ),
+            (
+                "Sidebar threads",
+                lambda pk: Thread.objects.using(BENCH_DB)
+                .filter(user_id=pk)
+                .only("id", "name")
+                .order_by("-created_at"),
+                user_ids,
+            ),
+        ]
+
+        self.stdout.write(f"\n{title}")
+        for name, make_queryset, ids in queries:
+            timings = []
+            for pk in ids:
+                start = time.perf_counter()
+                list(make_queryset(pk))
+                timings.append((time.perf_counter() - start) * 1000)
+
+            self.stdout.write(
+                f"  {name}: mean {statistics.mean(timings):.2f} ms, "
+                f"median {statistics.median(timings):.2f} ms"
+            )
+            for line in make_queryset(ids[0]).explain().splitlines():
+                self.stdout.write(f"    {line}")
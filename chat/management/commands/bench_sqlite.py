@@ -0,0 +1,148 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+from chat.db import sqlite_pragmas
+from chat.models import Message, Thread
+
+BENCH_DB = "bench"
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs concurrent readers and writers in several processes against a scratch "
+        "SQLite database, comparing SQLite's defaults and a new connection per request "
+        "with WAL, the tuning pragmas and persistent connections."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=8)
+        parser.add_argument(
+            "--seconds", type=float, default=5, help="Duration of each run."
+        )
+        parser.add_argument(
+            "--write-ratio",
+            type=float,
+            default=0.2,
+            help="Fraction of the operations that save a chat turn.",
+        )
+        parser.add_argument("--threads", type=int, default=100)
+
+    def handle(self, *args, **options):
+        modes = [
+            ("defaults, new connections", {"PRAGMAS": {}}, False),
+            (
+                "tuned, persistent",
+                {"PRAGMAS": sqlite_pragmas(busy_timeout=settings.SQLITE_BUSY_TIMEOUT)},
+                True,
+            ),
+        ]
+        self.stdout.write(
+            f"{'mode':<28}{'ops/s':>9}{'reads/s':>9}{'writes/s':>9}"
+            f"{'p95 ms':>9}{'locked':>8}"
+        )
+        for name, database, persistent in modes:
+            with tempfile.TemporaryDirectory() as db_dir:
+                connections.settings[BENCH_DB] = connections.configure_settings(
+                    {
+                        "default": settings.DATABASES["default"],
+                        BENCH_DB: {
+                            "ENGINE": "django.db.backends.sqlite3",
+                            "NAME": os.path.join(db_dir, "bench.sqlite3"),
+                            # The default busy timeout of Python's sqlite3 module
+                            "OPTIONS": {"timeout": 5},
+                            **database,
+                        },
+                    }
+                )[BENCH_DB]
+                try:
+                    self._seed(options["threads"])
+                    results = self._run(options, persistent)
+                finally:
+                    connections[BENCH_DB].close()
+                    del connections[BENCH_DB]
+
+            reads = sum(r["reads"] for r in results)
+            writes = sum(r["writes"] for r in results)
+            latencies = sorted(ms for r in results for ms in r["latencies"])
+            p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+            seconds = options["seconds"]
+            self.stdout.write(
+                f"{name:<28}{(reads + writes) / seconds:>9.0f}{reads / seconds:>9.0f}"
+                f"{writes / seconds:>9.0f}{p95:>9.1f}"
+                f"{sum(r['locked'] for r in results):>8}"
+            )
+
+    def _seed(self, threads):
+        call_command("migrate", database=BENCH_DB, verbosity=0)
+        # bulk_create skips the signals, which use the default database
+        (user,) = get_user_model().objects.using(BENCH_DB).bulk_create(
+            [get_user_model()(email="bench@example.com", password="")]
+        )
+        Thread.objects.using(BENCH_DB).bulk_create(
+            Thread(user=user, name=f"Thread {i}") for i in range(threads)
+        )
+        Message.objects.using(BENCH_DB).bulk_create(
+            Message(thread=thread, user=user, content=f"Message {i}", role="user")
+            for thread in Thread.objects.using(BENCH_DB)
+            for i in range(20)
+        )
+        # Each process opens its own connection
+        connections[BENCH_DB].close()
+
+    def _run(self, options, persistent):
+        context = multiprocessing.get_context("fork")
+        with context.Pool(options["processes"]) as pool:
+            return pool.starmap(
+                _work,
+                [
+                    (seed, options["seconds"], options["write_ratio"], persistent)
+                    for seed in range(options["processes"])
+                ],
+            )
+
+
+def _work(seed, seconds, write_ratio, persistent):
+    """Reads thread histories and saves turns, like a web worker, for a while."""
+    rng = random.Random(seed)
+    connection = connections[BENCH_DB]
+    thread_ids = list(Thread.objects.using(BENCH_DB).values_list("pk", flat=True))
+    user_id = Thread.objects.using(BENCH_DB).values_list("user_id", flat=True)[0]
+    result = {"reads": 0, "writes": 0, "locked": 0, "latencies": []}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if not persistent:
+            connection.close()  # CONN_MAX_AGE=0 closes the connection per request
+        thread_id = rng.choice(thread_ids)
+        write = rng.random() < write_ratio
+        start = time.perf_counter()
+        try:
+            if write:
+                with transaction.atomic(using=BENCH_DB):
+                    Message.objects.using(BENCH_DB).bulk_create(
+                        [
+                            Message(thread_id=thread_id, user_id=user_id, content="Hi", role="user"),
+                            Message(thread_id=thread_id, user_id=user_id, content="Hello", role="assistant"),
+                        ]
+                    )
+            else:
+                list(
+                    Message.objects.using(BENCH_DB)
+                    .filter(thread_id=thread_id)
+                    .order_by("-timestamp")[:50]
+                )
+        except OperationalError:
+            result["locked"] += 1
+            continue
+        result["latencies"].append((time.perf_counter() - start) * 1000)
+        result["writes" if write else "reads"] += 1
+    connection.close()
+    return result
@@ -0,0 +1,55 @@
+import statistics
+import time
+
+import requests
+from django.core.management.base import BaseCommand
+
+from chat import upstream
+from ._fake_upstream import FakeUpstream
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the per-request overhead of calling the upstream API with a "
+        "fresh connection per request versus the shared pooled client, against "
+        "a local fake upstream."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument(
+            "--delay",
+            type=float,
+            default=0.0,
+            help="Seconds the fake upstream waits before answering.",
+        )
+
+    def handle(self, *args, **options):
+        body = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "Hi"}]}
+
+        with FakeUpstream(delay=options["delay"]) as fake:
+            url = f"{fake.url}/chat/completions"
+            results = [
+                ("fresh connection", lambda: requests.post(url, json=body)),
+                ("pooled client", lambda: upstream.post(url, json=body)),
+            ]
+
+            self.stdout.write(
+                f"{'client':<18}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'conns':>8}"
+            )
+            for name, send in results:
+                send()  # Warm up (and, for the pooled client, open its connection)
+                connections = fake.connections
+                timings = []
+                for _ in range(options["requests"]):
+                    start = time.perf_counter()
+                    send().raise_for_status()
+                    timings.append((time.perf_counter() - start) * 1000)
+
+                timings.sort()
+                p95 = timings[int(len(timings) * 0.95) - 1]
+                self.stdout.write(
+                    f"{name:<18}{statistics.mean(timings):>10.2f}"
+                    f"{statistics.median(timings):>10.2f}{p95:>10.2f}"
+                    f"{fake.connections - connections:>8}"
+                )
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ._fake_upstream import FakeUpstream
+
+CREATE_TOKEN = """
+from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+user = get_user_model().objects.create_user(email="loadtest@example.com")
+print(Token.objects.create(user=user).key)
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Load tests the chat/completions passthrough against a local fake upstream, "
+        "comparing sync gunicorn workers, threaded (gthread) workers and the async "
+        "views under an ASGI worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=100,
+            help="Number of API requests sent at once.",
+        )
+        parser.add_argument(
+            "--delay",
+            type=float,
+            default=0.5,
+            help="Seconds the fake upstream takes to answer each request.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=3,
+            help="Number of sync and threaded gunicorn workers to compare against.",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=16,
+            help="Number of threads per threaded gunicorn worker.",
+        )
+
+    def handle(self, *args, **options):
+        servers = [
+            (
+                f"wsgi, {options['workers']} sync workers",
+                [
+                    "aistarterkit.wsgi:application",
+                    "--workers",
+                    str(options["workers"]),
+                    "--worker-class",
+                    "sync",
+                    # gunicorn.conf.py's threads would turn these into gthread workers
+                    "--threads",
+                    "1",
+                ],
+                {},
+            ),
+            (
+                f"wsgi, {options['workers']}x{options['threads']} gthread",
+                [
+                    "aistarterkit.wsgi:application",
+                    "--workers",
+                    str(options["workers"]),
+                    "--worker-class",
+                    "gthread",
+                    "--threads",
+                    str(options["threads"]),
+                ],
+                {},
+            ),
+            (
+                "asgi, 1 uvicorn worker",
+                [
+                    "aistarterkit.asgi:api_application",
+                    "--workers",
+                    "1",
+                    "--worker-class",
+                    "uvicorn_worker.UvicornWorker",
+                ],
+                {"ASYNC_PASSTHROUGH": "true"},
+            ),
+        ]
+
+        with tempfile.TemporaryDirectory() as db_dir, FakeUpstream(
+            delay=options["delay"]
+        ) as fake:
+            env = {
+                **os.environ,
+                "ENVIRONMENT": "development",
+                "SQLITE3_STORAGE_PATH": db_dir,
+                "OPENAI_API_TYPE": "azure",
+                "AZURE_OPENAI_ENDPOINT": fake.url,
+                "AZURE_OPENAI_API_KEY": "fake",
+            }
+            self._manage(env, "migrate", "--verbosity", "0")
+            token = self._manage(env, "shell", "--command", CREATE_TOKEN).strip()
+
+            self.stdout.write(
+                f"{'server':<28}{'req/s':>8}{'p50 s':>8}{'p95 s':>8}"
+                f"{'errors':>8}{'upstream in flight':>20}"
+            )
+            for name, server_args, server_env in servers:
+                fake.max_in_flight = 0
+                port = self._free_port()
+                process = subprocess.Popen(
+                    [sys.executable, "-m", "gunicorn", *server_args]
+                    + ["--bind", f"127.0.0.1:{port}", "--timeout", "300"],
+                    cwd=settings.BASE_DIR,
+                    env={**env, **server_env},
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+                try:
+                    self._wait_for_port(port)
+                    elapsed, latencies, errors = asyncio.run(
+                        self._load(port, token, options["concurrency"])
+                    )
+                finally:
+                    process.terminate()
+                    process.wait()
+
+                latencies.sort()
+                p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+                self.stdout.write(
+                    f"{name:<28}{options['concurrency'] / elapsed:>8.1f}"
+                    f"{statistics.median(latencies or [0]):>8.2f}{p95:>8.2f}"
+                    f"{errors:>8}{fake.max_in_flight:>20}"
+                )
+
+    def _manage(self, env, *args):
+        result = subprocess.run(
+            [sys.executable, "manage.py", *args],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(result.stderr)
+        return result.stdout
+
+    def _free_port(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    def _wait_for_port(self, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f"The server did not start on port {port}")
+
+    async def _load(self, port, token, concurrency):
+        url = f"http://127.0.0.1:{port}/chat/api/v1/chat/completions"
+        body = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "Hi"}]}
+        headers = {"Authorization": f"Bearer {token}"}
+        limits = httpx.Limits(max_connections=concurrency)
+
+        async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+
+            async def send():
+                start = time.perf_counter()
+                response = await client.post(url, json=body, headers=headers)
+                return response.status_code, time.perf_counter() - start
+
+            start = time.perf_counter()
+            results = await asyncio.gather(
+                *(send() for _ in range(concurrency)), return_exceptions=True
+            )
+            elapsed = time.perf_counter() - start
+
+        latencies = [r[1] for r in results if not isinstance(r, Exception) and r[0] == 200]
+        return elapsed, latencies, len(results) - len(latencies)
@@ -0,0 +1,89 @@
+import os
+import re
+import resource
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a web worker imports before serving its first request: the WSGI
+# application (settings, apps and models), the URLconf and its views, and the
+# template tags of the chat pages
+WORKER_MODULES = ["aistarterkit.wsgi", "chat.urls", "chat.templatetags.markdown_filters"]
+
+# Dependencies that should only be imported on first use
+HEAVY_MODULES = ["openai", "numpy", "httpx", "requests", "tenacity", "bs4", "chromadb"]
+
+# A line of `python -X importtime` output: self and cumulative microseconds
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports the modules a web worker loads in a fresh interpreter and reports "
+        "the cold-start cost of the slowest ones (from `python -X importtime`) and "
+        "the interpreter's peak memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "modules",
+            nargs="*",
+            default=WORKER_MODULES,
+            help="Modules to import (default: the modules a web worker loads).",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=25,
+            help="Number of modules reported, slowest (cumulative time) first.",
+        )
+
+    def handle(self, *args, **options):
+        code = "import django; django.setup()\n" + "".join(
+            f"import {module}\n" for module in options["modules"]
+        )
+        env = dict(os.environ)
+        env.setdefault("DJANGO_SETTINGS_MODULE", "aistarterkit.settings")
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            env=env,
+            cwd=settings.BASE_DIR,  # So the project's packages are importable
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            errors = [
+                line
+                for line in result.stderr.splitlines()
+                if not line.startswith("import time:")
+            ]
+            raise CommandError("\n".join(errors))
+        # The only child process so far, so its peak is the interpreter's (KiB)
+        peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+        imports = []
+        total = 0
+        for line in result.stderr.splitlines():
+            match = IMPORTTIME_RE.match(line)
+            if match is None:
+                continue
+            own, cumulative, indent, name = match.groups()
+            imports.append((int(cumulative), int(own), name))
+            if len(indent) == 1:  # Imported by the profiled code itself
+                total += int(cumulative)
+
+        self.stdout.write(f"{'cumulative ms':>14} {'self ms':>8}  module")
+        for cumulative, own, name in sorted(imports, reverse=True)[: options["limit"]]:
+            self.stdout.write(f"{cumulative / 1000:>14.1f} {own / 1000:>8.1f}  {name}")
+
+        loaded = {name for _, _, name in imports}
+        heavy = [name for name in HEAVY_MODULES if name in loaded]
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {len(imports)} modules in {total / 1000:.0f} ms; "
+                f"peak memory {peak_rss / 1024:.1f} MiB"
+            )
+        )
+        self.stdout.write(f"Heavy dependencies loaded: {', '.join(heavy) or 'none'}")
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.models import Message
+from chat.rendering import RENDERER_VERSION
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders the stored HTML of messages rendered with an older renderer "
+        "version (or never rendered), in chunks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Number of messages rendered and updated per transaction.",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Re-render every message, including up-to-date ones.",
+        )
+
+    def handle(self, *args, **options):
+        messages = Message.objects.only("pk", "content").order_by("pk")
+        if not options["all"]:
+            messages = messages.exclude(content_html_version=RENDERER_VERSION)
+
+        rendered = 0
+        last_pk = 0
+        while True:
+            chunk = list(messages.filter(pk__gt=last_pk)[: options["chunk_size"]])
+            if not chunk:
+                break
+            for message in chunk:
+                message.render_content()
+            with transaction.atomic():
+                Message.objects.bulk_update(chunk, ["content_html", "content_html_version"])
+            rendered += len(chunk)
+            last_pk = chunk[-1].pk
+            self.stdout.write(f"Rendered {rendered} messages")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rendered {rendered} messages with renderer version {RENDERER_VERSION}")
+        )
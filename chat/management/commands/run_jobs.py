@@ -0,0 +1,48 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs background jobs, e.g. the agent's replies to chat messages, until "
+        "it receives SIGINT or SIGTERM."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.JOB_WORKER_CONCURRENCY,
+            help="Number of jobs run at the same time.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=0.5,
+            help="Seconds to wait for new jobs when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Run the due jobs one after another, then exit.",
+        )
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            concurrency=options["concurrency"], poll_interval=options["poll_interval"]
+        )
+        if options["once"]:
+            count = worker.run_until_empty()
+            self.stdout.write(self.style.SUCCESS(f"Ran {count} jobs"))
+            return
+
+        # Finish the running jobs before exiting
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: worker.stop())
+        self.stdout.write(f"Running jobs on {worker.concurrency} threads")
+        worker.run()
+        self.stdout.write(self.style.SUCCESS("Stopped"))
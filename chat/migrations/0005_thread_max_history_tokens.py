@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_alter_thread_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='max_history_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='thread',
+            name='model',
+            field=models.CharField(choices=[('gpt-35-turbo-16k', 'gpt-35-turbo-16k'), ('gpt-4o', 'gpt-4o'), ('gpt-4o-mini', 'gpt-4o-mini')], default='gpt-4o-mini', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='thread',
+            name='temperature',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_message_content_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='threads_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
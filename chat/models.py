@@ -3,6 +3,8 @@ from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .rendering import RENDERER_VERSION, render_markdown
+
 
 class CustomUserManager(BaseUserManager):
     use_in_migrations = True
@@ -34,6 +36,8 @@ class CustomUser(AbstractUser):
 
     USERNAME_FIELD = "email"  # Use email as the unique identifier
     REQUIRED_FIELDS = []  # Remove email from REQUIRED_FIELDS
+    # Incremented whenever the user's thread list changes; keys the cached sidebar
+    threads_version = models.PositiveIntegerField(default=0, editable=False)
 
     objects = CustomUserManager()  # Use the custom manager
 
@@ -55,6 +59,15 @@ class Thread(models.Model):
     temperature = models.FloatField(default=0)
     prompt = models.TextField()
     created_at = models.DateTimeField(default=timezone.now)  # Add this field
+    # Token budget for the conversation history sent with each message;
+    # falls back to settings.AGENT_HISTORY_TOKENS when not set
+    max_history_tokens = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Sidebar thread list: newest threads of a user first
+            models.Index(fields=["user", "-created_at"], name="chat_thread_user_created"),
+        ]
 
 
 class Message(models.Model):
@@ -69,3 +82,67 @@ class Message(models.Model):
     content = models.TextField()
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default="user")
     timestamp = models.DateTimeField(auto_now_add=True)
+    # The content rendered to HTML on write, and the renderer version used
+    content_html = models.TextField(blank=True, default="")
+    content_html_version = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Thread history in chronological order
+            models.Index(fields=["thread", "timestamp"], name="chat_message_thread_ts"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.render_content()
+        super().save(*args, **kwargs)
+
+    def render_content(self):
+        """Renders the content to HTML with the current renderer."""
+        self.content_html = render_markdown(self.content)
+        self.content_html_version = RENDERER_VERSION
+
+    @property
+    def html(self):
+        """The content as HTML, rendered now if the stored HTML is outdated."""
+        if self.content_html_version != RENDERER_VERSION:
+            return render_markdown(self.content)
+        return self.content_html
+
+
+class Job(models.Model):
+    """A task run in the background by the `run_jobs` worker command."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, blank=True)
+    kind = models.CharField(max_length=50)
+    # Jobs with the same key run one at a time, in the order they were queued
+    key = models.CharField(max_length=100, blank=True, default="")
+    payload = models.JSONField(default=dict)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    # A running job whose worker has not finished it by then is run again
+    locked_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Workers look for queued jobs that are due
+            models.Index(fields=["status", "run_after"], name="chat_job_status_run_after"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
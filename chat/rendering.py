@@ -0,0 +1,166 @@
+"""This module contains the rendering of message markdown to HTML.
+
+Markdown is converted with an extension that adds the chat's CSS classes
+while the document is still a tree, so each message is parsed and serialized
+once. The output matches `markdown_to_html|enhance_markdown_html` (which
+re-parses the HTML with BeautifulSoup), except that raw HTML written in a
+message is neither repaired nor given margin classes.
+
+Messages store their rendered HTML together with the RENDERER_VERSION it was
+rendered with. Bump RENDERER_VERSION whenever the output of render_markdown
+changes, then run `python manage.py render_messages` to re-render stored
+messages; until then they are rendered when displayed.
+Typical usage example:
+
+    html = render_markdown("**Hello**")
+"""
+
+import html
+import re
+import threading
+
+import markdown
+from markdown.extensions import Extension
+from markdown.postprocessors import Postprocessor
+from markdown.treeprocessors import Treeprocessor
+from markdown.util import HTML_PLACEHOLDER_RE
+
+RENDERER_VERSION = 2
+
+# Elements that get a bottom margin when a message has more than one
+BLOCK_TAGS = {
+    "p", "pre", "ul", "ol", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "hr", "li"
+}
+MARGIN_CLASS = "mb-4"
+
+
+def _add_class(element, name):
+    classes = element.get("class")
+    element.set("class", f"{classes} {name}" if classes else name)
+
+
+class ChatClassesTreeprocessor(Treeprocessor):
+    """Adds margin classes to block elements and language classes to code."""
+
+    def __init__(self, md, default_language=None):
+        super().__init__(md)
+        self.default_language = default_language
+
+    def run(self, root):
+        stash = self.md.htmlStash.rawHtmlBlocks
+        blocks = []
+        for element in root.iter():
+            if element.tag not in BLOCK_TAGS:
+                continue
+            match = HTML_PLACEHOLDER_RE.fullmatch(element.text or "")
+            if element.tag == "p" and len(element) == 0 and match:
+                index = int(match.group(1))
+                if self.md.postprocessors["raw_html"].isblocklevel(str(stash[index])):
+                    # The paragraph is replaced by stashed HTML: fenced code
+                    # blocks are styled there, other raw HTML is left alone.
+                    if str(stash[index]).startswith("<pre"):
+                        blocks.append(index)
+                    continue
+            blocks.append(element)
+
+        if len(blocks) > 1:
+            for block in blocks[:-1]:
+                if isinstance(block, int):
+                    stash[block] = stash[block].replace("<pre", f'<pre class="{MARGIN_CLASS}"', 1)
+                else:
+                    _add_class(block, MARGIN_CLASS)
+
+        if self.default_language is not None:
+            language_class = f"language-{self.default_language}"
+            for code in root.iter("code"):
+                if code.get("class") is None:
+                    code.set("class", language_class)
+            for block in blocks:
+                if isinstance(block, int) and "<code>" in stash[block]:
+                    stash[block] = stash[block].replace(
+                        "<code>", f'<code class="{language_class}">', 1
+                    )
+
+
+class NormalizeHtmlPostprocessor(Postprocessor):
+    """Writes void tags as `<br/>` and decodes character references.
+
+    This keeps the output identical to HTML serialized by BeautifulSoup.
+    """
+
+    PATTERN = re.compile(r"<[^<>]*>|&#?\w+;")
+    REFERENCE = re.compile(r"&#?\w+;")
+
+    def run(self, text):
+        return self.PATTERN.sub(self._normalize, text)
+
+    def _normalize(self, match):
+        token = match.group(0)
+        if not token.startswith("<"):
+            return self._decode_text(token)
+        if "&" in token:
+            token = self.REFERENCE.sub(self._decode_attribute, token)
+        return token[:-3] + "/>" if token.endswith(" />") else token
+
+    def _decode_text(self, reference):
+        character = html.unescape(reference)
+        if character == reference:
+            # BeautifulSoup keeps unknown references without the semicolon
+            return html.escape(reference[:-1], quote=False)
+        return html.escape(character, quote=False)
+
+    def _decode_attribute(self, match):
+        # Quotes and markup characters stay escaped inside attribute values
+        character = html.unescape(match.group(0))
+        return match.group(0) if character in "&<>\"'" else character
+
+
+class ChatMarkdownExtension(Extension):
+    def __init__(self, **kwargs):
+        self.config = {
+            "default_language": ["", "Language class for code without one"],
+        }
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md):
+        # Run after the inline patterns so inline code elements exist
+        md.treeprocessors.register(
+            ChatClassesTreeprocessor(md, self.getConfig("default_language") or None),
+            "chat_classes",
+            5,
+        )
+        md.postprocessors.register(NormalizeHtmlPostprocessor(md), "normalize_html", 10)
+
+
+_local = threading.local()
+
+
+def _get_markdown(default_language):
+    # Markdown instances are reusable but not thread-safe
+    instances = _local.__dict__.setdefault("instances", {})
+    if default_language not in instances:
+        instances[default_language] = markdown.Markdown(
+            extensions=[
+                "fenced_code",
+                ChatMarkdownExtension(default_language=default_language or ""),
+            ]
+        )
+    return instances[default_language]
+
+
+def render_markdown(content, default_language=None):
+    """Renders message markdown to the HTML shown in the chat.
+
+    Args:
+        content: A string containing markdown.
+        default_language: A language for the `language-*` class of code
+                          without one, or None to leave such code unmarked.
+
+    Returns:
+        A string containing HTML.
+    """
+    md = _get_markdown(default_language)
+    try:
+        return md.convert(content)
+    finally:
+        md.reset()
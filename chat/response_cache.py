@@ -0,0 +1,217 @@
+"""This module contains the response cache of the API passthrough.
+
+Deterministic requests (temperature 0, a single choice, not streamed) are
+cached by a hash of the endpoint and the canonical JSON of the request body,
+which includes the model. Responses are kept in a SQLite file of their own,
+so they are shared by all worker processes and survive restarts. Entries
+expire after RESPONSE_CACHE_TTL seconds, and the least recently used entries
+are evicted beyond RESPONSE_CACHE_SIZE.
+
+The file also records which requests are being fetched, so that a worker
+can wait for another worker's response to the same request instead of
+fetching it again.
+Typical usage example:
+
+    key = request_cache_key("chat/completions", request_data)
+    if key is not None:
+        body = response_cache.get(key)
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+CREATE TABLE IF NOT EXISTS flights (
+    key TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def request_cache_key(path, request_data):
+    """Computes the cache key of an API request, if it may be cached.
+
+    Args:
+        path: The upstream API path, e.g. "chat/completions".
+        request_data: The request body as a dictionary.
+
+    Returns:
+        A hex digest string, or None if the request is not deterministic.
+    """
+    if not isinstance(request_data, dict):
+        return None
+    if request_data.get("stream") or request_data.get("n", 1) != 1:
+        return None
+    if request_data.get("temperature") != 0:
+        return None
+    canonical = json.dumps(
+        {"path": path, "body": request_data},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    """A size-bounded, persistent cache of response bodies in SQLite.
+
+    Attributes:
+        path: The path of the SQLite file.
+        maxsize: The maximum number of responses kept; the least recently
+                 used ones are evicted beyond it.
+        ttl: The number of seconds a response stays valid.
+        hits: The number of lookups in this process that found a response.
+        misses: The number of lookups in this process that did not.
+    """
+
+    def __init__(self, path, maxsize=10000, ttl=86400):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+
+    def _connection(self):
+        # SQLite connections cannot be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        """Returns the cached response body of a key, or None."""
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute(
+            "SELECT body FROM responses WHERE key = ? AND created_at > ?",
+            (key, now - self.ttl),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return row[0]
+
+    def claim(self, key, timeout):
+        """Records that this worker is fetching the response of a key.
+
+        Args:
+            key: The cache key of the request.
+            timeout: The number of seconds after which the claim lapses, so
+                     a crashed worker does not block others.
+
+        Returns:
+            True if the key was claimed, False if another worker is
+            fetching it.
+        """
+        connection = self._connection()
+        now = time.time()
+        connection.execute("DELETE FROM flights WHERE key = ? AND expires_at <= ?", (key, now))
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO flights (key, expires_at) VALUES (?, ?)", (key, now + timeout)
+        )
+        return cursor.rowcount == 1
+
+    def release(self, key):
+        """Removes the claim on a key once its response is fetched (or failed)."""
+        self._connection().execute("DELETE FROM flights WHERE key = ?", (key,))
+
+    def poll(self, key):
+        """Checks on a key claimed by another worker.
+
+        Returns:
+            A (body, in_flight) tuple: the cached response body or None, and
+            whether the key is still claimed.
+        """
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute(
+            "SELECT body FROM responses WHERE key = ? AND created_at > ?",
+            (key, now - self.ttl),
+        ).fetchone()
+        if row is not None:
+            self.hits += 1
+            return row[0], False
+        in_flight = connection.execute(
+            "SELECT 1 FROM flights WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return None, in_flight is not None
+
+    def wait(self, key, timeout, interval=0.05):
+        """Waits for another worker to cache the response of a claimed key.
+
+        Returns:
+            The response body, or None if the other worker failed or the
+            timeout passed.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            body, in_flight = self.poll(key)
+            if body is not None or not in_flight or time.monotonic() >= deadline:
+                return body
+            time.sleep(interval)
+
+    def set(self, key, body):
+        """Caches a response body, evicting expired and least recently used ones."""
+        connection = self._connection()
+        now = time.time()
+        connection.execute(
+            "INSERT OR REPLACE INTO responses (key, body, created_at, accessed_at) "
+            "VALUES (?, ?, ?, ?)",
+            (key, body, now, now),
+        )
+        connection.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+        connection.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+            "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,),
+        )
+
+    def clear(self):
+        """Removes every cached response."""
+        self._connection().execute("DELETE FROM responses")
+        self._connection().execute("DELETE FROM flights")
+
+    def stats(self):
+        """Returns the hit and miss counters and the current size."""
+        (size,) = self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": size,
+            "maxsize": self.maxsize,
+        }
+
+    def _reset_after_fork(self):
+        self._local = threading.local()
+
+
+response_cache = ResponseCache(
+    settings.RESPONSE_CACHE_PATH,
+    maxsize=settings.RESPONSE_CACHE_SIZE,
+    ttl=settings.RESPONSE_CACHE_TTL,
+)
+
+# A forked worker opens its own connections
+os.register_at_fork(after_in_child=response_cache._reset_after_fork)
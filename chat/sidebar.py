@@ -0,0 +1,59 @@
+"""This module contains the thread list shown in the sidebar.
+
+The sidebar lists a user's newest threads, fetching only their ids and names,
+and loads older ones a page at a time. Each process caches the first page per
+user, keyed by the user's threads_version, which is incremented whenever a
+thread is created, renamed or deleted. The user is loaded on every request,
+so all worker processes see a change without any extra query.
+Typical usage example:
+
+    threads, has_more = get_sidebar_threads(request.user)
+"""
+
+from django.conf import settings
+from django.db.models import F, Q, Subquery
+
+from .caching import LRUCache
+from .models import CustomUser, Thread
+
+# Maps (user id, date joined, threads_version) to the first page of the user's threads
+sidebar_cache = LRUCache(maxsize=settings.SIDEBAR_CACHE_SIZE)
+
+
+def get_thread_page(user, before=None):
+    """Gets a page of a user's threads, newest first.
+
+    Args:
+        user: The user to list the threads of.
+        before: The id of the last thread already listed, or None for the
+                first page.
+
+    Returns:
+        A tuple of the list of threads (with only their ids and names loaded)
+        and whether there are more threads.
+    """
+    size = settings.SIDEBAR_THREADS
+    threads = Thread.objects.filter(user=user).only("id", "name").order_by("-created_at", "-pk")
+    if before is not None:
+        created_at = Subquery(Thread.objects.filter(pk=before, user=user).values("created_at"))
+        threads = threads.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=before)
+        )
+    page = list(threads[: size + 1])
+    return page[:size], len(page) > size
+
+
+def get_sidebar_threads(user):
+    """Gets the first page of a user's threads, from the cache when current."""
+    # date_joined tells apart a new user that reuses a deleted user's id
+    key = (user.pk, user.date_joined, user.threads_version)
+    page = sidebar_cache.get(key)
+    if page is None:
+        page = get_thread_page(user)
+        sidebar_cache.set(key, page)
+    return page
+
+
+def bump_threads_version(user_id):
+    """Marks a user's cached thread list as outdated in every process."""
+    CustomUser.objects.filter(pk=user_id).update(threads_version=F("threads_version") + 1)
@@ -0,0 +1,60 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .ai.history import invalidate_history
+from .authentication import invalidate_token
+from .db import apply_pragmas
+from .models import CustomUser, Thread
+from .sidebar import bump_threads_version
+
+
+@receiver(post_init, sender=Thread)
+def remember_thread_name(sender, instance, **kwargs):
+    # Read from __dict__ so threads loaded without their name stay deferred
+    instance._saved_name = instance.__dict__.get("name")
+
+
+@receiver(post_save, sender=Thread)
+def invalidate_new_thread_history(sender, instance, created, **kwargs):
+    # A new thread has no history, even if its id was used before
+    if created:
+        invalidate_history(instance.pk)
+
+
+@receiver(post_save, sender=Thread)
+def invalidate_sidebar_on_save(sender, instance, created, **kwargs):
+    name = instance.__dict__.get("name", instance._saved_name)
+    if created or name != instance._saved_name:
+        bump_threads_version(instance.user_id)
+    instance._saved_name = name
+
+
+@receiver(post_delete, sender=Thread)
+def invalidate_thread_history(sender, instance, **kwargs):
+    invalidate_history(instance.pk)
+
+
+@receiver(post_delete, sender=Thread)
+def invalidate_sidebar_on_delete(sender, instance, **kwargs):
+    bump_threads_version(instance.user_id)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_user_tokens(sender, instance, update_fields=None, **kwargs):
+    # Logging in only updates last_login, which does not affect the API
+    if update_fields == {"last_login"}:
+        return
+    for key in Token.objects.filter(user=instance).values_list("key", flat=True):
+        invalidate_token(key)
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    apply_pragmas(connection)
@@ -0,0 +1,107 @@
+"""This module contains the coalescing of identical in-flight upstream calls.
+
+When several threads (or asyncio tasks) of a worker make the same call at
+the same time, only the first one runs it; the others wait for it and
+receive its result, or its exception.
+Typical usage example:
+
+    reply = flights.do(key, lambda: client.chat.completions.create(**request))
+    response = await flights.ado(key, lambda: upstream.apost(endpoint, json=data))
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time, sharing its result.
+
+    Attributes:
+        calls: The number of calls that were run.
+        shared: The number of calls that waited for another one instead.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Calls fn, unless a call with the same key is in flight in another thread.
+
+        Args:
+            key: A hashable identifying the call.
+            fn: A function without arguments making the call.
+
+        Returns:
+            The result of fn, or of the call in flight.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def ado(self, key, coroutine_fn):
+        """Awaits coroutine_fn(), unless a call with the same key is in flight.
+
+        The call runs in its own task, so it completes for the other waiters
+        even if the request that started it is cancelled.
+
+        Args:
+            key: A hashable identifying the call.
+            coroutine_fn: A function without arguments returning an awaitable.
+
+        Returns:
+            The result of the call.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coroutine_fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+            self.calls += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        """Returns the call counters and the number of calls in flight."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "shared": self.shared,
+                "in_flight": len(self._calls) + len(self._tasks),
+            }
+
+
+flights = SingleFlight()
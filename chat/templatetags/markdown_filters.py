@@ -1,9 +1,14 @@
 from django import template
-from bs4 import BeautifulSoup
 import markdown
 
+from ..rendering import render_markdown as _render_markdown
+
 register = template.Library()
 
+@register.filter
+def render_markdown(md_string, default_language=None):
+    return _render_markdown(md_string, default_language)
+
 @register.filter
 def markdown_to_html(md_string):
     html = markdown.markdown(md_string, extensions=['fenced_code'])
@@ -12,6 +17,8 @@ def markdown_to_html(md_string):
 @register.filter
 @register.filter
 def enhance_markdown_html(html_string, default_language=None):
+    from bs4 import BeautifulSoup  # Only the legacy filter chain needs it
+
     soup = BeautifulSoup(html_string, 'html.parser')
     block_elements = soup.find_all(['p', 'pre', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'hr', 'li'])
 
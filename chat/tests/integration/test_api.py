@@ -1,8 +1,14 @@
+import os
+import tempfile
 import vcr
+from unittest.mock import MagicMock, patch
 from django.contrib.auth import get_user_model
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
+from chat.limiter import AdaptiveLimiter, ConcurrencyLimitExceeded
+from chat.response_cache import ResponseCache
 
 class OpenAIAPITest(APITestCase):
     def setUp(self):
@@ -34,4 +40,132 @@ class OpenAIAPITest(APITestCase):
         self.assertEqual(response.status_code, 200)
 
         # Assert that the response data is as expected
-        self.assertIn('choices', response.data)
\ No newline at end of file
+        self.assertIn('choices', response.data)
+
+    @patch('chat.views.upstream.post')
+    def test_openai_api_chat_completions_passthrough_stream(self, post):
+        chunks = [
+            b'data: {"choices": [{"delta": {"content": "Hello"}}]}\n\n',
+            b'data: [DONE]\n\n',
+        ]
+        upstream = MagicMock(status_code=200, headers={'Content-Type': 'text/event-stream'})
+        upstream.iter_content.return_value = iter(chunks)
+        post.return_value = upstream
+
+        request_data = {
+            "messages": [{"role": "user", "content": "Hello"}],
+            "model": "gpt-3.5-turbo",
+            "stream": True,
+        }
+        response = self.client.post(
+            self.api_url,
+            request_data,
+            format='json',
+            HTTP_AUTHORIZATION='Bearer ' + self.token.key
+        )
+
+        # The upstream events are relayed unchanged without buffering the body
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(list(response.streaming_content), chunks)
+        self.assertTrue(post.call_args.kwargs['stream'])
+        upstream.close.assert_called_once()
+
+    def test_stream_closed_before_it_is_read_frees_slot(self):
+        limiter = AdaptiveLimiter(max_limit=4)
+        upstream = MagicMock(status_code=200, headers={'Content-Type': 'text/event-stream'})
+        with patch('chat.upstream.get_limiter', return_value=limiter), \
+                patch('chat.upstream.get_session') as get_session:
+            get_session.return_value.post.return_value = upstream
+            response = self.client.post(
+                self.api_url,
+                {"messages": [], "model": "gpt-3.5-turbo", "stream": True},
+                format='json',
+                HTTP_AUTHORIZATION='Bearer ' + self.token.key
+            )
+        self.assertEqual(limiter.in_flight, 1)
+
+        # E.g. the client disconnected before the first chunk was sent
+        response.close()
+        self.assertEqual(limiter.in_flight, 0)
+        upstream.iter_content.assert_not_called()
+
+    @patch('chat.views.upstream.post', side_effect=ConcurrencyLimitExceeded("No upstream capacity"))
+    def test_openai_api_chat_completions_passthrough_overloaded(self, post):
+        response = self.client.post(
+            self.api_url,
+            {"messages": [{"role": "user", "content": "Hello"}], "model": "gpt-3.5-turbo"},
+            format='json',
+            HTTP_AUTHORIZATION='Bearer ' + self.token.key
+        )
+
+        # Requests that waited too long for upstream capacity are throttled
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(response.json()['error']['type'], 'rate_limit_exceeded')
+
+
+@override_settings(RESPONSE_CACHE=True)
+class ResponseCacheAPITest(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.token = Token.objects.create(user=self.user)
+        self.api_url = reverse('openai_api_chat_completions_passthrough')
+        self.request_data = {
+            "messages": [{"role": "user", "content": "Hello"}],
+            "model": "gpt-3.5-turbo",
+            "temperature": 0,
+        }
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = ResponseCache(os.path.join(directory.name, 'responses.sqlite3'))
+        cache_patch = patch('chat.views.response_cache', cache)
+        cache_patch.start()
+        self.addCleanup(cache_patch.stop)
+
+        post_patch = patch('chat.views.upstream.post')
+        self.post = post_patch.start()
+        self.addCleanup(post_patch.stop)
+        body = b'{"choices": [{"message": {"content": "Hi"}}]}'
+        self.post.return_value = MagicMock(
+            status_code=200, content=body, json=MagicMock(return_value={"choices": [{"message": {"content": "Hi"}}]})
+        )
+
+    def send(self, request_data, **extra):
+        return self.client.post(
+            self.api_url, request_data, format='json', HTTP_AUTHORIZATION='Bearer ' + self.token.key, **extra
+        )
+
+    def test_repeated_request_is_served_from_cache(self):
+        first = self.send(self.request_data)
+        second = self.send(self.request_data)
+
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.json(), first.json())
+        self.post.assert_called_once()
+
+    def test_nondeterministic_request_is_not_cached(self):
+        self.request_data['temperature'] = 0.7
+        self.send(self.request_data)
+        response = self.send(self.request_data)
+
+        self.assertNotIn('X-Cache', response)
+        self.assertEqual(self.post.call_count, 2)
+
+    def test_no_cache_header_bypasses_cache(self):
+        self.send(self.request_data)
+        response = self.send(self.request_data, HTTP_CACHE_CONTROL='no-cache')
+
+        self.assertNotIn('X-Cache', response)
+        self.assertEqual(self.post.call_count, 2)
+
+    def test_error_responses_are_not_cached(self):
+        self.post.return_value.status_code = 429
+        self.send(self.request_data)
+        response = self.send(self.request_data)
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(self.post.call_count, 2)
@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+from unittest.mock import patch
+import httpx
+from django.contrib.auth import get_user_model
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from chat import views
+from chat.response_cache import ResponseCache
+
+
+def upstream_handler(request):
+    body = json.loads(request.content)
+    if body.get("stream"):
+        return httpx.Response(
+            200,
+            headers={"Content-Type": "text/event-stream"},
+            content=b'data: {"choices": [{"delta": {"content": "Hi"}}]}\n\ndata: [DONE]\n\n',
+        )
+    return httpx.Response(200, json={"choices": [{"message": {"content": "Hi"}}]})
+
+
+class AsyncOpenAIAPITest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.token = Token.objects.create(user=self.user)
+        self.factory = AsyncRequestFactory()
+        self.client_patch = patch(
+            'chat.views.upstream.get_async_client',
+            side_effect=lambda: httpx.AsyncClient(transport=httpx.MockTransport(upstream_handler)),
+        )
+        self.client_patch.start()
+        self.addCleanup(self.client_patch.stop)
+
+    def post(self, data, **extra):
+        return self.factory.post(
+            '/chat/api/v1/chat/completions', data=data, content_type='application/json', **extra
+        )
+
+    async def test_chat_completions_passthrough(self):
+        request = self.post(
+            {"model": "gpt-3.5-turbo", "messages": []}, headers={'Authorization': 'Bearer ' + self.token.key}
+        )
+        response = await views.async_openai_api_chat_completions_passthrough(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('choices', json.loads(response.content))
+
+    async def test_chat_completions_passthrough_stream(self):
+        request = self.post(
+            {"model": "gpt-3.5-turbo", "messages": [], "stream": True},
+            headers={'Authorization': 'Bearer ' + self.token.key},
+        )
+        response = await views.async_openai_api_chat_completions_passthrough(request)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertTrue(body.endswith(b'data: [DONE]\n\n'))
+
+    async def test_requires_token(self):
+        response = await views.async_openai_api_completions_passthrough(self.post({}))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_rejects_unknown_token(self):
+        request = self.post({}, headers={'Authorization': 'Bearer not-a-token'})
+        response = await views.async_openai_api_completions_passthrough(request)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_rejects_body_that_is_not_an_object(self):
+        for body in ('[1, 2]', '"text"', 'not json'):
+            request = self.post(body, headers={'Authorization': 'Bearer ' + self.token.key})
+            response = await views.async_openai_api_chat_completions_passthrough(request)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.content), {"detail": "JSON parse error."})
+
+    @override_settings(RESPONSE_CACHE=True)
+    async def test_deterministic_request_is_cached(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = ResponseCache(os.path.join(directory.name, 'responses.sqlite3'))
+        data = {"model": "gpt-3.5-turbo", "messages": [], "temperature": 0}
+        headers = {'Authorization': 'Bearer ' + self.token.key}
+        with patch('chat.views.response_cache', cache):
+            first = await views.async_openai_api_chat_completions_passthrough(self.post(data, headers=headers))
+            second = await views.async_openai_api_chat_completions_passthrough(self.post(data, headers=headers))
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(json.loads(second.content), json.loads(first.content))
+        self.assertEqual(cache.hits, 1)
@@ -0,0 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from chat.models import Message, Thread
+
+
+@override_settings(THREAD_MESSAGES_PAGE_SIZE=3)
+class MessageHistoryTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.client.login(username='testuser@test.com', password='12345')
+        self.thread = Thread.objects.create(name='Test Thread', user=self.user)
+        self.messages = [
+            Message.objects.create(thread=self.thread, user=self.user, content=f'Message {i}')
+            for i in range(1, 8)
+        ]
+
+    def history_url(self, before):
+        return f"{reverse('message_history', kwargs={'pk': self.thread.pk})}?before={before.pk}"
+
+    def shown(self, response):
+        return [message.content for message in response.context['messages']]
+
+    def test_thread_detail_renders_newest_page(self):
+        response = self.client.get(reverse('thread_detail', kwargs={'pk': self.thread.pk}))
+        self.assertEqual(self.shown(response), ['Message 5', 'Message 6', 'Message 7'])
+        self.assertContains(response, self.history_url(self.messages[4]))
+        self.assertNotContains(response, 'Message 4')
+
+    def test_history_pages_back_to_first_message(self):
+        response = self.client.get(self.history_url(self.messages[4]))
+        self.assertEqual(self.shown(response), ['Message 2', 'Message 3', 'Message 4'])
+        self.assertContains(response, self.history_url(self.messages[1]))
+
+        response = self.client.get(self.history_url(self.messages[1]))
+        self.assertEqual(self.shown(response), ['Message 1'])
+        self.assertNotContains(response, 'data-thread-target="olderMessages"')
+
+    def test_history_breaks_timestamp_ties_by_id(self):
+        Message.objects.update(timestamp=self.messages[0].timestamp)
+        response = self.client.get(self.history_url(self.messages[4]))
+        self.assertEqual(self.shown(response), ['Message 2', 'Message 3', 'Message 4'])
+
+    def test_history_requires_cursor(self):
+        response = self.client.get(reverse('message_history', kwargs={'pk': self.thread.pk}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_history_of_other_users_thread(self):
+        get_user_model().objects.create_user(email='other@test.com', password='12345')
+        self.client.login(username='other@test.com', password='12345')
+        response = self.client.get(self.history_url(self.messages[4]))
+        self.assertEqual(response.status_code, 404)
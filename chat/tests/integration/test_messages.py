@@ -1,7 +1,10 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from chat.models import Thread, Message
+from chat.jobs import Worker
+from chat.models import Job, Thread, Message
+from unittest.mock import patch
+import re
 import vcr
 
 class MessageIntegrationTestCase(TestCase):
@@ -27,6 +30,31 @@ class MessageIntegrationTestCase(TestCase):
         ).exists()
         self.assertTrue(message_exists)  # Message should exist in the database and be associated with the correct user and thread
 
+    @patch('chat.ai.agent.client')
+    def test_message_creation_fragment(self, client):
+        client.chat.completions.create.return_value.choices[0].message.content = '**Hi** there!'
+
+        # Test that an AJAX send returns only the new messages instead of redirecting
+        response = self.client.post(
+            reverse('new_message', kwargs={'pk': self.thread.pk}),
+            {'content': 'Hello, World!'},
+            headers={'X-Requested-With': 'XMLHttpRequest'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Hello, World!')
+        self.assertContains(response, '<strong>Hi</strong> there!')
+        self.assertNotContains(response, 'Type a message...')  # Not the full page
+        self.assertEqual(Message.objects.filter(thread=self.thread).count(), 2)
+
+    def test_message_creation_fragment_errors(self):
+        response = self.client.post(
+            reverse('new_message', kwargs={'pk': self.thread.pk}),
+            {'content': ''},
+            headers={'X-Requested-With': 'XMLHttpRequest'},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('content', response.json()['errors'])
+
     def test_thread_view_with_messages(self):
         # Create a message within the thread
         Message.objects.create(thread=self.thread, user=self.user, content='Hello, World!')
@@ -55,4 +83,48 @@ class MessageNonAuthenticatedTestCase(TestCase):
 
     def tearDown(self):
         # Clean up after each test method
-        self.client.logout()
\ No newline at end of file
+        self.client.logout()
+
+
+@override_settings(CHAT_BACKGROUND_JOBS=True)
+class BackgroundMessageTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.client.login(username='testuser@test.com', password='12345')
+        self.thread = Thread.objects.create(name='Test Thread', user=self.user)
+
+    @patch('chat.ai.agent.client')
+    def test_message_reply_is_queued(self, client):
+        client.chat.completions.create.return_value.choices[0].message.content = '**Hi** there!'
+
+        # The page posts messages to the form's action instead of streaming them
+        page = self.client.get(reverse('thread_detail', kwargs={'pk': self.thread.pk}))
+        self.assertNotContains(page, 'data-thread-stream-url-value')
+        action = re.search(r'<form method="POST" action="([^"]+)" data-thread-target="form"', page.content.decode()).group(1)
+        self.assertEqual(action, reverse('new_message', kwargs={'pk': self.thread.pk}))
+
+        # The web request returns before the agent is called
+        response = self.client.post(
+            action,
+            {'content': 'Hello, World!'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(response.status_code, 202)
+        job = Job.objects.get(pk=response.json()['job'])
+        client.chat.completions.create.assert_not_called()
+        status = self.client.get(response.json()['status_url']).json()
+        self.assertEqual(status, {'status': 'queued'})
+
+        # A worker gets the reply, then the page receives the rendered turn
+        self.assertEqual(Worker().run_until_empty(), 1)
+        status = self.client.get(reverse('job_status', kwargs={'pk': job.pk})).json()
+        self.assertEqual(status['status'], 'done')
+        self.assertIn('Hello, World!', status['html'])
+        self.assertIn('<strong>Hi</strong> there!', status['html'])
+        self.assertEqual(Message.objects.filter(thread=self.thread).count(), 2)
+
+    def test_job_status_requires_job_owner(self):
+        other = get_user_model().objects.create_user(email='other@test.com', password='12345')
+        job = Job.objects.create(kind='agent_turn', user=other)
+        response = self.client.get(reverse('job_status', kwargs={'pk': job.pk}))
+        self.assertEqual(response.status_code, 404)
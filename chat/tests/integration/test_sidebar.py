@@ -0,0 +1,63 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from chat.models import Thread
+from chat.sidebar import get_sidebar_threads, sidebar_cache
+
+
+@override_settings(SIDEBAR_THREADS=3)
+class SidebarTestCase(TestCase):
+    def setUp(self):
+        sidebar_cache.clear()
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.client.login(username='testuser@test.com', password='12345')
+        self.threads = [Thread.objects.create(name=f'Thread {i}', user=self.user) for i in range(1, 6)]
+
+    def sidebar(self):
+        user = get_user_model().objects.get(pk=self.user.pk)  # As loaded by a new request
+        threads, has_more = get_sidebar_threads(user)
+        return [thread.name for thread in threads], has_more
+
+    def test_sidebar_lists_newest_threads(self):
+        self.assertEqual(self.sidebar(), (['Thread 5', 'Thread 4', 'Thread 3'], True))
+        response = self.client.get(reverse('thread_list'))
+        self.assertContains(response, f"{reverse('sidebar_threads')}?before={self.threads[2].pk}")
+        self.assertNotContains(response, 'Thread 2')
+
+    def test_sidebar_is_cached(self):
+        self.sidebar()
+        user = get_user_model().objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            get_sidebar_threads(user)
+
+    def test_sidebar_invalidated_by_thread_changes(self):
+        self.sidebar()
+        Thread.objects.create(name='Thread 6', user=self.user)
+        self.assertEqual(self.sidebar()[0], ['Thread 6', 'Thread 5', 'Thread 4'])
+
+        self.threads[4].name = 'Renamed'
+        self.threads[4].save()
+        self.assertEqual(self.sidebar()[0], ['Thread 6', 'Renamed', 'Thread 4'])
+
+        self.threads[3].delete()
+        self.assertEqual(self.sidebar()[0], ['Thread 6', 'Renamed', 'Thread 3'])
+
+    def test_saving_thread_settings_keeps_sidebar_cached(self):
+        self.sidebar()
+        version = get_user_model().objects.get(pk=self.user.pk).threads_version
+        self.threads[4].temperature = 1
+        self.threads[4].save()
+        self.assertEqual(get_user_model().objects.get(pk=self.user.pk).threads_version, version)
+
+    def test_show_more_fragment(self):
+        response = self.client.get(f"{reverse('sidebar_threads')}?before={self.threads[2].pk}")
+        self.assertContains(response, 'Thread 2')
+        self.assertContains(response, 'Thread 1')
+        self.assertNotContains(response, 'Thread 3')
+        self.assertNotContains(response, 'Show more')
+
+    def test_show_more_lists_only_own_threads(self):
+        other = get_user_model().objects.create_user(email='other@test.com', password='12345')
+        Thread.objects.create(name='Other Thread', user=other)
+        response = self.client.get(f"{reverse('sidebar_threads')}?before={self.threads[4].pk}")
+        self.assertNotContains(response, 'Other Thread')
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+from django.test import TestCase
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from chat.models import Thread, Message
+
+
+def make_chunk(content):
+    delta = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+class StreamMessageTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.client.login(username='testuser@test.com', password='12345')
+        self.thread = Thread.objects.create(name='Test Thread', user=self.user)
+
+    @patch('chat.ai.agent.client')
+    def test_stream_message(self, client):
+        client.chat.completions.create.return_value = iter(
+            [SimpleNamespace(choices=[]), make_chunk('Hello'), make_chunk(', World!'), make_chunk(None)]
+        )
+
+        response = self.client.post(reverse('stream_message', kwargs={'pk': self.thread.pk}), {'content': 'Hi!'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+
+        # Each delta is sent as its own event, followed by the rendered reply
+        self.assertIn('data: {"delta": "Hello"}', body)
+        self.assertIn('data: {"delta": ", World!"}', body)
+        self.assertIn('event: done', body)
+
+        # The turn is persisted once the stream completes
+        messages = Message.objects.filter(thread=self.thread).order_by('timestamp')
+        self.assertEqual([(m.role, m.content) for m in messages], [('user', 'Hi!'), ('assistant', 'Hello, World!')])
+
+    @patch('chat.ai.agent.client')
+    def test_stream_message_requires_thread_owner(self, client):
+        other = get_user_model().objects.create_user(email='other@test.com', password='12345')
+        thread = Thread.objects.create(name='Other Thread', user=other)
+        response = self.client.post(reverse('stream_message', kwargs={'pk': thread.pk}), {'content': 'Hi!'})
+        self.assertEqual(response.status_code, 404)
+        client.chat.completions.create.assert_not_called()
+
+    def test_stream_message_requires_login(self):
+        self.client.logout()
+        response = self.client.post(reverse('stream_message', kwargs={'pk': self.thread.pk}), {'content': 'Hi!'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Message.objects.exists())
@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from chat.models import Thread
@@ -40,6 +40,18 @@ class AuthenticatedThreadIntegrationTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'No messages yet.')  # Should be an empty thread at this state
 
+    def test_thread_detail_view_streams_replies(self):
+        # The page streams replies from the stream endpoint
+        response = self.client.get(reverse('thread_detail', kwargs={'pk': self.thread.pk}))
+        self.assertContains(response, f'data-thread-stream-url-value="{reverse("stream_message", kwargs={"pk": self.thread.pk})}"')
+
+    @override_settings(CHAT_STREAMING=False)
+    def test_thread_detail_view_without_streaming(self):
+        # Without a stream URL the page posts messages to the form's action
+        response = self.client.get(reverse('thread_detail', kwargs={'pk': self.thread.pk}))
+        self.assertNotContains(response, 'data-thread-stream-url-value')
+        self.assertContains(response, f'action="{reverse("new_message", kwargs={"pk": self.thread.pk})}"')
+
     def test_thread_deletion(self):
         # Test that a thread can be deleted
         response = self.client.post(reverse('delete_thread', kwargs={'pk': self.thread.pk}))
@@ -1,6 +1,11 @@
-from django.test import TestCase
+import threading
+from django.test import TestCase, override_settings
+from chat.ai import agent as agent_module
 from chat.ai.agent import Agent
-from unittest.mock import MagicMock
+from chat.ai.semantic_cache import SemanticCache
+from chat.limiter import AdaptiveLimiter
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
 from .vcr_config import vcr
 
 
@@ -15,3 +20,136 @@ class TestAgent(TestCase):
     def test_chat(self):
         response = self.agent.chat("Hello, what is your name?")
         self.assertIn("Jarvis", response)
+
+    @patch("chat.ai.agent.client")
+    def test_chat_stream(self, client):
+        client.chat.completions.create.return_value = iter(
+            [
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=c))])
+                for c in ["My name ", "is Jarvis.", None]
+            ]
+        )
+        chunks = list(self.agent.chat("Hello, what is your name?", stream=True))
+        self.assertEqual(chunks, ["My name ", "is Jarvis."])
+        self.assertEqual(
+            self.agent.history[-1], {"role": "assistant", "content": "My name is Jarvis."}
+        )
+        self.assertTrue(client.chat.completions.create.call_args.kwargs["stream"])
+
+    @patch("chat.ai.agent.client")
+    def test_stream_holds_slot_until_consumed(self, client):
+        limiter = AdaptiveLimiter(max_limit=4)
+        client.chat.completions.create.return_value = iter(["Hi", "!"])
+        with patch("chat.ai.agent.get_limiter", return_value=limiter):
+            completion = agent_module._create_completion(model="gpt-4o", messages=[], stream=True)
+            self.assertEqual(limiter.in_flight, 1)
+            self.assertEqual(list(completion), ["Hi", "!"])
+            self.assertEqual(limiter.in_flight, 0)
+
+            # A stream closed before it is read also frees its slot
+            completion = agent_module._create_completion(model="gpt-4o", messages=[], stream=True)
+            completion.close()
+            self.assertEqual(limiter.in_flight, 0)
+
+
+@patch("chat.ai.tokens.get_encoding", return_value=None)  # ~4 characters per token
+class TestAgentContextWindow(TestCase):
+    def setUp(self):
+        self.agent = Agent(max_history_tokens=50)
+        # Each message is 10 tokens plus 4 tokens of chat formatting
+        self.agent.history = [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"{i:02d}" * 20}
+            for i in range(10)
+        ]
+
+    def test_keeps_newest_history_within_budget(self, get_encoding):
+        messages = self.agent._prepare_messages("Hi", "You are Jarvis.")
+        self.assertEqual(messages[0], {"role": "system", "content": "You are Jarvis."})
+        self.assertEqual(messages[1:-1], self.agent.history[-3:])
+        self.assertEqual(messages[-1], {"role": "user", "content": "Hi"})
+
+    def test_truncates_oldest_kept_message(self, get_encoding):
+        self.agent.history = [
+            {"role": "user", "content": "a" * 400},
+            {"role": "assistant", "content": "b" * 40},
+        ]
+        messages = self.agent._prepare_messages("Hi", None)
+        # 36 tokens remain after the newest message and formatting overhead
+        self.assertEqual(messages[0], {"role": "user", "content": "a" * 32 * 4})
+        self.assertEqual(messages[1:], [self.agent.history[-1], {"role": "user", "content": "Hi"}])
+
+    @override_settings(DEFAULT_CONTEXT_WINDOW=1100, AGENT_REPLY_TOKENS=1024)
+    def test_respects_model_context_window(self, get_encoding):
+        self.agent.max_history_tokens = 1000
+        messages = self.agent._prepare_messages("Hi", None, model="unknown-model")
+        # 76 tokens remain after the reply and the new message (5 tokens)
+        self.assertEqual(messages[:-1], self.agent.history[-5:])
+
+    @override_settings(AGENT_HISTORY_TOKENS=1234)
+    def test_default_budget(self, get_encoding):
+        self.assertEqual(Agent().max_history_tokens, 1234)
+
+
+@override_settings(SEMANTIC_CACHE=True)
+@patch("chat.ai.agent.client")
+class TestAgentSemanticCache(TestCase):
+    def setUp(self):
+        patcher = patch("chat.ai.agent.semantic_cache", SemanticCache(threshold=0.9))
+        self.cache = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def configure(self, client, embedding, reply="Paris."):
+        client.embeddings.create.return_value = SimpleNamespace(
+            data=[SimpleNamespace(embedding=embedding)]
+        )
+        client.chat.completions.create.return_value = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=reply))]
+        )
+
+    def test_similar_message_is_served_from_cache(self, client):
+        self.configure(client, [1.0, 0.0])
+        self.assertEqual(Agent(prompt="You are a tutor.").chat("Capital of France?"), "Paris.")
+        self.configure(client, [0.99, 0.05], reply="Not cached")
+        self.assertEqual(Agent(prompt="You are a tutor.").chat("France's capital?"), "Paris.")
+        client.chat.completions.create.assert_called_once()
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_cache_is_scoped_to_prompt(self, client):
+        self.configure(client, [1.0, 0.0])
+        Agent(prompt="You are a tutor.").chat("Capital of France?")
+        self.configure(client, [1.0, 0.0], reply="Paris, in verse.")
+        self.assertEqual(Agent(prompt="You are a poet.").chat("Capital of France?"), "Paris, in verse.")
+
+    def test_streamed_replies_are_cached(self, client):
+        self.configure(client, [1.0, 0.0])
+        client.chat.completions.create.return_value = iter(
+            [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=c))]) for c in ["Par", "is."]]
+        )
+        self.assertEqual("".join(Agent().chat("Capital of France?", stream=True)), "Paris.")
+        self.assertEqual(list(Agent().chat("Capital of France?", stream=True)), ["Paris."])
+        client.chat.completions.create.assert_called_once()
+
+
+class TestAgentClients(TestCase):
+    def setUp(self):
+        patcher = patch.multiple(agent_module, client=None, _endpoint_clients={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch("chat.ai.agent._create_client")
+    def test_client_is_created_once_on_first_use(self, create_client):
+        create_client.side_effect = lambda *args: object()
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(agent_module.get_client())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        create_client.assert_called_once_with()
+        self.assertEqual(len(set(map(id, clients))), 1)
+
+    @patch("chat.ai.agent._create_client", side_effect=lambda *args: object())
+    def test_forked_worker_creates_its_own_clients(self, create_client):
+        parent = agent_module.get_client()
+        agent_module._reset_after_fork()
+        self.assertIsNot(agent_module.get_client(), parent)
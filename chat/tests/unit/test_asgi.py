@@ -0,0 +1,26 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+from django.test import SimpleTestCase
+from aistarterkit import asgi
+
+
+class ApiApplicationTest(SimpleTestCase):
+    def call(self, path):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(asgi.api_application({'type': 'http', 'path': path}, AsyncMock(), send))
+        return sent
+
+    @patch('aistarterkit.asgi.application', new_callable=AsyncMock)
+    def test_serves_api_paths(self, application):
+        self.call('/chat/api/v1/chat/completions')
+        application.assert_awaited_once()
+
+    @patch('aistarterkit.asgi.application', new_callable=AsyncMock)
+    def test_leaves_other_paths_to_wsgi(self, application):
+        sent = self.call('/chat/1/stream/')
+        application.assert_not_awaited()
+        self.assertEqual(sent[0]['status'], 404)
@@ -0,0 +1,81 @@
+from unittest.mock import MagicMock, patch
+from django.test import SimpleTestCase, override_settings
+from chat import upstream
+from chat.balancer import Backend, Balancer, build_backends
+
+
+@override_settings(OPENAI_API_TYPE="azure", UPSTREAM_RETRIES=1, UPSTREAM_RETRY_BACKOFF=0)
+class BalancerTest(SimpleTestCase):
+    def setUp(self):
+        self.east = Backend("https://east.openai.azure.com", "east-key")
+        self.west = Backend("https://west.openai.azure.com", "west-key", deployments=["gpt-4o"])
+        self.balancer = Balancer([self.east, self.west], failure_threshold=2, cooldown=30)
+
+    def test_prefers_less_loaded_backend(self):
+        self.east.in_flight = 3
+        self.assertIs(self.balancer.choose("gpt-4o"), self.west)
+
+    def test_prefers_faster_backend(self):
+        self.east.latency, self.west.latency = 2.0, 0.5
+        self.assertIs(self.balancer.choose("gpt-4o"), self.west)
+
+    def test_only_routes_to_backends_serving_deployment(self):
+        self.east.in_flight = 3
+        self.assertIs(self.balancer.choose("gpt-35-turbo"), self.east)
+
+    def test_ejects_failing_backend_until_cooldown(self):
+        for _ in range(2):
+            with self.balancer.track(self.west) as outcome:
+                outcome.ok = False
+        self.east.in_flight = 10
+        self.assertIs(self.balancer.choose("gpt-4o"), self.east)
+        self.assertTrue(self.balancer.stats()[1]["ejected"])
+
+        with patch("chat.balancer.time.monotonic", return_value=self.west.ejected_until):
+            self.assertIs(self.balancer.choose("gpt-4o"), self.west)
+
+    def test_ignores_exceptions_that_are_not_failures(self):
+        with self.assertRaises(ValueError):
+            with self.balancer.track(self.east, is_failure=lambda exc: False):
+                raise ValueError
+        self.assertEqual(self.east.error_rate, 0.0)
+        self.assertEqual(self.east.in_flight, 0)
+
+    @override_settings(
+        AZURE_OPENAI_ENDPOINT="https://east.openai.azure.com/",
+        AZURE_OPENAI_API_KEY="east-key",
+        OPENAI_API_VERSION="1",
+        UPSTREAM_ENDPOINTS=[{"endpoint": "https://west.openai.azure.com/", "api_key": "west-key"}],
+    )
+    def test_routes_endpoint_with_trailing_slash(self):
+        balancer = Balancer(build_backends())
+        url, headers = upstream.resolve_endpoint("chat/completions", "gpt-4o")
+        self.assertEqual(url, "https://east.openai.azure.com/openai/deployments/gpt-4o/chat/completions?api-version=1")
+        self.assertIs(balancer.backend_for(url, headers), balancer.primary)
+        self.assertIsNotNone(balancer.route(url, headers)[2])
+
+    def test_route_rewrites_endpoint_and_key(self):
+        self.east.in_flight = 3
+        url = "https://east.openai.azure.com/openai/deployments/gpt-4o/chat/completions?api-version=1"
+        routed_url, headers, backend = self.balancer.route(url, {"api-key": "east-key", "Content-Type": "application/json"})
+        self.assertIs(backend, self.west)
+        self.assertEqual(
+            routed_url, "https://west.openai.azure.com/openai/deployments/gpt-4o/chat/completions?api-version=1"
+        )
+        self.assertEqual(headers, {"api-key": "west-key", "Content-Type": "application/json"})
+
+    def test_retry_is_routed_to_other_backend(self):
+        url = "https://east.openai.azure.com/openai/deployments/gpt-4o/chat/completions"
+        self.west.error_rate = 0.01  # Send the first attempt to east
+        session = MagicMock()
+        session.post.side_effect = [MagicMock(status_code=503, headers={}), MagicMock(status_code=200)]
+        with patch("chat.upstream.get_balancer", return_value=self.balancer), patch(
+            "chat.upstream.get_session", return_value=session
+        ):
+            response = upstream.post(url, json={}, headers={"api-key": "east-key"})
+
+        self.assertEqual(response.status_code, 200)
+        first, second = session.post.call_args_list
+        self.assertTrue(first.args[0].startswith("https://east."))
+        self.assertTrue(second.args[0].startswith("https://west."))
+        self.assertEqual(second.kwargs["headers"], {"api-key": "west-key"})
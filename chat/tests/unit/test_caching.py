@@ -0,0 +1,38 @@
+from unittest.mock import patch
+from django.test import TestCase
+from chat.caching import LRUCache
+
+
+class TestLRUCache(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_expires_entries_after_ttl(self):
+        cache = LRUCache(ttl=10)
+        with patch("chat.caching.time.monotonic", return_value=100):
+            cache.set("a", 1)
+        with patch("chat.caching.time.monotonic", return_value=105):
+            self.assertEqual(cache.get("a"), 1)
+        with patch("chat.caching.time.monotonic", return_value=111):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_stats(self):
+        cache = LRUCache(maxsize=10)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "size": 1, "maxsize": 10})
+
+    def test_pop(self):
+        cache = LRUCache()
+        cache.set("a", 1)
+        self.assertEqual(cache.pop("a"), 1)
+        self.assertIsNone(cache.pop("a"))
@@ -0,0 +1,39 @@
+from unittest.mock import MagicMock
+from django.conf import settings
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from chat.db import apply_pragmas, sqlite_pragmas
+
+
+class SQLitePragmasTest(TestCase):
+    def test_new_connections_are_tuned(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_BUSY_TIMEOUT)
+            cursor.execute("PRAGMA temp_store")
+            self.assertEqual(cursor.fetchone()[0], 2)  # MEMORY
+
+
+class ApplyPragmasTest(SimpleTestCase):
+    def make_connection(self, pragmas, vendor="sqlite"):
+        fake = MagicMock(vendor=vendor, settings_dict={"PRAGMAS": pragmas})
+        return fake, fake.cursor.return_value.__enter__.return_value
+
+    def test_busy_timeout_is_set_first(self):
+        self.assertEqual(list(sqlite_pragmas())[:2], ["busy_timeout", "journal_mode"])
+
+    def test_sets_pragmas_in_order(self):
+        fake, cursor = self.make_connection(sqlite_pragmas(busy_timeout=100))
+        apply_pragmas(fake)
+        statements = [call.args[0] for call in cursor.execute.call_args_list]
+        self.assertEqual(statements[:2], ["PRAGMA busy_timeout = 100", "PRAGMA journal_mode = WAL"])
+
+    def test_rejects_invalid_pragmas(self):
+        fake, _ = self.make_connection({"journal_mode": "WAL; DROP TABLE chat_message"})
+        with self.assertRaises(ValueError):
+            apply_pragmas(fake)
+
+    def test_ignores_other_databases(self):
+        fake, cursor = self.make_connection(sqlite_pragmas(), vendor="postgresql")
+        apply_pragmas(fake)
+        cursor.execute.assert_not_called()
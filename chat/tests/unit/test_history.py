@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from chat.ai.history import history_cache, load_history
+from chat.models import Message, Thread
+
+
+class TestHistory(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser', password='12345')
+        self.thread = Thread.objects.create(user=self.user)
+        self.create_message('user', 'Hello')
+        self.create_message('assistant', 'Hi there!')
+
+    def create_message(self, role, content):
+        return Message.objects.create(thread=self.thread, user=self.user, role=role, content=content)
+
+    def test_load_history(self):
+        self.assertEqual(
+            load_history(self.thread),
+            [{'role': 'user', 'content': 'Hello'}, {'role': 'assistant', 'content': 'Hi there!'}],
+        )
+
+    def test_load_fetches_only_new_messages(self):
+        load_history(self.thread)
+        # A message written elsewhere, e.g. by another worker process
+        self.create_message('user', 'Are you there?')
+        with self.assertNumQueries(1):
+            history = load_history(self.thread)
+        self.assertEqual(history[-1], {'role': 'user', 'content': 'Are you there?'})
+        self.assertEqual(history_cache.get(self.thread.pk)[1], history)
+
+    def test_load_picks_up_messages_of_interleaved_turns(self):
+        load_history(self.thread)
+        # Another worker's turn, then this worker's turn, before the next load
+        self.create_message('user', 'From another worker')
+        self.create_message('user', 'Tell me a joke')
+        self.assertEqual(
+            [entry['content'] for entry in load_history(self.thread)],
+            ['Hello', 'Hi there!', 'From another worker', 'Tell me a joke'],
+        )
+
+    def test_loaded_history_is_a_copy(self):
+        load_history(self.thread).append({'role': 'user', 'content': 'Not saved'})
+        self.assertEqual(len(load_history(self.thread)), 2)
+
+    def test_thread_delete_invalidates_history(self):
+        load_history(self.thread)
+        thread_id = self.thread.pk
+        self.thread.delete()
+        self.assertIsNone(history_cache.get(thread_id))
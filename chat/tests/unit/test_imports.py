@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+from django.conf import settings
+from django.test import SimpleTestCase
+
+# Imports a web worker does before its first request, then lists the loaded
+# heavy dependencies
+WORKER_STARTUP = """
+import json, sys
+import django
+django.setup()
+import aistarterkit.wsgi, chat.urls, chat.templatetags.markdown_filters, chat.jobs
+print(json.dumps(sorted(set(sys.modules) & {"openai", "numpy", "httpx", "tenacity", "bs4"})))
+"""
+
+
+class WorkerStartupTest(SimpleTestCase):
+    def test_heavy_dependencies_are_loaded_on_first_use(self):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE="aistarterkit.settings")
+        output = subprocess.run(
+            [sys.executable, "-c", WORKER_STARTUP],
+            env=env,
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        self.assertEqual(json.loads(output.splitlines()[-1]), [])
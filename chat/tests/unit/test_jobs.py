@@ -0,0 +1,97 @@
+from datetime import timedelta
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from chat import jobs
+from chat.models import Job, Thread
+
+
+@override_settings(JOB_MAX_ATTEMPTS=2, JOB_RETRY_DELAY=1, JOB_VISIBILITY_TIMEOUT=60)
+class JobQueueTest(TestCase):
+    def setUp(self):
+        self.calls = []
+        patcher = patch.dict(jobs.handlers, {"echo": self.echo, "fail": self.fail_job})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def echo(self, job):
+        self.calls.append(job.pk)
+        return job.payload
+
+    def fail_job(self, job):
+        raise ValueError("boom")
+
+    def test_runs_job_and_stores_result(self):
+        job = jobs.enqueue("echo", {"value": 1})
+        claimed = jobs.claim()
+        self.assertEqual((claimed.pk, claimed.status, claimed.attempts), (job.pk, Job.RUNNING, 1))
+        self.assertIsNone(jobs.claim())
+
+        jobs.run(claimed)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (Job.DONE, {"value": 1}))
+
+    def test_retries_failed_job_with_backoff_then_gives_up(self):
+        job = jobs.enqueue("fail", {})
+        jobs.run(jobs.claim())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.error, "ValueError: boom")
+        self.assertIsNone(jobs.claim())  # Not due before the retry delay
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        jobs.run(jobs.claim())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_reruns_job_after_visibility_timeout(self):
+        job = jobs.enqueue("echo", {})
+        stale = jobs.claim()
+        self.assertIsNone(jobs.claim())
+
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        claimed = jobs.claim()
+        self.assertEqual((claimed.pk, claimed.attempts), (job.pk, 2))
+
+        # The first worker's late result is ignored
+        jobs.run(stale)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.RUNNING)
+        self.assertEqual(self.calls, [job.pk])
+
+    def test_jobs_with_same_key_run_in_order(self):
+        first = jobs.enqueue("echo", {}, key="thread:1")
+        second = jobs.enqueue("echo", {}, key="thread:1")
+        other = jobs.enqueue("echo", {}, key="thread:2")
+
+        self.assertEqual(jobs.claim().pk, first.pk)
+        self.assertEqual(jobs.claim().pk, other.pk)
+        self.assertIsNone(jobs.claim())
+
+        jobs.run(Job.objects.get(pk=first.pk))
+        self.assertEqual(jobs.claim().pk, second.pk)
+
+    def test_worker_runs_due_jobs_until_empty(self):
+        for value in range(3):
+            jobs.enqueue("echo", {"value": value})
+        self.assertEqual(jobs.Worker().run_until_empty(), 3)
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 3)
+
+    @override_settings(JOB_RETENTION=60)
+    def test_purge_deletes_old_finished_jobs(self):
+        old = jobs.enqueue("echo", {})
+        recent = jobs.enqueue("echo", {})
+        queued = jobs.enqueue("echo", {})
+        Job.objects.filter(pk__in=[old.pk, recent.pk]).update(status=Job.DONE)
+        Job.objects.filter(pk__in=[old.pk, queued.pk]).update(
+            updated_at=timezone.now() - timedelta(hours=1)
+        )
+        self.assertEqual(jobs.purge(), 1)
+        self.assertFalse(Job.objects.filter(pk=old.pk).exists())
+
+    def test_enqueue_turn_keys_by_thread(self):
+        user = get_user_model().objects.create_user(email="jobs@test.com", password="12345")
+        thread = Thread.objects.create(name="Thread", user=user)
+        job = jobs.enqueue_turn(thread, "Hi!", user)
+        self.assertEqual(job.key, f"thread:{thread.pk}")
+        self.assertEqual(job.payload, {"thread": thread.pk, "content": "Hi!"})
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+from unittest.mock import patch
+from django.test import SimpleTestCase, override_settings
+from chat import limiter
+from chat.limiter import AdaptiveLimiter, ConcurrencyLimitExceeded
+
+
+class AdaptiveLimiterTest(SimpleTestCase):
+    def setUp(self):
+        self.limiter = AdaptiveLimiter(max_limit=4, min_limit=1, queue_timeout=0.05)
+
+    def test_halves_limit_when_throttled(self):
+        with self.limiter.slot() as outcome:
+            outcome.throttled = True
+        self.assertEqual(self.limiter.stats()["limit"], 2)
+
+    def test_decreases_once_per_latency(self):
+        self.limiter.latency = 10
+        for _ in range(2):
+            with self.limiter.slot() as outcome:
+                outcome.throttled = True
+        self.assertEqual(self.limiter.limit, 2)
+
+    def test_grows_back_while_healthy(self):
+        self.limiter.limit = 2
+        for _ in range(3):
+            self.limiter.acquire()
+            self.limiter.release(0.1, throttled=False)
+        self.assertGreaterEqual(self.limiter.stats()["limit"], 3)
+
+    def test_shrinks_on_latency_spikes(self):
+        self.limiter.latency = 0.1
+        self.limiter.acquire()
+        self.limiter.release(1.0, throttled=False)
+        self.assertEqual(self.limiter.limit, 3.6)
+
+    def test_exceptions_count_as_throttled(self):
+        with self.assertRaises(ConnectionError):
+            with self.limiter.slot():
+                raise ConnectionError
+        with self.assertRaises(ValueError):
+            with self.limiter.slot(is_throttled=lambda exc: isinstance(exc, ConnectionError)):
+                raise ValueError
+        self.assertEqual(self.limiter.stats()["limit"], 2)
+
+    def test_requests_over_limit_wait_until_timeout(self):
+        self.limiter.limit = 1
+        self.limiter.acquire()
+        with self.assertRaises(ConcurrencyLimitExceeded):
+            self.limiter.acquire()
+        self.assertEqual(self.limiter.stats(), {"limit": 1, "in_flight": 1, "queued": 0, "latency": None})
+
+    def test_released_slot_goes_to_waiting_request(self):
+        self.limiter.limit = 1
+        self.limiter.queue_timeout = 5
+        self.limiter.acquire()
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (self.limiter.acquire(), acquired.set()))
+        thread.start()
+        while self.limiter.queued == 0:
+            acquired.wait(0.001)
+        self.limiter.release(0.1, throttled=False)
+        thread.join()
+        self.assertTrue(acquired.is_set())
+        self.assertEqual(self.limiter.in_flight, 1)
+
+    def test_async_requests_wait_for_slot(self):
+        self.limiter.limit = 1
+        self.limiter.queue_timeout = 5
+
+        async def main():
+            await self.limiter.aacquire()
+            waiting = asyncio.ensure_future(self.limiter.aacquire())
+            await asyncio.sleep(0)
+            self.assertEqual(self.limiter.queued, 1)
+            self.limiter.release(0.1, throttled=False)
+            await waiting
+
+        asyncio.run(main())
+        self.assertEqual(self.limiter.in_flight, 1)
+
+    def test_cancelled_async_request_leaves_line(self):
+        self.limiter.limit = 1
+        self.limiter.queue_timeout = 5
+
+        async def main():
+            await self.limiter.aacquire()
+            waiting = asyncio.ensure_future(self.limiter.aacquire())
+            await asyncio.sleep(0)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+
+        asyncio.run(main())
+        self.assertEqual(self.limiter.stats()["queued"], 0)
+
+    @override_settings(UPSTREAM_ADAPTIVE_CONCURRENCY=True, UPSTREAM_CONCURRENCY_MAX=7)
+    def test_limiters_are_kept_per_endpoint_and_model(self):
+        with patch.object(limiter, "_limiters", {}):
+            east = limiter.get_limiter(("https://east", "gpt-4o"))
+            self.assertIs(limiter.get_limiter(("https://east", "gpt-4o")), east)
+            self.assertIsNot(limiter.get_limiter(("https://east", "gpt-4o-mini")), east)
+            self.assertEqual(limiter.stats()["https://east gpt-4o"]["limit"], 7)
+
+    @override_settings(UPSTREAM_ADAPTIVE_CONCURRENCY=False)
+    def test_can_be_disabled(self):
+        self.assertIsNone(limiter.get_limiter(("https://east", "gpt-4o")))
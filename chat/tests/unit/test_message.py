@@ -1,7 +1,10 @@
 # chat/tests/test_models.py
+import io
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from chat.models import Thread, Message
+from chat.rendering import RENDERER_VERSION
+from django.core.management import call_command
 from django.core.exceptions import ValidationError
 
 class MessageModelTest(TestCase):
@@ -21,4 +24,29 @@ class MessageModelTest(TestCase):
     def test_message_role_choices(self):
         message = Message(thread=self.thread, user=self.user, role='invalid_role')
         with self.assertRaises(ValidationError):
-            message.full_clean()
\ No newline at end of file
+            message.full_clean()
+
+    def test_message_html_rendered_on_save(self):
+        message = Message.objects.create(thread=self.thread, user=self.user, content='**Hi**')
+        message.refresh_from_db()
+        self.assertEqual(message.content_html, '<p><strong>Hi</strong></p>')
+        self.assertEqual(message.content_html_version, RENDERER_VERSION)
+        self.assertEqual(message.html, message.content_html)
+
+    def test_outdated_message_html_rendered_on_read(self):
+        message = Message.objects.create(thread=self.thread, user=self.user, content='**Hi**')
+        Message.objects.filter(pk=message.pk).update(content_html='', content_html_version=0)
+        message.refresh_from_db()
+        self.assertEqual(message.html, '<p><strong>Hi</strong></p>')
+
+    def test_render_messages_backfills_outdated_rows(self):
+        for content in ['*One*', '*Two*', '*Three*']:
+            Message.objects.create(thread=self.thread, user=self.user, content=content)
+        Message.objects.update(content_html='', content_html_version=0)
+        output = io.StringIO()
+        call_command('render_messages', chunk_size=2, stdout=output)
+        self.assertIn(f'Rendered 3 messages with renderer version {RENDERER_VERSION}', output.getvalue())
+        self.assertEqual(
+            list(Message.objects.order_by('pk').values_list('content_html', 'content_html_version')),
+            [(f'<p><em>{c}</em></p>', RENDERER_VERSION) for c in ['One', 'Two', 'Three']],
+        )
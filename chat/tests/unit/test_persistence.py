@@ -0,0 +1,139 @@
+import threading
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from chat.ai.agent import Agent
+from chat.ai.history import load_history
+from chat.ai.persistence import WriteBehindQueue, save_turn, write_turns
+from chat.models import Message, Thread
+
+
+class TestPersistence(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser', password='12345')
+        self.thread = Thread.objects.create(user=self.user)
+
+    def build_turn(self, thread, content):
+        return [
+            Message(thread=thread, user=self.user, role='user', content=content),
+            Message(thread=thread, user=self.user, role='assistant', content=f'Re: {content}'),
+        ]
+
+    def test_save_turn_is_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            save_turn(self.thread, self.build_turn(self.thread, 'Hello'))
+        inserts = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            list(self.thread.message_set.order_by('timestamp').values_list('role', 'content')),
+            [('user', 'Hello'), ('assistant', 'Re: Hello')],
+        )
+
+    def test_written_turns_are_in_cached_history(self):
+        save_turn(self.thread, self.build_turn(self.thread, 'Hello'))
+        load_history(self.thread)
+        write_turns([(self.thread, self.build_turn(self.thread, 'Again'))])
+        with self.assertNumQueries(1):
+            self.assertEqual(len(load_history(self.thread)), 4)
+
+    def test_failed_turn_saves_nothing(self):
+        turn = self.build_turn(self.thread, 'Hello')
+        turn[1].thread = None
+        with self.assertRaises(Exception):
+            save_turn(self.thread, turn)
+        self.assertFalse(self.thread.message_set.exists())
+
+    @patch('chat.ai.agent.client')
+    def test_agent_saves_turn_once(self, client):
+        client.chat.completions.create.return_value.choices[0].message.content = 'Hi!'
+        agent = Agent(thread=self.thread)
+        with patch('chat.ai.agent.save_turn') as save:
+            agent.chat('Hello')
+        save.assert_called_once()
+        thread, messages = save.call_args.args
+        self.assertEqual([(m.role, m.content) for m in messages], [('user', 'Hello'), ('assistant', 'Hi!')])
+
+
+class TestWriteBehind(TransactionTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser', password='12345')
+        self.threads = [Thread.objects.create(user=self.user) for _ in range(3)]
+        self.queue = WriteBehindQueue(batch_size=10, interval=0.5)
+
+    def build_turn(self, thread, content):
+        return [
+            Message(thread=thread, user=self.user, role='user', content=content),
+            Message(thread=thread, user=self.user, role='assistant', content=f'Re: {content}'),
+        ]
+
+    def test_batches_queued_turns(self):
+        with patch('chat.ai.persistence.write_turns', wraps=write_turns) as write:
+            for i, thread in enumerate(self.threads):
+                self.queue.submit(thread, self.build_turn(thread, f'Hello {i}'))
+            self.assertEqual(len(self.queue.pending(self.threads[0].pk)), 2)
+            self.queue.flush()
+        write.assert_called_once()
+        self.assertEqual(Message.objects.count(), 6)
+        self.assertEqual(self.queue.pending(self.threads[0].pk), [])
+
+    @override_settings(MESSAGE_WRITE_BEHIND=True)
+    def test_agent_includes_queued_turns(self):
+        thread = self.threads[0]
+        with patch('chat.ai.persistence.write_behind', self.queue), \
+                patch('chat.ai.persistence.write_turns') as write:
+            save_turn(thread, self.build_turn(thread, 'Hello'))
+            agent = Agent(thread=thread)
+            self.queue.flush()
+        self.assertEqual(
+            agent.history,
+            [{'role': 'user', 'content': 'Hello'}, {'role': 'assistant', 'content': 'Re: Hello'}],
+        )
+        write.assert_called_once()
+
+    def test_failed_batch_writes_turns_one_by_one(self):
+        bad_turn = self.build_turn(self.threads[1], 'Bad')
+        bad_turn[1].thread = None  # Fails the insert of every batch it is in
+        queue = WriteBehindQueue(batch_size=10, interval=0.5, retries=1)
+        with patch('chat.ai.persistence.write_turns', wraps=write_turns) as write, \
+                self.assertLogs('chat.ai.persistence', 'ERROR'):
+            queue.submit(self.threads[0], self.build_turn(self.threads[0], 'Hello'))
+            queue.submit(self.threads[1], bad_turn)
+            queue.submit(self.threads[2], self.build_turn(self.threads[2], 'Hi'))
+            queue.flush()
+        # The batch, then each turn, then one retry of the bad turn
+        self.assertEqual(write.call_count, 5)
+        self.assertEqual(
+            sorted(Message.objects.values_list('content', flat=True)),
+            ['Hello', 'Hi', 'Re: Hello', 'Re: Hi'],
+        )
+        for thread in self.threads:
+            self.assertEqual(queue.pending(thread.pk), [])
+
+    def test_failed_turn_stays_pending_until_written(self):
+        written = threading.Event()
+        attempts = []
+
+        def flaky_write(turns):
+            attempts.append(len(turns))
+            if len(attempts) < 3:
+                raise OperationalError('database is locked')
+            write_turns(turns)
+            written.set()
+
+        queue = WriteBehindQueue(batch_size=10, interval=0.5, retries=3)
+        thread = self.threads[0]
+        with patch('chat.ai.persistence.write_turns', side_effect=flaky_write), \
+                self.assertLogs('chat.ai.persistence', 'ERROR'):
+            queue.submit(thread, self.build_turn(thread, 'Hello'))
+            while len(attempts) < 2:
+                time.sleep(0.01)
+            self.assertEqual(len(queue.pending(thread.pk)), 2)
+            queue.flush()
+        self.assertTrue(written.is_set())
+        self.assertEqual(attempts, [1, 1, 1])
+        self.assertEqual(Message.objects.filter(thread=thread).count(), 2)
+        self.assertEqual(queue.pending(thread.pk), [])
@@ -0,0 +1,40 @@
+from django.test import SimpleTestCase
+from chat.rendering import render_markdown
+from chat.templatetags.markdown_filters import enhance_markdown_html, markdown_to_html
+
+SAMPLES = [
+    'Hello',
+    'Para one\n\nPara two',
+    '# Title\n\nSome *text* & "quotes" &copy; &#169; &foo; AT&T\n\n---\n\nend  \nline',
+    '- a\n- b\n  - c\n\n1. x\n2. y',
+    '```python\nif a < b and c > d & e:\n    print("hi", \'x\')\n```\n\ntext',
+    '```\nplain\n```\n\n    indented <code>\n\nend',
+    '> quote\n> more\n\nafter',
+    'Inline `code <b>` [link](http://x.com?a=1&b=2 "title") ![img](a.png) <me@x.com>',
+    '<span>inline html</span>\n\nsecond',
+    '3. start\n4. next\n\n## h2\n### h3',
+]
+
+
+class TestRendering(SimpleTestCase):
+    def test_matches_beautifulsoup_enhanced_html(self):
+        for sample in SAMPLES:
+            for language in [None, 'python']:
+                with self.subTest(sample=sample, language=language):
+                    self.assertEqual(
+                        render_markdown(sample, language),
+                        enhance_markdown_html(markdown_to_html(sample), language),
+                    )
+
+    def test_margin_classes(self):
+        self.assertEqual(
+            render_markdown('One\n\n```\ncode\n```\n\nTwo'),
+            '<p class="mb-4">One</p>\n<pre class="mb-4"><code>code\n</code></pre>\n<p>Two</p>',
+        )
+        self.assertEqual(render_markdown('Only one'), '<p>Only one</p>')
+
+    def test_raw_html_blocks_are_not_styled(self):
+        self.assertEqual(
+            render_markdown('<div><p>raw</p></div>\n\ntext'),
+            '<div><p>raw</p></div>\n\n<p>text</p>',
+        )
@@ -0,0 +1,94 @@
+import os
+import tempfile
+from unittest.mock import patch
+from django.test import SimpleTestCase
+from chat.response_cache import ResponseCache, request_cache_key
+
+
+class RequestCacheKeyTest(SimpleTestCase):
+    def setUp(self):
+        self.request_data = {
+            "model": "gpt-3.5-turbo",
+            "messages": [{"role": "user", "content": "Hello"}],
+            "temperature": 0,
+        }
+
+    def test_key_ignores_key_order(self):
+        reordered = dict(reversed(list(self.request_data.items())))
+        self.assertEqual(
+            request_cache_key("chat/completions", self.request_data),
+            request_cache_key("chat/completions", reordered),
+        )
+
+    def test_key_depends_on_model_and_path(self):
+        key = request_cache_key("chat/completions", self.request_data)
+        self.assertNotEqual(
+            key, request_cache_key("chat/completions", {**self.request_data, "model": "gpt-4"})
+        )
+        self.assertNotEqual(key, request_cache_key("completions", self.request_data))
+
+    def test_nondeterministic_requests_are_not_cached(self):
+        for changes in [{"temperature": 0.7}, {"stream": True}, {"n": 2}]:
+            self.assertIsNone(
+                request_cache_key("chat/completions", {**self.request_data, **changes})
+            )
+        del self.request_data["temperature"]
+        self.assertIsNone(request_cache_key("chat/completions", self.request_data))
+
+
+class ResponseCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "responses.sqlite3")
+        self.cache = ResponseCache(self.path, maxsize=2, ttl=60)
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", b'{"id": 1}')
+        self.assertEqual(self.cache.get("a"), b'{"id": 1}')
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+
+    def test_survives_restart(self):
+        self.cache.set("a", b"{}")
+        self.assertEqual(ResponseCache(self.path).get("a"), b"{}")
+
+    def test_entries_expire(self):
+        with patch("chat.response_cache.time.time", return_value=1000):
+            self.cache.set("a", b"{}")
+        with patch("chat.response_cache.time.time", return_value=1059):
+            self.assertEqual(self.cache.get("a"), b"{}")
+        with patch("chat.response_cache.time.time", return_value=1061):
+            self.assertIsNone(self.cache.get("a"))
+
+    def test_evicts_least_recently_used(self):
+        with patch("chat.response_cache.time.time", side_effect=[1, 2, 3, 4, 5, 5, 5]):
+            self.cache.set("a", b"{}")
+            self.cache.set("b", b"{}")
+            self.cache.get("a")
+            self.cache.set("c", b"{}")
+            self.assertIsNone(self.cache.get("b"))
+            self.assertIsNotNone(self.cache.get("a"))
+            self.assertIsNotNone(self.cache.get("c"))
+
+    def test_other_worker_waits_for_claimed_key(self):
+        other_worker = ResponseCache(self.path)
+        self.assertTrue(self.cache.claim("a", timeout=10))
+        self.assertFalse(other_worker.claim("a", timeout=10))
+        self.assertEqual(other_worker.poll("a"), (None, True))
+
+        self.cache.set("a", b"{}")
+        self.cache.release("a")
+        self.assertEqual(other_worker.wait("a", timeout=10), b"{}")
+
+    def test_failed_claim_stops_waiting(self):
+        self.assertTrue(self.cache.claim("a", timeout=10))
+        self.cache.release("a")
+        self.assertIsNone(self.cache.wait("a", timeout=10))
+
+    def test_claims_lapse(self):
+        with patch("chat.response_cache.time.time", return_value=1000):
+            self.assertTrue(self.cache.claim("a", timeout=10))
+        with patch("chat.response_cache.time.time", return_value=1011):
+            self.assertTrue(self.cache.claim("a", timeout=10))
@@ -0,0 +1,41 @@
+from unittest.mock import patch
+from django.test import SimpleTestCase
+from chat.ai.semantic_cache import SemanticCache, semantic_scope
+
+
+class SemanticCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.cache = SemanticCache(maxsize=2, threshold=0.9)
+        self.scope = semantic_scope("gpt-4o", 0, [{"role": "system", "content": "You are a tutor."}])
+
+    def test_serves_similar_messages(self):
+        self.cache.add(self.scope, [1.0, 0.0], "Paris")
+        self.assertEqual(self.cache.lookup(self.scope, [0.99, 0.1]), "Paris")
+        self.assertIsNone(self.cache.lookup(self.scope, [0.5, 0.5]))
+        self.assertEqual(self.cache.stats()["hit_rate"], 0.5)
+
+    def test_returns_most_similar_reply(self):
+        self.cache.add(self.scope, [1.0, 0.0], "Paris")
+        self.cache.add(self.scope, [0.0, 1.0], "Rome")
+        self.assertEqual(self.cache.lookup(self.scope, [0.1, 0.99]), "Rome")
+
+    def test_scopes_are_separate(self):
+        other = semantic_scope("gpt-4o", 0, [{"role": "system", "content": "You are a poet."}])
+        self.cache.add(self.scope, [1.0, 0.0], "Paris")
+        self.assertIsNone(self.cache.lookup(other, [1.0, 0.0]))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.add(self.scope, [1.0, 0.0], "Paris")
+        self.cache.add(self.scope, [0.0, 1.0], "Rome")
+        self.cache.lookup(self.scope, [1.0, 0.0])
+        self.cache.add(self.scope, [-1.0, 0.0], "Oslo")
+        self.assertIsNone(self.cache.lookup(self.scope, [0.0, 1.0]))
+        self.assertEqual(self.cache.lookup(self.scope, [1.0, 0.0]), "Paris")
+        self.assertEqual(len(self.cache), 2)
+
+    def test_replies_expire(self):
+        self.cache.ttl = 60
+        with patch("chat.ai.semantic_cache.time.monotonic", return_value=1000):
+            self.cache.add(self.scope, [1.0, 0.0], "Paris")
+        with patch("chat.ai.semantic_cache.time.monotonic", return_value=1061):
+            self.assertIsNone(self.cache.lookup(self.scope, [1.0, 0.0]))
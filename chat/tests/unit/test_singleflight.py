@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+from django.test import SimpleTestCase
+from chat.singleflight import SingleFlight
+
+
+class SingleFlightTest(SimpleTestCase):
+    def setUp(self):
+        self.flights = SingleFlight()
+
+    def run_concurrently(self, fn, count=5):
+        started = threading.Barrier(count)
+        results = []
+
+        def call():
+            started.wait()
+            try:
+                results.append(self.flights.do("key", fn))
+            except ValueError as exc:
+                results.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def slow_call(self, result):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            # Wait until the other threads have joined the call
+            while self.flights.stats()["shared"] < 4:
+                time.sleep(0.01)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        return fn, calls
+
+    def test_concurrent_calls_share_one_call(self):
+        fn, calls = self.slow_call("reply")
+        self.assertEqual(self.run_concurrently(fn), ["reply"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.flights.stats(), {"calls": 1, "shared": 4, "in_flight": 0})
+
+    def test_errors_are_shared(self):
+        error = ValueError("upstream failed")
+        fn, calls = self.slow_call(error)
+        self.assertEqual(self.run_concurrently(fn), [error] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_sequential_calls_are_not_shared(self):
+        self.assertEqual(self.flights.do("key", lambda: 1), 1)
+        self.assertEqual(self.flights.do("key", lambda: 2), 2)
+
+    def test_concurrent_async_calls_share_one_call(self):
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "reply"
+
+        async def main():
+            return await asyncio.gather(*[self.flights.ado("key", fn) for _ in range(5)])
+
+        self.assertEqual(asyncio.run(main()), ["reply"] * 5)
+        self.assertEqual(len(calls), 1)
@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from chat.authentication import BearerAuthentication, token_cache
+
+
+class TestBearerAuthentication(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = get_user_model().objects.create_user(email='testuser', password='12345')
+        self.token = Token.objects.create(user=self.user)
+
+    def authenticate(self, key=None):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {key or self.token.key}')
+        return BearerAuthentication().authenticate(request)
+
+    def test_authenticated_token_is_cached(self):
+        before = token_cache.stats()
+        self.assertEqual(self.authenticate(), (self.user, self.token.key))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(), (self.user, self.token.key))
+        after = token_cache.stats()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+
+    def test_requests_get_their_own_user(self):
+        first, _ = self.authenticate()
+        first.first_name = 'Changed'
+        second, _ = self.authenticate()
+        self.assertIsNot(first, second)
+        self.assertEqual(second.pk, self.user.pk)
+        self.assertEqual(second.first_name, '')
+
+    def test_unknown_token_is_not_cached(self):
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate('unknown')
+        self.assertEqual(len(token_cache), 0)
+
+    def test_deleted_token_is_rejected(self):
+        self.authenticate()
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_regenerated_token_replaces_old_one(self):
+        self.authenticate()
+        old_key = self.token.key
+        self.token.delete()
+        new_token = Token.objects.create(user=self.user)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(old_key)
+        self.assertEqual(self.authenticate(new_token.key), (self.user, new_token.key))
+
+    def test_deactivated_user_is_rejected(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
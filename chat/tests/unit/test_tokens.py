@@ -0,0 +1,18 @@
+from unittest.mock import patch
+from django.test import TestCase
+from chat.ai import tokens
+
+
+class TestTokens(TestCase):
+    @patch("chat.ai.tokens.get_encoding", return_value=None)
+    def test_estimates_without_encoding(self, get_encoding):
+        self.assertEqual(tokens.count_tokens("abcdefghi", "gpt-4o"), 3)
+        self.assertEqual(tokens.count_message_tokens({"role": "user", "content": "abcd"}, "gpt-4o"), 5)
+        self.assertEqual(tokens.truncate_tokens("abcdefghij", 2, "gpt-4o"), "cdefghij")
+        self.assertEqual(tokens.truncate_tokens("abcdefghij", 0, "gpt-4o"), "")
+
+    def test_truncate_keeps_end_of_text(self):
+        text = " ".join(str(i) for i in range(1000))
+        truncated = tokens.truncate_tokens(text, 50, "gpt-4o")
+        self.assertTrue(text.endswith(truncated))
+        self.assertLessEqual(tokens.count_tokens(truncated, "gpt-4o"), 50)
@@ -0,0 +1,219 @@
+import asyncio
+import threading
+import time
+import httpx
+import requests
+from unittest.mock import MagicMock, patch
+from django.test import TestCase, override_settings
+from chat import upstream
+from chat.limiter import AdaptiveLimiter
+
+
+def upstream_response(status_code, headers=None):
+    return MagicMock(status_code=status_code, headers=headers or {})
+
+
+class TestUpstream(TestCase):
+    @override_settings(
+        OPENAI_API_TYPE="azure",
+        AZURE_OPENAI_ENDPOINT="https://example.openai.azure.com",
+        AZURE_OPENAI_API_KEY="azure-key",
+        OPENAI_API_VERSION="2024-10-21",
+    )
+    def test_resolve_endpoint_azure(self):
+        endpoint, headers = upstream.resolve_endpoint("chat/completions", "gpt-4o")
+        self.assertEqual(
+            endpoint,
+            "https://example.openai.azure.com/openai/deployments/gpt-4o/chat/completions?api-version=2024-10-21",
+        )
+        self.assertEqual(headers, {"api-key": "azure-key"})
+
+    @override_settings(OPENAI_API_TYPE="openai", OPENAI_API_KEY="openai-key")
+    def test_resolve_endpoint_openai(self):
+        endpoint, headers = upstream.resolve_endpoint("completions", "gpt-3.5-turbo")
+        self.assertEqual(endpoint, "https://api.openai.com/v1/completions")
+        self.assertEqual(headers, {"Authorization": "Bearer openai-key"})
+
+    def test_session_is_shared(self):
+        self.assertIs(upstream.get_session(), upstream.get_session())
+        self.assertIs(upstream.get_http_client(), upstream.get_http_client())
+
+    @override_settings(UPSTREAM_POOL_SIZE=4)
+    def test_session_pool_size(self):
+        with patch.object(upstream, "_session", None):
+            adapter = upstream.get_session().get_adapter("https://api.openai.com")
+            self.assertEqual(adapter._pool_maxsize, 4)
+
+    @override_settings(UPSTREAM_CONNECT_TIMEOUT=1, UPSTREAM_READ_TIMEOUT=30)
+    def test_post_applies_timeouts(self):
+        with patch.object(upstream.get_session(), "post") as post:
+            upstream.post("https://api.openai.com/v1/completions", json={})
+        post.assert_called_once_with(
+            "https://api.openai.com/v1/completions", json={}, timeout=(1, 30)
+        )
+
+
+@override_settings(UPSTREAM_RETRIES=2, UPSTREAM_RETRY_BACKOFF=0, UPSTREAM_RETRY_MAX_BACKOFF=5)
+class TestUpstreamRetries(TestCase):
+    url = "https://api.openai.com/v1/chat/completions"
+
+    def post(self, *responses):
+        with patch.object(upstream.get_session(), "post", side_effect=responses) as post:
+            response = upstream.post(self.url, json={})
+        return response, post.call_count
+
+    def test_retries_rate_limited_and_failed_requests(self):
+        ok = upstream_response(200)
+        response, calls = self.post(upstream_response(429), upstream_response(503), ok)
+        self.assertIs(response, ok)
+        self.assertEqual(calls, 3)
+
+    def test_returns_last_response_when_out_of_retries(self):
+        response, calls = self.post(*[upstream_response(500) for _ in range(3)])
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(calls, 3)
+
+    def test_does_not_retry_client_errors(self):
+        response, calls = self.post(upstream_response(400))
+        self.assertEqual(calls, 1)
+
+    def test_retries_connection_errors(self):
+        ok = upstream_response(200)
+        response, calls = self.post(requests.ConnectionError(), ok)
+        self.assertIs(response, ok)
+
+    def test_honours_retry_after(self):
+        with patch("tenacity.nap.time.sleep") as sleep:
+            self.post(upstream_response(429, {"retry-after": "2"}), upstream_response(200))
+        sleep.assert_called_once_with(2.0)
+
+    def test_does_not_wait_beyond_max_backoff(self):
+        response, calls = self.post(upstream_response(429, {"retry-after": "60"}))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(calls, 1)
+
+    def test_retry_after_formats(self):
+        self.assertEqual(upstream.retry_after(upstream_response(429, {"retry-after-ms": "1500"})), 1.5)
+        self.assertEqual(upstream.retry_after(upstream_response(429, {"retry-after": "3"})), 3.0)
+        self.assertEqual(
+            upstream.retry_after(upstream_response(429, {"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})), 0.0
+        )
+        self.assertIsNone(upstream.retry_after(upstream_response(429)))
+
+    def test_async_retries(self):
+        statuses = iter([429, 200])
+        transport = httpx.MockTransport(lambda request: httpx.Response(next(statuses), json={}))
+
+        async def post():
+            with patch.object(
+                upstream, "get_async_client", return_value=httpx.AsyncClient(transport=transport)
+            ):
+                return await upstream.apost(self.url, json={})
+
+        self.assertEqual(asyncio.run(post()).status_code, 200)
+
+
+@override_settings(UPSTREAM_HEDGE=True, UPSTREAM_HEDGE_MIN_DELAY=0.01)
+class TestUpstreamHedging(TestCase):
+    key = ("https://api.openai.com/v1/chat/completions", "gpt-4o")
+
+    def setUp(self):
+        upstream.latencies.clear()
+        self.addCleanup(upstream.latencies.clear)
+
+    def record_latencies(self, seconds=0.01):
+        for _ in range(upstream.HEDGE_MIN_SAMPLES):
+            upstream.latencies.record(self.key, seconds)
+
+    def slow_then_fast(self):
+        calls = []
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def fn():
+            calls.append(1)
+            if len(calls) == 1:
+                release.wait(5)
+                return "slow"
+            return "fast"
+
+        return fn, calls
+
+    def test_hedges_slow_calls(self):
+        self.record_latencies()
+        fn, calls = self.slow_then_fast()
+        start = time.monotonic()
+        self.assertEqual(upstream.hedge(self.key, fn), "fast")
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(calls), 2)
+
+    def test_does_not_hedge_without_enough_latencies(self):
+        self.assertEqual(upstream.hedge(self.key, lambda: "reply"), "reply")
+        self.assertIsNone(upstream.hedge_delay(self.key))
+
+    @override_settings(UPSTREAM_HEDGE=False)
+    def test_hedging_is_opt_in(self):
+        self.record_latencies()
+        self.assertIsNone(upstream.hedge_delay(self.key))
+
+    def test_hedge_delay_is_latency_quantile(self):
+        for i in range(100):
+            upstream.latencies.record(self.key, i / 10)
+        self.assertEqual(upstream.hedge_delay(self.key), 9.5)
+
+    def test_async_hedges_slow_calls(self):
+        self.record_latencies()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            if len(calls) == 1:
+                await asyncio.sleep(5)
+                return "slow"
+            return "fast"
+
+        async def hedge():
+            result = await upstream.ahedge(self.key, fn)
+            for task in list(upstream._background_tasks):
+                task.cancel()
+            return result
+
+        self.assertEqual(asyncio.run(hedge()), "fast")
+
+
+class TestUpstreamStreaming(TestCase):
+    url = "https://api.openai.com/v1/chat/completions"
+
+    def setUp(self):
+        self.limiter = AdaptiveLimiter(max_limit=4)
+        patcher = patch.object(upstream, "get_limiter", return_value=self.limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_streamed_response_holds_slot_until_closed(self):
+        with patch.object(upstream.get_session(), "post", return_value=upstream_response(200)):
+            response = upstream.post(self.url, json={"model": "gpt-4o"}, stream=True)
+        self.assertEqual(self.limiter.in_flight, 1)
+        response.close()
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    @override_settings(UPSTREAM_RETRIES=0)
+    def test_failed_streamed_response_releases_slot(self):
+        with patch.object(upstream.get_session(), "post", return_value=upstream_response(503)):
+            upstream.post(self.url, json={"model": "gpt-4o"}, stream=True)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_async_streamed_response_holds_slot_until_closed(self):
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, content=b"data: [DONE]\n\n"))
+
+        async def stream():
+            with patch.object(
+                upstream, "get_async_client", return_value=httpx.AsyncClient(transport=transport)
+            ):
+                response = await upstream.apost(self.url, stream=True, json={"model": "gpt-4o"})
+            self.assertEqual(self.limiter.in_flight, 1)
+            self.assertEqual(b"".join([chunk async for chunk in response.aiter_bytes()]), b"data: [DONE]\n\n")
+            await response.aclose()
+
+        asyncio.run(stream())
+        self.assertEqual(self.limiter.in_flight, 0)
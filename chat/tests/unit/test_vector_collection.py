@@ -1,3 +1,5 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
 from django.test import TestCase
 from .vcr_config import vcr
 from chat.ai.vector_collection import Document, VectorCollection
@@ -48,3 +50,50 @@ class TestVectorCollection(TestCase):
     def test_to_embed_str(self):
         doc = Document("1", {"text": "Hello, world!"})
         self.assertEqual(doc.to_embed_str(), '{"text": "Hello, world!"}')
+
+
+def embeddings_response(model, input):
+    # Returned out of order, as the API does not promise the input order
+    data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+    return SimpleNamespace(data=data[::-1])
+
+
+@patch("chat.ai.agent.client")
+@patch("chat.ai.vector_collection.get_chroma_client")
+class TestVectorCollectionBatching(TestCase):
+    def make_collection(self, get_chroma_client, client, **kwargs):
+        client.embeddings.create.side_effect = embeddings_response
+        chroma_collection = MagicMock()
+        get_chroma_client.return_value.get_or_create_collection.return_value = chroma_collection
+        return VectorCollection("test", **kwargs), chroma_collection
+
+    def test_add_many_embeds_in_batches(self, get_chroma_client, client):
+        collection, chroma_collection = self.make_collection(get_chroma_client, client, batch_size=2)
+        documents = [Document(i, {"text": "x" * i}) for i in range(5)]
+        self.assertEqual(collection.add_many(documents), 5)
+
+        self.assertEqual(client.embeddings.create.call_count, 3)
+        upserts = [call.kwargs for call in chroma_collection.upsert.call_args_list]
+        self.assertEqual([upsert["ids"] for upsert in upserts], [["0", "1"], ["2", "3"], ["4"]])
+        # Embeddings are matched to their documents by index
+        first = upserts[0]
+        self.assertEqual(first["embeddings"], [[float(len(text))] for text in first["documents"]])
+
+    def test_add_many_caps_batch_tokens(self, get_chroma_client, client):
+        collection, _ = self.make_collection(get_chroma_client, client, batch_tokens=50)
+        collection.add_many(Document(i, {"text": "word " * 30}) for i in range(3))
+        self.assertEqual(client.embeddings.create.call_count, 3)
+
+    def test_add_many_keeps_last_document_per_id(self, get_chroma_client, client):
+        collection, chroma_collection = self.make_collection(get_chroma_client, client)
+        collection.add_many([Document(1, {"v": 1}), Document(2, {"v": 2}), Document(1, {"v": 3})])
+        upsert = chroma_collection.upsert.call_args.kwargs
+        self.assertEqual(upsert["ids"], ["2", "1"])
+        self.assertEqual(upsert["documents"], ['{"v": 2}', '{"v": 3}'])
+
+    def test_search_returns_document_data(self, get_chroma_client, client):
+        collection, chroma_collection = self.make_collection(get_chroma_client, client)
+        chroma_collection.count.return_value = 1
+        chroma_collection.query.return_value = {"documents": [['{"text": "Hello"}']]}
+        self.assertEqual(collection.search("Hi", n_results=3), [{"text": "Hello"}])
+        self.assertEqual(chroma_collection.query.call_args.kwargs["n_results"], 1)
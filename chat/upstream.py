@@ -0,0 +1,545 @@
+"""This module contains the shared HTTP clients used to call the upstream API.
+
+Every request to Azure OpenAI or OpenAI goes through one pooled client per
+process, so connections (and their TCP/TLS handshakes) are reused across
+requests and a hung upstream is bounded by the configured timeouts.
+
+Rate limited (429) and failed (5xx) requests, and requests that could not
+connect, are retried up to UPSTREAM_RETRIES times with jittered exponential
+backoff, waiting as long as the response's Retry-After header asks. With
+UPSTREAM_HEDGE enabled, a non-streamed request still running after the 95th
+percentile of recent latencies is sent a second time, and whichever response
+arrives first is used. Each attempt is sent to the healthiest of the
+configured endpoints (see balancer.py), within the adaptive concurrency
+limit of that endpoint and model (see limiter.py).
+
+The HTTP and retry libraries are imported on the first request, so web
+workers and management commands that never call upstream do not load them.
+Typical usage example:
+
+    endpoint, headers = resolve_endpoint("chat/completions", "gpt-4o")
+    response = post(endpoint, json=data, headers=headers)
+"""
+
+import asyncio
+import email.utils
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import AsyncExitStack, ExitStack, asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from .balancer import get_balancer
+from .limiter import get_limiter
+
+# Statuses of responses worth retrying (rate limits and transient failures)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# The latency quantile after which a request is hedged, and the number of
+# latencies needed (out of the last LATENCY_WINDOW) before hedging starts
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+_lock = threading.Lock()
+_session = None
+_http_client = None
+_async_clients = weakref.WeakKeyDictionary()
+# Hedged requests left running after the other one answered
+_background_tasks = set()
+
+
+def resolve_endpoint(path, deployment_name=None):
+    """Builds the upstream URL and authentication headers for an API path.
+
+    Args:
+        path: A string containing the API path, e.g. "chat/completions".
+        deployment_name: A string containing the model or Azure deployment name.
+
+    Returns:
+        A tuple of the endpoint URL and a dictionary of headers.
+    """
+    if settings.OPENAI_API_TYPE == "azure":
+        # Azure endpoints are usually given with a trailing slash; the
+        # balancer's backends are matched without it
+        base_url = (settings.AZURE_OPENAI_ENDPOINT or "").rstrip("/")
+        endpoint = (
+            f"{base_url}/openai/deployments/{deployment_name}"
+            f"/{path}?api-version={settings.OPENAI_API_VERSION}"
+        )
+        headers = {"api-key": settings.AZURE_OPENAI_API_KEY}
+    else:
+        endpoint = f"https://api.openai.com/v1/{path}"
+        headers = {"Authorization": f"Bearer {settings.OPENAI_API_KEY}"}
+    return endpoint, headers
+
+
+def get_timeout():
+    """Returns the (connect, read) timeout tuple for upstream requests."""
+    return (settings.UPSTREAM_CONNECT_TIMEOUT, settings.UPSTREAM_READ_TIMEOUT)
+
+
+def get_session():
+    """Returns the process-wide requests session used by the passthrough views.
+
+    The session keeps up to UPSTREAM_POOL_SIZE keep-alive connections per host.
+    """
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        with _lock:
+            if _session is None:
+                adapter = HTTPAdapter(
+                    pool_connections=settings.UPSTREAM_POOL_SIZE,
+                    pool_maxsize=settings.UPSTREAM_POOL_SIZE,
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def retry_after(response):
+    """Returns the number of seconds a response asks to wait before retrying.
+
+    Azure sends the delay in milliseconds in a retry-after-ms header; the
+    standard Retry-After header holds seconds or an HTTP date.
+
+    Returns:
+        A float, or None if the response does not say.
+    """
+    value = response.headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def _should_retry(response):
+    if response.status_code not in RETRY_STATUSES:
+        return False
+    # Waiting longer than the backoff allows would only hold up the request
+    delay = retry_after(response)
+    return delay is None or delay <= settings.UPSTREAM_RETRY_MAX_BACKOFF
+
+
+class wait_retry_after:
+    """Waits as long as the response's Retry-After asks, else as fallback does."""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def __call__(self, retry_state):
+        outcome = retry_state.outcome
+        if outcome is not None and not outcome.failed:
+            delay = retry_after(outcome.result())
+            if delay is not None:
+                return delay
+        return self.fallback(retry_state)
+
+
+def _retry_options(connect_errors):
+    from tenacity import (
+        retry_if_exception_type,
+        retry_if_result,
+        stop_after_attempt,
+        wait_random_exponential,
+    )
+
+    # Settings are read on each request so they can be changed in tests
+    return dict(
+        stop=stop_after_attempt(settings.UPSTREAM_RETRIES + 1),
+        wait=wait_retry_after(
+            wait_random_exponential(
+                multiplier=settings.UPSTREAM_RETRY_BACKOFF,
+                max=settings.UPSTREAM_RETRY_MAX_BACKOFF,
+            )
+        ),
+        retry=retry_if_exception_type(connect_errors) | retry_if_result(_should_retry),
+        # Return the last response (or raise the last error) once out of retries
+        retry_error_callback=lambda retry_state: retry_state.outcome.result(),
+    )
+
+
+class LatencyTracker:
+    """Keeps the latest latencies of upstream requests, by key."""
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self.size = size
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.size)).append(seconds)
+
+    def quantile(self, key, q):
+        """Returns a quantile of the recorded latencies, or None if there are too few."""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+latencies = LatencyTracker()
+
+
+def hedge_delay(key):
+    """Returns the seconds after which a request is hedged, or None to not hedge."""
+    if not settings.UPSTREAM_HEDGE:
+        return None
+    delay = latencies.quantile(key, HEDGE_QUANTILE)
+    if delay is None:
+        return None
+    return max(delay, settings.UPSTREAM_HEDGE_MIN_DELAY)
+
+
+def _timed(key, fn):
+    start = time.monotonic()
+    result = fn()
+    latencies.record(key, time.monotonic() - start)
+    return result
+
+
+def hedge(key, fn):
+    """Calls fn, calling it a second time if the first call is slow.
+
+    The second call is made once the first has taken longer than the
+    hedge_delay of the key, and the result of whichever call completes first
+    without an error is returned. The other call keeps running in the
+    background.
+
+    Args:
+        key: A hashable grouping calls of similar latency, e.g. the endpoint
+             and model.
+        fn: A function without arguments making the call.
+
+    Returns:
+        The result of fn.
+    """
+    delay = hedge_delay(key)
+    if delay is None:
+        return _timed(key, fn)
+
+    results = queue.Queue()
+
+    def run():
+        try:
+            results.put((None, _timed(key, fn)))
+        except Exception as exc:
+            results.put((exc, None))
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        error, result = results.get(timeout=delay)
+    except queue.Empty:
+        threading.Thread(target=run, daemon=True).start()
+        error, result = results.get()
+        if error is not None:
+            error, result = results.get()
+    if error is not None:
+        raise error
+    return result
+
+
+async def _atimed(key, coroutine_fn):
+    start = time.monotonic()
+    result = await coroutine_fn()
+    latencies.record(key, time.monotonic() - start)
+    return result
+
+
+def _keep_in_background(task):
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    # Retrieve the exception so it is not logged as never retrieved
+    task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+
+async def ahedge(key, coroutine_fn):
+    """Awaits coroutine_fn(), awaiting it a second time if the first call is slow.
+
+    This is the async version of hedge.
+    """
+    delay = hedge_delay(key)
+    if delay is None:
+        return await _atimed(key, coroutine_fn)
+
+    first = asyncio.ensure_future(_atimed(key, coroutine_fn))
+    _keep_in_background(first)
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    second = asyncio.ensure_future(_atimed(key, coroutine_fn))
+    _keep_in_background(second)
+    pending = {first, second}
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                return task.result()
+    return first.result()
+
+
+def _hedge_key(url, kwargs):
+    data = kwargs.get("json")
+    return (url, data.get("model") if isinstance(data, dict) else None)
+
+
+def _route(url, kwargs):
+    """Sends each attempt of a request to the best endpoint for it."""
+    headers = kwargs.get("headers") or {}
+    routed_url, routed_headers, backend = get_balancer().route(url, headers)
+    if routed_headers is not headers:
+        kwargs = {**kwargs, "headers": routed_headers}
+    return routed_url, kwargs, backend
+
+
+def _limiter_for(url, kwargs, backend):
+    data = kwargs.get("json")
+    model = data.get("model") if isinstance(data, dict) else None
+    return get_limiter((backend.endpoint if backend is not None else url, model))
+
+
+class _Untracked:
+    ok = True
+    throttled = False
+
+
+@contextmanager
+def _tracked(backend):
+    if backend is None:
+        yield _Untracked()
+    else:
+        with get_balancer().track(backend) as outcome:
+            yield outcome
+
+
+@contextmanager
+def _slot(limiter):
+    if limiter is None:
+        yield _Untracked()
+    else:
+        with limiter.slot() as outcome:
+            yield outcome
+
+
+@asynccontextmanager
+async def _aslot(limiter):
+    if limiter is None:
+        yield _Untracked()
+    else:
+        async with limiter.aslot() as outcome:
+            yield outcome
+
+
+def _release_on_close(response, stack):
+    """Exits the contexts of a streamed request when its response is closed."""
+    close = response.close
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            stack.close()
+
+    response.close = close_and_release
+    return response
+
+
+def _send(url, kwargs):
+    url, kwargs, backend = _route(url, kwargs)
+    with ExitStack() as stack:
+        slot = stack.enter_context(_slot(_limiter_for(url, kwargs, backend)))
+        outcome = stack.enter_context(_tracked(backend))
+        response = get_session().post(url, **kwargs)
+        outcome.ok = response.status_code not in RETRY_STATUSES
+        slot.throttled = response.status_code == 429
+        if kwargs.get("stream") and outcome.ok:
+            # The request holds its slot until the body is read
+            return _release_on_close(response, stack.pop_all())
+    if kwargs.get("stream") and response.status_code in RETRY_STATUSES:
+        response.content  # Read the error so the connection is released
+    return response
+
+
+def post(url, **kwargs):
+    """Sends a POST request upstream through the pooled session.
+
+    Retryable failures are retried, and non-streamed requests are hedged.
+
+    Args:
+        url: A string containing the upstream URL.
+        **kwargs: Keyword arguments passed on to requests.Session.post. A
+                  streamed response must be closed with response.close(),
+                  which frees its place within the concurrency limit.
+
+    Returns:
+        A requests.Response instance.
+    """
+    import requests
+    from tenacity import Retrying
+
+    kwargs.setdefault("timeout", get_timeout())
+    retrying = Retrying(**_retry_options(requests.ConnectionError))
+    if kwargs.get("stream"):
+        return retrying(_send, url, kwargs)
+    return hedge(_hedge_key(url, kwargs), lambda: retrying(_send, url, kwargs))
+
+
+def get_httpx_timeout():
+    """Returns the upstream timeouts as an httpx.Timeout."""
+    import httpx
+
+    return httpx.Timeout(
+        settings.UPSTREAM_READ_TIMEOUT, connect=settings.UPSTREAM_CONNECT_TIMEOUT
+    )
+
+
+def get_httpx_limits():
+    """Returns the upstream connection pool limits as an httpx.Limits."""
+    import httpx
+
+    return httpx.Limits(
+        max_connections=settings.UPSTREAM_POOL_SIZE,
+        max_keepalive_connections=settings.UPSTREAM_POOL_SIZE,
+        keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_http_client():
+    """Returns the process-wide httpx client used by the OpenAI SDK clients."""
+    global _http_client
+    if _http_client is None:
+        import httpx
+
+        with _lock:
+            if _http_client is None:
+                _http_client = httpx.Client(
+                    timeout=get_httpx_timeout(), limits=get_httpx_limits()
+                )
+    return _http_client
+
+
+def get_async_client():
+    """Returns the httpx async client for the running event loop.
+
+    Under an ASGI server there is a single loop per worker process, so this is
+    one shared client; a client is never reused across event loops. Up to
+    UPSTREAM_ASYNC_MAX_CONNECTIONS requests can be in flight at once.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        import httpx
+
+        limits = httpx.Limits(
+            max_connections=settings.UPSTREAM_ASYNC_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.UPSTREAM_POOL_SIZE,
+            keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+        )
+        client = httpx.AsyncClient(timeout=get_httpx_timeout(), limits=limits)
+        _async_clients[loop] = client
+    return client
+
+
+def _arelease_on_close(response, stack):
+    """Exits the contexts of a streamed request when its response is closed."""
+    aclose = response.aclose
+
+    async def aclose_and_release():
+        try:
+            await aclose()
+        finally:
+            await stack.aclose()
+
+    response.aclose = aclose_and_release
+    return response
+
+
+async def _asend(url, stream, kwargs):
+    client = get_async_client()
+    url, kwargs, backend = _route(url, kwargs)
+    async with AsyncExitStack() as stack:
+        slot = await stack.enter_async_context(_aslot(_limiter_for(url, kwargs, backend)))
+        outcome = stack.enter_context(_tracked(backend))
+        if stream:
+            request = client.build_request("POST", url, **kwargs)
+            response = await client.send(request, stream=True)
+        else:
+            response = await client.post(url, **kwargs)
+        outcome.ok = response.status_code not in RETRY_STATUSES
+        slot.throttled = response.status_code == 429
+        if stream and outcome.ok:
+            # The request holds its slot until the body is read
+            return _arelease_on_close(response, stack.pop_all())
+    if stream and response.status_code in RETRY_STATUSES:
+        await response.aread()  # Read the error so the connection is released
+    return response
+
+
+async def apost(url, stream=False, **kwargs):
+    """Sends a POST request upstream through the pooled async client.
+
+    Retryable failures are retried, and non-streamed requests are hedged.
+
+    Args:
+        url: A string containing the upstream URL.
+        stream: If True, return once the response headers arrive; the body
+                is read with response.aiter_bytes() and the response must be
+                closed with response.aclose(), which frees its place within
+                the concurrency limit.
+        **kwargs: Keyword arguments passed on to httpx.AsyncClient.post.
+
+    Returns:
+        An httpx.Response instance.
+    """
+    import httpx
+    from tenacity import AsyncRetrying
+
+    retrying = AsyncRetrying(
+        **_retry_options((httpx.ConnectError, httpx.ConnectTimeout))
+    )
+    if stream:
+        return await retrying(_asend, url, stream, kwargs)
+    return await ahedge(
+        _hedge_key(url, kwargs), lambda: retrying(_asend, url, stream, kwargs)
+    )
+
+
+def _reset_after_fork():
+    """Drops the inherited clients so a forked worker opens its own connections."""
+    global _lock, _session, _http_client, _async_clients
+    _lock = threading.Lock()
+    _session = None
+    _http_client = None
+    _async_clients = weakref.WeakKeyDictionary()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,6 +1,16 @@
+from django.conf import settings
 from django.urls import path, re_path
 from . import views
 
+# The async passthrough views keep many slow upstream calls in flight per
+# worker when the app is served by an ASGI server.
+if settings.ASYNC_PASSTHROUGH:
+    chat_completions_view = views.async_openai_api_chat_completions_passthrough
+    completions_view = views.async_openai_api_completions_passthrough
+else:
+    chat_completions_view = views.openai_api_chat_completions_passthrough
+    completions_view = views.openai_api_completions_passthrough
+
 urlpatterns = [
     path("", views.thread_list, name="thread_list"),  # Add this line if needed
     path(
@@ -9,20 +19,32 @@ urlpatterns = [
     path(
         "thread/", views.create_thread, name="create_thread"
     ),  # POST request to create a new thread.
+    path(
+        "threads/", views.sidebar_threads, name="sidebar_threads"
+    ),  # GET request to render the sidebar threads after a cursor as an HTML fragment.
     path(
         "thread/<int:pk>/messages/", views.new_message, name="new_message"
     ),  # POST request to create a new message in a thread.
+    path(
+        "thread/<int:pk>/messages/history/", views.message_history, name="message_history"
+    ),  # GET request to render the messages before a cursor as an HTML fragment.
+    path(
+        "thread/<int:pk>/messages/stream/", views.stream_message, name="stream_message"
+    ),  # POST request to create a new message and stream the reply as server-sent events.
     path(
         "thread/<int:pk>/delete", views.delete_thread, name="delete_thread"
     ),  # DELETE request to delete a specific thread.
+    path(
+        "jobs/<int:pk>/", views.job_status, name="job_status"
+    ),  # GET request to retrieve the status of a background job, e.g. a chat turn.
     path(
         "api/v1/chat/completions",
-        views.openai_api_chat_completions_passthrough,
+        chat_completions_view,
         name="openai_api_chat_completions_passthrough",
     ),
     path(
         "api/v1/completions",
-        views.openai_api_completions_passthrough,
+        completions_view,
         name="openai_api_completions_passthrough",
     ),
     path("settings/", views.developer_settings, name="settings"),
@@ -1,14 +1,28 @@
-import requests
+import asyncio
+import json
 import os
-from .ai.agent import Agent  # Import the Agent class from the current app directory
-from .models import Thread, Message
+import time
+from functools import wraps
+from asgiref.sync import sync_to_async
+from . import upstream
+from .authentication import BearerAuthentication
+from .ai.persistence import pending_messages
+from .jobs import enqueue_turn
+from .limiter import ConcurrencyLimitExceeded
+from .models import Job, Thread, Message
+from .response_cache import request_cache_key, response_cache
+from .singleflight import flights
+from .sidebar import get_thread_page
 from .forms import MessageForm, ThreadForm
 from .forms import CustomUserAuthenticationForm
+from django.conf import settings
+from django.db.models import Q, Subquery
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import get_user_model
 from django.contrib.auth.views import LoginView
-from django.conf import settings
 from django.utils import timezone
 from django.views.decorators.http import require_POST
 from rest_framework.authtoken.models import Token
@@ -17,7 +31,6 @@ from rest_framework.decorators import (
     authentication_classes,
     permission_classes,
 )
-from rest_framework.authentication import BaseAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.exceptions import AuthenticationFailed
@@ -27,104 +40,296 @@ class CustomLoginView(LoginView):
     authentication_form = CustomUserAuthenticationForm
 
 
-class BearerAuthentication(BaseAuthentication):
-    def authenticate(self, request):
-        header = request.META.get("HTTP_AUTHORIZATION")
-        if not header:
-            return None
+def _stream_upstream_response(response):
+    """Relays a streamed upstream response chunk by chunk as it arrives."""
 
+    def relay():
         try:
-            token = header.split(" ")[1]
-        except IndexError:
-            raise AuthenticationFailed("Bearer token not provided")
+            # Started below, so closing the response before it is read still
+            # closes the upstream response (and frees its concurrency slot)
+            yield
+            yield from response.iter_content(chunk_size=None)
+        finally:
+            response.close()
+
+    chunks = relay()
+    next(chunks)
+    streaming_response = StreamingHttpResponse(
+        chunks,
+        status=response.status_code,
+        content_type=response.headers.get("Content-Type", "text/event-stream"),
+    )
+    streaming_response["Cache-Control"] = "no-cache"
+    streaming_response["X-Accel-Buffering"] = "no"  # Disable proxy buffering
+    return streaming_response
 
-        try:
-            user = get_user_model().objects.get(auth_token=token)
-        except get_user_model().DoesNotExist:
-            raise AuthenticationFailed("No such user")
 
-        return (user, token)
+def _response_cache_key(request, path, request_data):
+    """Returns the response cache key of an API request, or None to bypass the cache."""
+    if not settings.RESPONSE_CACHE:
+        return None
+    cache_control = request.headers.get("Cache-Control", "")
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return None
+    return request_cache_key(path, request_data)
 
 
-@api_view(["POST"])
-@authentication_classes([BearerAuthentication])
-@permission_classes([IsAuthenticated])
-def openai_api_chat_completions_passthrough(request):
-    # Get the request data and headers
+def _overloaded_response(exc):
+    """Returns the 429 response of a request that waited too long for upstream capacity."""
+    response = JsonResponse(
+        {"error": {"message": str(exc), "type": "rate_limit_exceeded"}}, status=429
+    )
+    response["Retry-After"] = "1"
+    return response
+
+
+def _cached_response(body):
+    response = HttpResponse(body, content_type="application/json")
+    response["X-Cache"] = "HIT"
+    return response
+
+
+def _flight_timeout():
+    return settings.UPSTREAM_CONNECT_TIMEOUT + settings.UPSTREAM_READ_TIMEOUT
+
+
+def _flight_key(path, request_data):
+    """Returns the key identical in-flight API requests are coalesced on, or None."""
+    if not settings.COALESCE_REQUESTS:
+        return None
+    return request_cache_key(path, request_data)
+
+
+def _post_once(endpoint, request_data, headers, cache_key):
+    """Posts an API request upstream and caches the response.
+
+    With the response cache enabled, only one worker at a time posts a
+    cacheable request; other workers wait for its response to be cached.
+
+    Returns:
+        The upstream response, or the cached response body.
+    """
+    claimed = False
+    if cache_key is not None and settings.COALESCE_REQUESTS:
+        claimed = response_cache.claim(cache_key, _flight_timeout())
+        if not claimed:
+            body = response_cache.wait(cache_key, _flight_timeout())
+            if body is not None:
+                return body
+    try:
+        response = upstream.post(endpoint, json=request_data, headers=headers, stream=False)
+        if cache_key is not None and response.status_code == 200:
+            response_cache.set(cache_key, response.content)
+    finally:
+        if claimed:
+            response_cache.release(cache_key)
+    return response
+
+
+async def _apost_once(endpoint, request_data, headers, cache_key):
+    """Posts an API request upstream and caches the response, like _post_once."""
+    claimed = False
+    if cache_key is not None and settings.COALESCE_REQUESTS:
+        claimed = await sync_to_async(response_cache.claim, thread_sensitive=False)(
+            cache_key, _flight_timeout()
+        )
+        deadline = time.monotonic() + _flight_timeout()
+        while not claimed and time.monotonic() < deadline:
+            body, in_flight = await sync_to_async(
+                response_cache.poll, thread_sensitive=False
+            )(cache_key)
+            if body is not None:
+                return body
+            if not in_flight:
+                break
+            await asyncio.sleep(0.05)
+    try:
+        response = await upstream.apost(endpoint, json=request_data, headers=headers)
+        if cache_key is not None and response.status_code == 200:
+            await sync_to_async(response_cache.set, thread_sensitive=False)(
+                cache_key, response.content
+            )
+    finally:
+        if claimed:
+            await sync_to_async(response_cache.release, thread_sensitive=False)(cache_key)
+    return response
+
+
+def _passthrough(request, path):
+    """Forwards an API request upstream, serving deterministic ones from the cache."""
     request_data = request.data
-    request_headers = request.META
 
-    # Extract the deployment name and API version from the request data
-    deployment_name = request_data.get(
-        "model", None
-    )  # Provide a default if not specified
-    api_version = settings.OPENAI_API_VERSION
+    # Extract the deployment name from the request data
+    deployment_name = request_data.get("model")
+
+    cache_key = _response_cache_key(request, path, request_data)
+    if cache_key is not None:
+        body = response_cache.get(cache_key)
+        if body is not None:
+            return _cached_response(body)
 
     # Determine the API key and endpoint based on configuration
-    if settings.OPENAI_API_TYPE == "azure":
-        api_key = settings.AZURE_OPENAI_API_KEY
-        endpoint = f"{settings.AZURE_OPENAI_ENDPOINT}/openai/deployments/{deployment_name}/chat/completions?api-version={api_version}"
-        headers = {
-            "Content-Type": request_headers.get("CONTENT_TYPE"),
-            "api-key": api_key,
-        }
-    else:
-        api_key = settings.OPENAI_API_KEY
-        endpoint = "https://api.openai.com/v1/chat/completions"
-        headers = {
-            "Content-Type": request_headers.get("CONTENT_TYPE"),
-            "Authorization": f"Bearer {api_key}",
-        }
+    endpoint, headers = upstream.resolve_endpoint(path, deployment_name)
+    headers["Content-Type"] = request.META.get("CONTENT_TYPE")
 
     # Forward the request to the appropriate API
-    response = requests.post(
-        endpoint,
-        json=request_data,
-        headers=headers,
-    )
+    try:
+        if request_data.get("stream"):
+            response = upstream.post(
+                endpoint,
+                json=request_data,
+                headers=headers,
+                stream=True,
+            )
+            return _stream_upstream_response(response)
+
+        # Identical requests in flight at the same time share one upstream call
+        flight_key = _flight_key(path, request_data)
+        if flight_key is None:
+            response = _post_once(endpoint, request_data, headers, cache_key)
+        else:
+            response = flights.do(
+                flight_key, lambda: _post_once(endpoint, request_data, headers, cache_key)
+            )
+    except ConcurrencyLimitExceeded as exc:
+        return _overloaded_response(exc)
+    if isinstance(response, bytes):
+        return _cached_response(response)
 
     # Return the API response
-    return Response(response.json())
+    api_response = Response(response.json())
+    if cache_key is not None:
+        api_response["X-Cache"] = "MISS"
+    return api_response
+
+
+@api_view(["POST"])
+@authentication_classes([BearerAuthentication])
+@permission_classes([IsAuthenticated])
+def openai_api_chat_completions_passthrough(request):
+    return _passthrough(request, "chat/completions")
 
 
 @api_view(["POST"])
 @authentication_classes([BearerAuthentication])
 @permission_classes([IsAuthenticated])
 def openai_api_completions_passthrough(request):
-    # Get the request data and headers
-    request_data = request.data
-    request_headers = request.META
+    return _passthrough(request, "completions")
 
-    # Extract the deployment name and API version from the request data
-    deployment_name = request_data.get("model")
-    api_version = settings.OPENAI_API_VERSION
 
-    # Determine the API key and endpoint based on configuration
-    if settings.OPENAI_API_TYPE == "azure":
-        api_key = settings.AZURE_OPENAI_API_KEY
-
-        endpoint = f"{settings.AZURE_OPENAI_ENDPOINT}/openai/deployments/{deployment_name}/completions?api-version={api_version}"
-        headers = {
-            "Content-Type": request_headers.get("CONTENT_TYPE"),
-            "api-key": api_key,
-        }
-    else:
-        api_key = settings.OPENAI_API_KEY
-        endpoint = "https://api.openai.com/v1/completions"
-        headers = {
-            "Content-Type": request_headers.get("CONTENT_TYPE"),
-            "Authorization": f"Bearer {api_key}",
-        }
+def async_api_view(view_func):
+    """Authenticates an async API view the way the DRF passthrough views do.
 
-    # Forward the request to the appropriate API
-    response = requests.post(
-        endpoint,
-        json=request_data,
-        headers=headers,
+    DRF's api_view does not support async views, so this applies
+    BearerAuthentication and IsAuthenticated to a plain async Django view.
+    """
+
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != "POST":
+            return JsonResponse(
+                {"detail": f'Method "{request.method}" not allowed.'}, status=405
+            )
+
+        try:
+            credentials = await sync_to_async(BearerAuthentication().authenticate)(
+                request
+            )
+        except AuthenticationFailed as exc:
+            return JsonResponse({"detail": str(exc.detail)}, status=401)
+        if credentials is None:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
+                status=401,
+            )
+
+        request.user, request.auth = credentials
+        return await view_func(request, *args, **kwargs)
+
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+async def _async_passthrough(request, path):
+    """Forwards an API request upstream without blocking the event loop."""
+    try:
+        return await _async_forward(request, path)
+    except ConcurrencyLimitExceeded as exc:
+        return _overloaded_response(exc)
+
+
+async def _async_forward(request, path):
+    """Forwards an API request upstream, serving deterministic ones from the cache."""
+    try:
+        request_data = json.loads(request.body)
+    except ValueError:
+        request_data = None
+    # API request bodies are JSON objects
+    if not isinstance(request_data, dict):
+        return JsonResponse({"detail": "JSON parse error."}, status=400)
+
+    cache_key = _response_cache_key(request, path, request_data)
+    if cache_key is not None:
+        body = await sync_to_async(response_cache.get, thread_sensitive=False)(cache_key)
+        if body is not None:
+            return _cached_response(body)
+
+    endpoint, headers = upstream.resolve_endpoint(path, request_data.get("model"))
+    headers["Content-Type"] = request.META.get("CONTENT_TYPE")
+
+    if not request_data.get("stream"):
+        flight_key = _flight_key(path, request_data)
+        if flight_key is None:
+            response = await _apost_once(endpoint, request_data, headers, cache_key)
+        else:
+            response = await flights.ado(
+                flight_key, lambda: _apost_once(endpoint, request_data, headers, cache_key)
+            )
+        if isinstance(response, bytes):
+            return _cached_response(response)
+
+        api_response = HttpResponse(
+            response.content,
+            status=response.status_code,
+            content_type=response.headers.get("Content-Type", "application/json"),
+        )
+        if cache_key is not None:
+            api_response["X-Cache"] = "MISS"
+        return api_response
+
+    response = await upstream.apost(
+        endpoint, stream=True, json=request_data, headers=headers
     )
 
-    # Return the API response
-    return Response(response.json())
+    async def relay():
+        try:
+            # Started below, like the sync relay
+            yield
+            async for chunk in response.aiter_bytes():
+                yield chunk
+        finally:
+            await response.aclose()
+
+    chunks = relay()
+    await chunks.__anext__()
+    streaming_response = StreamingHttpResponse(
+        chunks,
+        status=response.status_code,
+        content_type=response.headers.get("Content-Type", "text/event-stream"),
+    )
+    streaming_response["Cache-Control"] = "no-cache"
+    streaming_response["X-Accel-Buffering"] = "no"  # Disable proxy buffering
+    return streaming_response
+
+
+@async_api_view
+async def async_openai_api_chat_completions_passthrough(request):
+    return await _async_passthrough(request, "chat/completions")
+
+
+@async_api_view
+async def async_openai_api_completions_passthrough(request):
+    return await _async_passthrough(request, "completions")
 
 
 @login_required
@@ -208,21 +413,82 @@ def thread_list(request):
     return render(request, "chat/empty_state.html")
 
 
+@login_required
+def sidebar_threads(request):
+    try:
+        before = int(request.GET["before"])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("A numeric 'before' thread id is required.")
+    threads, has_more_threads = get_thread_page(request.user, before)
+    return render(
+        request,
+        "_sidebar_threads.html",
+        {"threads": threads, "has_more_threads": has_more_threads},
+    )
+
+
 @login_required
 def thread_detail(request, pk):
     # Check if the thread belongs to the user
     thread = get_object_or_404(Thread, pk=pk, user=request.user)
-    messages = thread.message_set.all()
+    messages, has_older = _message_page(thread)
+    # Show turns this worker has queued but not yet written
+    messages.extend(pending_messages(thread.pk))
     return render(
         request,
         "chat/thread_detail.html",
         {
             "thread": thread,
             "messages": messages,
+            "has_older": has_older,
+            # Queued replies are polled for, not streamed
+            "stream_replies": settings.CHAT_STREAMING
+            and not settings.CHAT_BACKGROUND_JOBS,
         },
     )
 
 
+@login_required
+def message_history(request, pk):
+    thread = get_object_or_404(Thread, pk=pk, user=request.user)
+    try:
+        before = int(request.GET["before"])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("A numeric 'before' message id is required.")
+    messages, has_older = _message_page(thread, before)
+    return render(
+        request,
+        "chat/_message_page.html",
+        {"thread": thread, "messages": messages, "has_older": has_older},
+    )
+
+
+def _message_page(thread, before=None):
+    """Gets a page of a thread's messages, ending before a cursor message.
+
+    Messages are ordered by timestamp and then id, so the page can be read in
+    order from the thread and timestamp index however long the thread is.
+
+    Args:
+        thread: The Thread to get the messages of.
+        before: The id of the oldest message already shown, or None for the
+                newest page.
+
+    Returns:
+        A tuple of the list of messages in chronological order and whether
+        there are older messages.
+    """
+    size = settings.THREAD_MESSAGES_PAGE_SIZE
+    messages = thread.message_set.order_by("-timestamp", "-pk")
+    if before is not None:
+        timestamp = Subquery(thread.message_set.filter(pk=before).values("timestamp"))
+        messages = messages.filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=before)
+        )
+    page = list(messages[: size + 1])
+    return page[:size][::-1], len(page) > size
+
+
 @login_required
 def create_thread(request):
     # Generate a default name for the thread, e.g., "Chat on <current date>"
@@ -253,12 +519,38 @@ def new_message(request, pk):
         thread_form = ThreadForm(
             request.POST, instance=thread
         )  # Pass the current thread instance
+        wants_fragment = request.headers.get("X-Requested-With") == "XMLHttpRequest"
         if form.is_valid() and thread_form.is_valid():
             message = form.save(commit=False)
             thread = thread_form.save()  # Save the thread form to update the thread
+            if settings.CHAT_BACKGROUND_JOBS:
+                # A `run_jobs` worker gets the reply; the page polls for it
+                job = enqueue_turn(thread, message.content, request.user)
+                if wants_fragment:
+                    return JsonResponse(
+                        {
+                            "job": job.pk,
+                            "status_url": reverse("job_status", args=[job.pk]),
+                        },
+                        status=202,
+                    )
+                return redirect("thread_detail", pk=thread.pk)
+            from .ai.agent import Agent  # Loads the OpenAI SDK on first use
+
             agent = Agent(thread=thread, prompt=thread.prompt)
             agent.chat(message.content)
+            if wants_fragment:
+                # Only the new messages, for the page to append
+                return HttpResponse(
+                    "".join(
+                        render_to_string("chat/_message.html", {"message": turn_message})
+                        for turn_message in agent.last_turn
+                    )
+                )
             return redirect("thread_detail", pk=thread.pk)
+        elif wants_fragment:
+            errors = {**form.errors.get_json_data(), **thread_form.errors.get_json_data()}
+            return JsonResponse({"errors": errors}, status=400)
         else:
             print(form.errors)
             print(thread_form.errors)
@@ -270,3 +562,65 @@ def new_message(request, pk):
         "chat/new_message.html",
         {"form": form, "thread_form": thread_form, "thread": thread},
     )
+
+
+@login_required
+def job_status(request, pk):
+    """Returns the status of a background job, with the rendered messages of a
+    finished chat turn."""
+    job = get_object_or_404(Job, pk=pk, user=request.user)
+    data = {"status": job.status}
+    if job.status == Job.DONE and job.kind == "agent_turn":
+        messages = Message.objects.filter(pk__in=job.result["messages"]).order_by("pk")
+        data["html"] = "".join(
+            render_to_string("chat/_message.html", {"message": message})
+            for message in messages
+        )
+    elif job.status == Job.FAILED:
+        data["error"] = "The assistant failed to respond."
+    return JsonResponse(data)
+
+
+def _sse_event(data, event=None):
+    """Formats a payload as a server-sent event."""
+    lines = []
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+@login_required
+@require_POST
+def stream_message(request, pk):
+    thread = get_object_or_404(Thread, pk=pk, user=request.user)
+    form = MessageForm(request.POST)
+    thread_form = ThreadForm(request.POST, instance=thread)
+    if not (form.is_valid() and thread_form.is_valid()):
+        errors = {**form.errors.get_json_data(), **thread_form.errors.get_json_data()}
+        return JsonResponse({"errors": errors}, status=400)
+
+    from openai import OpenAIError
+    from .ai.agent import Agent
+
+    message = form.save(commit=False)
+    thread = thread_form.save()
+    agent = Agent(thread=thread, prompt=thread.prompt)
+
+    def event_stream():
+        try:
+            for chunk in agent.chat(message.content, stream=True):
+                yield _sse_event({"delta": chunk})
+        except (OpenAIError, ConcurrencyLimitExceeded):
+            yield _sse_event({"error": "The assistant failed to respond."}, "error")
+            return
+
+        # The turn is saved once the stream completes; send the rendered reply
+        # so the client can swap the raw text for formatted markdown.
+        html = render_to_string("chat/_message.html", {"message": agent.last_turn[-1]})
+        yield _sse_event({"html": html}, "done")
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # Disable proxy buffering
+    return response
@@ -0,0 +1,55 @@
+"""Gunicorn settings, read from the environment.
+
+Gunicorn loads this file from the working directory, so `gunicorn` alone
+serves the app. The app spends most of each request waiting on the upstream
+LLM API, so by default each worker process serves GUNICORN_THREADS requests
+at once on threads (the gthread worker class) instead of one.
+Typical usage example:
+
+    GUNICORN_WORKERS=2 GUNICORN_THREADS=32 gunicorn
+    GUNICORN_APP=aistarterkit.asgi:api_application \
+        GUNICORN_WORKER_CLASS=uvicorn_worker.UvicornWorker gunicorn
+"""
+
+import multiprocessing
+import os
+import sys
+
+wsgi_app = os.getenv("GUNICORN_APP", "aistarterkit.wsgi:application")
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+
+# Threads share the memory of their worker, so a few processes with many
+# threads serve more concurrent requests than many single-threaded ones
+workers = int(os.getenv("GUNICORN_WORKERS", str(min(multiprocessing.cpu_count(), 4))))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+# Seconds a worker may be silent before it is restarted, seconds it has to
+# finish its requests on restart or shutdown, and seconds an idle keep-alive
+# connection is kept open
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Restart each worker after a (jittered) number of requests, so slow memory
+# growth is bounded and the workers do not all restart at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+# Load the app once in the master process, so workers start by forking it
+# and share the memory of the imported modules
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+
+# Each thread may hold an upstream connection; a smaller pool would make
+# threads wait for one
+os.environ.setdefault("UPSTREAM_POOL_SIZE", str(max(threads, 10)))
+
+
+def pre_fork(server, worker):
+    # Connections opened while preloading must not be shared with the workers
+    if "django.db" in sys.modules:
+        from django.db import connections
+
+        connections.close_all()